@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+import argparse, contextlib, json, math, os, sys, time, traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Set
+
+import harmonize
+
+# Harmonize a bunch of melodies without the server/client, e.g.
+#
+#   python batch.py src usertests -o harmonizations.jsonl
+#
+# Inputs are melody JSON files (like src/*.json) or saved client states (like
+# usertests/*.txt, which have the melody under "music" and the UI settings
+# next to it); directories are searched recursively. Each output line is
+#
+#   {"name": input path, "request": the request we made, minus the melody,
+#    "result": the "result" part of the server's response}
+#
+# or {"name", "error"} if it failed. Inputs already in the output file are
+# skipped, so rerunning the same command after an interruption picks up where
+# it left off.
+
+# the client's constants, to turn saved UI state into a request like it would
+CHORD_INCLUSION_TOLERANCE = 1.0e-6
+JAZZ_MAGNITUDE = 100
+FIRST_WEIGHT_MAX = 100
+MINORNESS_MAX = 100
+CHAOS_MAGNITUDE = 100
+
+def default_chord_length(music: dict) -> float:
+	# computeDefaultChordLength in the client
+	if music['timeSignature']['numerator'] % 3 == 0:
+		quarter_notes = 3
+	else:
+		quarter_notes = 2
+	return quarter_notes * music['tempoMicrosecondsPerQuarterNote'] / 1000000
+
+def request_for(data: dict) -> dict:
+	"""the request the client would send right after loading this file"""
+	if 'music' in data:
+		# saved client state
+		music = data['music']
+		return {
+			'seq': 0,
+			'music': music,
+			'mode': data['uiMode'],
+			'keySignature': data['uiKeySignature'],
+			'minorness': data['uiMinorness'] / MINORNESS_MAX,
+			'chordLength': data['defaultChordLength'],
+			'constraints': [{'time': rec['time'], 'value': rec['value']['value'], 'locked': rec['locked']} for rec in data['chords']],
+			'jazziness': data['uiJazz'] / JAZZ_MAGNITUDE,
+			'firstWeight': math.exp(data['uiFirstWeight'] / FIRST_WEIGHT_MAX * 8),
+			'determinismWeight': (1 - data['uiChaos'] / CHAOS_MAGNITUDE) ** 3,
+			'seed': data['seed'] if data['isRandom'] and data['seed'] else None,
+			'bottomBass': data['bottomBass'],
+			'tolerance': CHORD_INCLUSION_TOLERANCE,
+			'preserve': False,
+		}
+	else:
+		# just a melody, as freshly loaded from a MIDI file
+		music = data
+		return {
+			'seq': 0,
+			'music': music,
+			'mode': 'relative-minor' if music['mode'] == 'minor' else 'major',
+			'keySignature': music['keySignature'],
+			'minorness': 0.5,
+			'chordLength': default_chord_length(music),
+			'constraints': [],
+			'jazziness': 0.0,
+			'firstWeight': 1.0,
+			'determinismWeight': 1.0,
+			'seed': None,
+			'bottomBass': 48,
+			'tolerance': CHORD_INCLUSION_TOLERANCE,
+			'preserve': False,
+		}
+
+def find_inputs(paths: List[str]) -> List[str]:
+	ret = []
+	for path in paths:
+		if os.path.isdir(path):
+			for dirpath, dirnames, filenames in os.walk(path):
+				dirnames.sort()
+				ret.extend(os.path.join(dirpath, filename) for filename in sorted(filenames) if filename.endswith(('.json', '.txt')))
+		else:
+			ret.append(path)
+	return ret
+
+def done_names(output_path: str) -> Set[str]:
+	"""names that already have a successful line in the output"""
+	ret = set()
+	if not os.path.exists(output_path): return ret
+	with open(output_path) as infile:
+		for line in infile:
+			try:
+				entry = json.loads(line)
+			except ValueError:
+				continue # probably cut off by the interruption
+			if 'result' in entry:
+				ret.add(entry['name'])
+	return ret
+
+# one model per worker process, loaded by the pool's initializer
+worker_model: Optional[harmonize.Model] = None
+worker_options: Dict = {}
+
+def init_worker(options: dict, quiet: bool):
+	global worker_model, worker_options
+	if quiet:
+		# the predictor is chatty
+		sys.stdout = open(os.devnull, 'w')
+	# batch requests never ask for similar songs
+	worker_model = harmonize.build_model(similarity_index=False)
+	worker_options = options
+
+def harmonize_file(path: str) -> dict:
+	try:
+		with open(path) as infile:
+			data = json.load(infile)
+		ans = request_for(data)
+		ans.update(worker_options['overrides'])
+		response = harmonize.harmonize(worker_model, ans, low_memory=worker_options['low_memory'])
+		del ans['music']
+		return {'name': path, 'request': ans, 'result': response['result']}
+	except Exception:
+		return {'name': path, 'error': traceback.format_exc()}
+
+def main():
+	parser = argparse.ArgumentParser(description='Harmonize a directory of melodies into JSONL, without the server.')
+	parser.add_argument('inputs', nargs='+', help='melody JSON files, saved client states, or directories of them')
+	parser.add_argument('-o', '--output', required=True, help='JSONL file to append results to; inputs already in it are skipped')
+	parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes, each with its own model; 1 runs in this process')
+	parser.add_argument('--mode', choices=['major', 'parallel-minor', 'relative-minor', 'mixed-parallel', 'mixed-relative'], help='override the mode')
+	parser.add_argument('--chord-length', type=float, help='override the chord length, in seconds')
+	parser.add_argument('--jazziness', type=float, help='override jazziness (-1 to 1)')
+	parser.add_argument('--bottom-bass', type=int, help='override the lowest MIDI note for chord voicings')
+	parser.add_argument('--seed', help='sample progressions with this seed instead of taking the best one')
+	parser.add_argument('--low-memory', action='store_true', help='use checkpointed decoding (same results, less memory for long pieces)')
+	parser.add_argument('-v', '--verbose', action='store_true', help="don't silence the predictor's debug output")
+	args = parser.parse_args()
+
+	overrides = {}
+	if args.mode is not None: overrides['mode'] = args.mode
+	if args.chord_length is not None: overrides['chordLength'] = args.chord_length
+	if args.jazziness is not None: overrides['jazziness'] = args.jazziness
+	if args.bottom_bass is not None: overrides['bottomBass'] = args.bottom_bass
+	if args.seed is not None: overrides['seed'] = args.seed
+	options = {'overrides': overrides, 'low_memory': args.low_memory}
+
+	inputs = find_inputs(args.inputs)
+	done = done_names(args.output)
+	todo = [path for path in inputs if path not in done]
+	print("{} inputs, {} already done, {} to go".format(len(inputs), len(inputs) - len(todo), len(todo)))
+	if not todo: return
+
+	# if we were interrupted mid-line, don't glue the next line onto it
+	if os.path.exists(args.output) and os.path.getsize(args.output):
+		with open(args.output, 'rb') as infile:
+			infile.seek(-1, os.SEEK_END)
+			needs_newline = infile.read(1) != b'\n'
+	else:
+		needs_newline = False
+
+	start_time = time.time()
+	failures = 0
+	with open(args.output, 'a') as outfile:
+		if needs_newline:
+			outfile.write('\n')
+
+		def write(entry: dict):
+			nonlocal failures
+			if 'error' in entry:
+				failures += 1
+				print('! failed:', entry['name'])
+				print(entry['error'])
+			outfile.write(json.dumps(entry) + '\n')
+			# flush every line so an interruption loses at most the ones in flight
+			outfile.flush()
+
+		if args.jobs > 1:
+			with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker, initargs=(options, not args.verbose)) as executor:
+				futures = [executor.submit(harmonize_file, path) for path in todo]
+				for i, future in enumerate(as_completed(futures)):
+					write(future.result())
+					if (i + 1) % 100 == 0:
+						print("{}/{} in {:.2f} seconds".format(i + 1, len(todo), time.time() - start_time))
+		else:
+			quiet_stdout = sys.stdout if args.verbose else open(os.devnull, 'w')
+			with contextlib.redirect_stdout(quiet_stdout):
+				init_worker(options, False)
+			for i, path in enumerate(todo):
+				with contextlib.redirect_stdout(quiet_stdout):
+					entry = harmonize_file(path)
+				write(entry)
+				if (i + 1) % 100 == 0:
+					print("{}/{} in {:.2f} seconds".format(i + 1, len(todo), time.time() - start_time))
+	print("Done: {} harmonized, {} failed, in {:.2f} seconds".format(len(todo) - failures, failures, time.time() - start_time))
+
+if __name__ == '__main__':
+	main()
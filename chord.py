@@ -1,19 +1,64 @@
-from typing import Optional, List
+from typing import Dict, Optional, List, Tuple
 from typing_extensions import Literal
 from functools import total_ordering
+import threading
 # A chord without a specified root. We drop sixths, and ninths and higher.
 
 roman_numerals = ['I', 'bII', 'II', 'bIII', 'III', 'IV', '#IV', 'V', 'bVI', 'VI', 'bVII', 'VII']
 
+# Chords are interned: constructing a chord that already exists hands back the
+# existing instance, so there's exactly one object per distinct chord. That
+# makes equality identity and hashing a precomputed small int, and lets us
+# memoize transpose/collapse results on the instance. Each chord also gets a
+# small integer id (its index in the vocabulary list) for use in lookup tables
+# and arrays. Ids depend on the order chords were first seen, so they're only
+# meaningful within one process; don't persist them (persist stringify()).
+#
+# Treat instances as immutable, since everyone holding that chord shares them.
+#
+# Making a new chord takes a lock, so a model being rebuilt on a background
+# thread can't race a request into creating two instances of one chord.
+# Looking up an existing chord (nearly always the case) doesn't.
+
+intern_lock = threading.Lock()
+
 @total_ordering # really unimportant but lets us break ties consistently
 class RelativeChord:
-	def __init__(self,
+	__slots__ = ['quality', 'seventh', 'inversions', 'id', 'key', '_rs_collapsed', '_beta_collapsed', '_simplified', '_render_offsets']
+
+	interned: Dict[Tuple[str, Optional[str], int], 'RelativeChord'] = {}
+	vocabulary: List['RelativeChord'] = []
+
+	def __new__(cls,
 			quality: Literal['maj', 'min', 'dim', 'aug', 'majb5', 'sus2', 'sus4'],
 			seventh: Literal[None, 'maj', 'min', 'dim'] = None,
 			inversions: int = 0):
-		self.quality = quality
-		self.seventh = seventh
-		self.inversions = inversions
+		fields = (quality, seventh, inversions)
+		self = cls.interned.get(fields)
+		if self is not None: return self
+
+		with intern_lock:
+			# someone may have made it while we waited for the lock
+			self = cls.interned.get(fields)
+			if self is not None: return self
+
+			self = object.__new__(cls)
+			self.quality = quality
+			self.seventh = seventh
+			self.inversions = inversions
+			self.id = len(cls.vocabulary)
+			self.key = ' '.join([quality, str(seventh), str(inversions)])
+			self._rs_collapsed = None
+			self._beta_collapsed = None
+			self._simplified = None
+			self._render_offsets = None
+			cls.interned[fields] = self
+			cls.vocabulary.append(self)
+			return self
+
+	def __reduce__(self):
+		# unpickle through __new__ so we get the interned instance back
+		return (RelativeChord, (self.quality, self.seventh, self.inversions))
 
 	@property
 	def simple_quality(self) -> Literal['maj', 'min']:
@@ -28,18 +73,27 @@ class RelativeChord:
 		else: return 'maj'
 
 	def rs_collapse(self) -> 'RelativeChord':
-		sq = self.simple_quality
-		return RelativeChord(sq, 'min' if self.seventh == 'min' and sq == 'maj' else None, 0)
+		if self._rs_collapsed is None:
+			sq = self.simple_quality
+			self._rs_collapsed = RelativeChord(sq, 'min' if self.seventh == 'min' and sq == 'maj' else None, 0)
+		return self._rs_collapsed
 
 	def beta_collapse(self) -> 'RelativeChord':
-		sq = self.beta_quality
-		return RelativeChord(sq, 'min' if self.seventh == 'min' and sq in ['min', 'maj'] else None, 0)
+		if self._beta_collapsed is None:
+			sq = self.beta_quality
+			self._beta_collapsed = RelativeChord(sq, 'min' if self.seventh == 'min' and sq in ['min', 'maj'] else None, 0)
+		return self._beta_collapsed
 
 
 	def simplified(self) -> 'RelativeChord':
-		return RelativeChord(self.simple_quality)
+		if self._simplified is None:
+			self._simplified = RelativeChord(self.simple_quality)
+		return self._simplified
 
 	def render_offsets(self):
+		if self._render_offsets is not None:
+			return list(self._render_offsets)
+
 		ret = [0]
 		if self.quality == 'maj': ret.extend([4, 7])
 		elif self.quality == 'min': ret.extend([3, 7])
@@ -55,10 +109,11 @@ class RelativeChord:
 
 		for _ in range(self.inversions):
 			ret = ret[1:] + [ret[0] + 12]
+		self._render_offsets = tuple(ret)
 		return ret
 
 	def stringify(self):
-		return ' '.join([self.quality, str(self.seventh), str(self.inversions)])
+		return self.key
 
 	@classmethod
 	def parse(cls, s):
@@ -71,18 +126,14 @@ class RelativeChord:
 	def __repr__(self):
 		return 'RelativeChord(quality={}, seventh={}, inversions={})'.format(repr(self.quality), repr(self.seventh), self.inversions)
 
-	def __eq__(self, other):
-		try:
-			return self.quality == other.quality and self.seventh == other.seventh and self.inversions == other.inversions
-		except AttributeError:
-			return NotImplemented
+	# no __eq__: interning makes the default identity comparison correct
 
 	def __hash__(self):
-		return hash((self.quality, self.seventh, self.inversions))
+		return self.id
 
 	def __lt__(self, other):
 		if isinstance(other, RelativeChord):
-			return self.stringify() < other.stringify()
+			return self.key < other.key
 		else:
 			return NotImplemented
 
@@ -122,12 +173,44 @@ def get_pitch_name(relative_semitone: int, key_sig: int) -> str:
 
 @total_ordering
 class Chord:
-	def __init__(self,
+	__slots__ = ['root', 'relative_chord', 'id', 'key', '_transposed', '_rs_collapsed', '_beta_collapsed', '_simplified']
+
+	interned: Dict[Tuple[Optional[int], Optional[RelativeChord]], 'Chord'] = {}
+	vocabulary: List['Chord'] = []
+
+	def __new__(cls,
 			root: Optional[int], # 0 to 11; above tonic. or None for N.C.
 			relative_chord: Optional[RelativeChord], # None for pedal...
 		):
-		self.root = root
-		self.relative_chord = relative_chord
+		fields = (root, relative_chord)
+		self = cls.interned.get(fields)
+		if self is not None: return self
+
+		with intern_lock:
+			# someone may have made it while we waited for the lock
+			self = cls.interned.get(fields)
+			if self is not None: return self
+
+			self = object.__new__(cls)
+			self.root = root
+			self.relative_chord = relative_chord
+			self.id = len(cls.vocabulary)
+			if root is None:
+				self.key = ''
+			elif relative_chord is None:
+				self.key = str(root)
+			else:
+				self.key = '{:02d}:{}'.format(root, relative_chord.stringify())
+			self._transposed: List[Optional[Chord]] = [None] * 12
+			self._rs_collapsed = None
+			self._beta_collapsed = None
+			self._simplified = None
+			cls.interned[fields] = self
+			cls.vocabulary.append(self)
+			return self
+
+	def __reduce__(self):
+		return (Chord, (self.root, self.relative_chord))
 
 	@property
 	def simple_quality(self) -> Literal[None, 'maj', 'min']:
@@ -153,39 +236,34 @@ class Chord:
 
 
 	def rs_collapse(self) -> 'Chord':
-		return Chord(self.root, self.relative_chord.rs_collapse() if self.relative_chord else None)
+		if self._rs_collapsed is None:
+			self._rs_collapsed = Chord(self.root, self.relative_chord.rs_collapse() if self.relative_chord else None)
+		return self._rs_collapsed
 
 	def beta_collapse(self) -> 'Chord':
-		return Chord(self.root, self.relative_chord.beta_collapse() if self.relative_chord else None)
+		if self._beta_collapsed is None:
+			self._beta_collapsed = Chord(self.root, self.relative_chord.beta_collapse() if self.relative_chord else None)
+		return self._beta_collapsed
 
 	def simplified(self) -> 'Chord':
-		return Chord(self.root, self.relative_chord.simplified() if self.relative_chord else None)
+		if self._simplified is None:
+			self._simplified = Chord(self.root, self.relative_chord.simplified() if self.relative_chord else None)
+		return self._simplified
 
 	def __repr__(self) -> str:
 		return 'Chord({}, {})'.format(self.root, repr(self.relative_chord))
 
-	def __eq__(self, other) -> bool:
-		try:
-			return self.root == other.root and self.relative_chord == other.relative_chord
-		except AttributeError:
-			return NotImplemented
-
 	def __hash__(self):
-		return hash((self.root, self.relative_chord))
+		return self.id
 
 	def __lt__(self, other):
 		if isinstance(other, Chord):
-			return self.stringify() < other.stringify()
+			return self.key < other.key
 		else:
 			return NotImplemented
 
 	def stringify(self) -> str:
-		if self.root is None:
-			return ''
-		elif self.relative_chord is None:
-			return str(self.root)
-		else:
-			return '{:02d}:{}'.format(self.root, self.relative_chord.stringify())
+		return self.key
 
 	@classmethod
 	def parse(cls, s) -> 'Chord':
@@ -197,9 +275,17 @@ class Chord:
 			root, rest = s.split(':')
 			return cls(int(root), RelativeChord.parse(rest))
 
+	@classmethod
+	def by_id(cls, chord_id: int) -> 'Chord':
+		return cls.vocabulary[chord_id]
+
 	def transpose(self, steps: int) -> 'Chord':
 		if self.root is None: return self
-		return Chord((self.root + steps) % 12, self.relative_chord)
+		steps %= 12
+		ret = self._transposed[steps]
+		if ret is None:
+			ret = self._transposed[steps] = Chord((self.root + steps) % 12, self.relative_chord)
+		return ret
 
 	def relative_to_absolute(self, key_signature: int):
 		return self.transpose(key_signature * 7)
@@ -294,3 +380,17 @@ class C:
 	IV = Chord(5, RC.maj)
 	V = Chord(7, RC.maj)
 	vi = Chord(9, RC.min)
+
+# Id-level lookup tables over the current vocabulary: table[chord.id] is the
+# id of the transposed/collapsed chord. The vocabulary can grow (including
+# while building these), so a table only covers the ids that existed when it
+# was built.
+
+def transpose_table(steps: int) -> List[int]:
+	return [chord.transpose(steps).id for chord in list(Chord.vocabulary)]
+
+def beta_collapse_table() -> List[int]:
+	return [chord.beta_collapse().id for chord in list(Chord.vocabulary)]
+
+def rs_collapse_table() -> List[int]:
+	return [chord.rs_collapse().id for chord in list(Chord.vocabulary)]
@@ -1,116 +1,203 @@
 import os, math, pickle, time
 from collections import defaultdict, Counter
-from typing import Dict, List, Tuple, Optional
-import music21
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional
 
 from measure import Measure, Song
 from corpus.abc.convert import convert, get_chord_type
+import corpus.abc.lite as lite
+import corpus.columnar as columnar
 
 cur_dirname = os.path.dirname(__file__)
 abc_dirpath = os.path.join(cur_dirname, 'nottingham-dataset', 'ABC_cleaned')
 pickle_path = os.path.join(cur_dirname, 'abc.pickle')
+columnar_path = os.path.join(cur_dirname, 'abc.columnar')
+
+# song.meta is the music21 mode of the section
+mode_names = {'major': 'maj', 'minor': 'min'}
+
+def music21_events(path: str) -> Iterator[lite.Event]:
+	"""the same events corpus.abc.lite produces, by walking music21's parse"""
+	# only imported here: it's slow to import and big, and everything but
+	# the odd unsupported file (and the server, which never parses) can do
+	# without it
+	import music21
+	for score in music21.converter.parse(path).getElementsByClass(music21.stream.Score):
+		# score.show('text')
+
+		metadatas = score.getElementsByClass(music21.metadata.Metadata)
+		assert len(metadatas) == 1
+		yield ('tune', metadatas[0].title)
+
+		for part in score.getElementsByClass(music21.stream.Part):
+			yield ('part',)
+			for measure in part.getElementsByClass(music21.stream.Measure):
+				for node in measure:
+					if isinstance(node, music21.key.Key):
+						yield ('key', node.tonic.midi, node.mode)
+					elif isinstance(node, music21.harmony.ChordSymbol):
+						yield ('chord', node._figure, node.offset)
+					elif isinstance(node, music21.note.Note):
+						yield ('note', node.pitch.midi, node.duration.quarterLength)
+
+def file_events(path: str) -> List[lite.Event]:
+	try:
+		return list(lite.tune_events(path))
+	except lite.UnsupportedABC as e:
+		print('-', os.path.basename(path), 'needs music21:', e)
+		return list(music21_events(path))
 
 def stats():
 	c = 0
-	for filename in os.listdir(abc_dirpath):
-		if filename.endswith('.abc'):
-			print('-', filename)
-			for score in music21.converter.parse(os.path.join(abc_dirpath, filename)).getElementsByClass(music21.stream.Score):
-				metadatas = score.getElementsByClass(music21.metadata.Metadata)
-				assert len(metadatas) == 1
-				title = metadatas[0].title
-				print(title)
+	for source in list_sources():
+		path, = source
+		print('-', os.path.basename(path))
+		for event in file_events(path):
+			if event[0] == 'tune':
+				print(event[1])
 				c += 1
 	print(c)
 
+def list_sources() -> List[Tuple[str, ...]]:
+	return [(os.path.join(abc_dirpath, filename),) for filename in sorted(os.listdir(abc_dirpath)) if filename.endswith('.abc')]
+
 # each "song" is only a song in which the key doesn't change
-def parse_songs():
+def songs_from_events(filename: str, events: Iterable[lite.Event]) -> List[Song]:
+	songs = []
+	title = None
+	section = 0
+	key = None # (tonic midi, mode)
+	output_measures: List[Measure] = []
+	output_measure: Optional[Measure] = None
+
+	def end_part():
+		nonlocal output_measures, output_measure
+		if output_measure:
+			output_measures.append(output_measure)
+		if output_measures:
+			assert key, "No key when dumping song!?"
+			songs.append(Song("{}/{}/{}".format(filename, title, section), key[1], output_measures))
+		output_measures = []
+		output_measure = None
+
+	for event in events:
+		if event[0] == 'tune':
+			end_part()
+			title = event[1]
+			section = 0
+		elif event[0] == 'part':
+			end_part()
+			key = None
+		elif event[0] == 'key':
+			if output_measure:
+				output_measures.append(output_measure)
+				output_measure = None
+			if output_measures:
+				assert key, "No key when dumping song!?"
+				songs.append(Song("{}/{}/{}".format(filename, title, section), key[1], output_measures))
+				section += 1
+				output_measures = []
+
+			key = (event[1], event[2])
+
+		elif event[0] == 'chord':
+			assert key, "No key before chord!?"
+			_, figure, offset = event
+
+			chord = convert(figure, key[0])
+
+			if output_measure:
+				output_measures.append(output_measure)
+			output_measure = Measure(
+				chord=chord,
+				chord_name="",
+				start=offset,
+				end=0.0, # music21 ChordSymbols have no duration
+				reps=1,
+				melody_notes=[],
+			)
+		elif event[0] == 'note':
+			assert key
+			_, note_midi, duration = event
+			midi = (note_midi - key[0]) % 12
+
+			if output_measure:
+				output_measure.melody_notes.append((midi, duration))
+	end_part()
+	return songs
+
+def parse_source(source: Tuple[str, ...]) -> List[Song]:
+	path, = source
+	filename = os.path.basename(path)
+	print('-', filename)
+	return songs_from_events(filename, file_events(path))
+
+def parse_source_music21(source: Tuple[str, ...]) -> List[Song]:
+	path, = source
+	return songs_from_events(os.path.basename(path), music21_events(path))
+
+def parse_songs() -> List[Song]:
 	print("Parsing the Nottingham dataset")
 	start_time = time.time()
 	songs = []
-
-	for filename in os.listdir(abc_dirpath):
-		if filename.endswith('.abc'):
-			print('-', filename)
-			for score in music21.converter.parse(os.path.join(abc_dirpath, filename)).getElementsByClass(music21.stream.Score):
-				# score.show('text')
-
-				metadatas = score.getElementsByClass(music21.metadata.Metadata)
-				assert len(metadatas) == 1
-				title = metadatas[0].title
-				section = 0
-
-				for part in score.getElementsByClass(music21.stream.Part):
-					output_measures = []
-					output_measure = None
-
-					key = None
-					for measure in part.getElementsByClass(music21.stream.Measure):
-						for node in measure:
-							if isinstance(node, music21.key.Key):
-								if output_measure:
-									output_measures.append(output_measure)
-									output_measure = None
-								if output_measures:
-									assert key, "No key when dumping song!?"
-									songs.append(Song("{}/{}/{}".format(filename, title, section), key.mode, output_measures))
-									section += 1
-									output_measures = []
-
-								key = node
-
-							elif isinstance(node, music21.harmony.ChordSymbol):
-								assert key, "No key before chord!?"
-
-								chord = convert(node._figure, key.tonic.midi)
-
-								if output_measure:
-									output_measures.append(output_measure)
-								output_measure = Measure(
-									chord=chord,
-									chord_name="",
-									start=node.offset,
-									end=node.duration.quarterLength,
-									reps=1,
-									melody_notes=[],
-								)
-							elif isinstance(node, music21.note.Note):
-								midi = (node.pitch.midi - key.tonic.midi) % 12
-
-								if output_measure:
-									output_measure.melody_notes.append((midi, node.duration.quarterLength))
-					if output_measure:
-						output_measures.append(output_measure)
-					if output_measures:
-						assert key, "No key when dumping song!?"
-						songs.append(Song("{}/{}/{}".format(filename, title, section), key.mode, output_measures))
+	for source in list_sources():
+		songs.extend(parse_source(source))
 
 	print("Done in", time.time() - start_time, "seconds")
 	return songs
 
+def check_lite_parser(sources: Optional[List[Tuple[str, ...]]] = None) -> int:
+	"""parse every file both ways, report where corpus.abc.lite disagrees with
+	music21, and return how many files did"""
+	if sources is None:
+		sources = list_sources()
+	mismatched = 0
+	for source in sources:
+		path, = source
+		filename = os.path.basename(path)
+		try:
+			lite_songs = songs_from_events(filename, lite.tune_events(path))
+		except lite.UnsupportedABC as e:
+			print('-', filename, 'unsupported, falls back to music21:', e)
+			continue
+		music21_songs = parse_source_music21(source)
+
+		if len(lite_songs) != len(music21_songs):
+			print('!', filename, len(lite_songs), 'songs vs', len(music21_songs), 'from music21')
+			mismatched += 1
+			continue
+		for lite_song, music21_song in zip(lite_songs, music21_songs):
+			if repr(lite_song) != repr(music21_song):
+				print('!', filename, lite_song.name, 'differs from music21')
+				print('  lite:   ', lite_song)
+				print('  music21:', music21_song)
+				mismatched += 1
+				break
+		else:
+			print('-', filename, 'ok')
+	print(mismatched, 'mismatched files')
+	return mismatched
+
 def tabulate_chord_types() -> Dict[str, int]:
 	print("Parsing the Nottingham dataset")
 	start_time = time.time()
 	chord_type_dict = Counter()
 
-	for filename in os.listdir(abc_dirpath):
-		if filename.endswith('.abc'):
-			print('-', filename)
-			for score in music21.converter.parse(os.path.join(abc_dirpath, filename)).getElementsByClass(music21.stream.Score):
-				# score.show('text')
-
-				for part in score.getElementsByClass(music21.stream.Part):
-					for measure in part.getElementsByClass(music21.stream.Measure):
-						for node in measure:
-							if isinstance(node, music21.harmony.ChordSymbol):
-								chord_type_dict[get_chord_type(node._figure)] += 1
+	for source in list_sources():
+		path, = source
+		print('-', os.path.basename(path))
+		for event in file_events(path):
+			if event[0] == 'chord':
+				chord_type_dict[get_chord_type(event[1])] += 1
 
 	print("Done in", time.time() - start_time, "seconds")
 	return chord_type_dict
 
-def dump_songs():
+def dump_songs(songs: Optional[List[Song]] = None):
+	if songs is None:
+		songs = parse_songs()
 	with open(pickle_path, 'wb') as outfile:
-		pickle.dump(parse_songs(), outfile)
+		pickle.dump(songs, outfile)
+	columnar.dump(songs, columnar_path, [mode_names[song.meta] for song in songs])
 
 # helpful: measure.show('text')
 
@@ -128,3 +215,14 @@ def load_songs():
 			'maj': major_songs,
 			'min': minor_songs,
 		}
+
+def iter_songs(modes: Optional[Iterable[str]] = None, name_pattern: Optional[str] = None) -> Iterator[columnar.SongView]:
+	return columnar.ColumnarCorpus.load(columnar_path).iter_songs(modes, name_pattern)
+
+def load_columnar():
+	store = columnar.ColumnarCorpus.load(columnar_path)
+	return {
+		'all': store.songs(),
+		'maj': list(store.iter_songs(['maj'])),
+		'min': list(store.iter_songs(['min'])),
+	}
@@ -0,0 +1,73 @@
+import os, hashlib, pickle
+from typing import List, Optional, Tuple, Iterable
+
+from measure import Song
+
+corpus_dirname = os.path.dirname(__file__)
+root_dirname = os.path.dirname(corpus_dirname)
+
+# Per-source-file parse cache. An entry is keyed by the contents of the
+# source files and by the "converter version", which is just a hash of all
+# the code that turns a source file into songs, so editing a chord conversion
+# rule invalidates everything for that corpus without anyone having to
+# remember to bump a number.
+
+def hash_files(paths: Iterable[str]) -> str:
+	h = hashlib.sha1()
+	for path in paths:
+		with open(path, 'rb') as infile:
+			h.update(infile.read())
+		h.update(b'\0')
+	return h.hexdigest()
+
+def converter_version(corpus_name: str) -> str:
+	corpus_dirpath = os.path.join(corpus_dirname, corpus_name)
+	paths = [os.path.join(corpus_dirpath, filename) for filename in sorted(os.listdir(corpus_dirpath)) if filename.endswith('.py')]
+	paths.append(os.path.join(root_dirname, 'chord.py'))
+	paths.append(os.path.join(root_dirname, 'measure.py'))
+	return hash_files(paths)
+
+def cache_dirpath(corpus_name: str) -> str:
+	return os.path.join(corpus_dirname, corpus_name, 'cache')
+
+def source_key(version: str, source: Tuple[str, ...]) -> str:
+	h = hashlib.sha1(version.encode('utf-8'))
+	# song names come from file names, so those are part of the key too
+	for path in source:
+		h.update(os.path.basename(path).encode('utf-8'))
+		h.update(b'\0')
+	h.update(hash_files(source).encode('utf-8'))
+	return h.hexdigest()
+
+def entry_path(corpus_name: str, key: str) -> str:
+	return os.path.join(cache_dirpath(corpus_name), key + '.pickle')
+
+def load(corpus_name: str, key: str) -> Optional[List[Song]]:
+	try:
+		with open(entry_path(corpus_name, key), 'rb') as infile:
+			return pickle.load(infile)
+	except (OSError, EOFError, pickle.UnpicklingError):
+		return None
+
+def store(corpus_name: str, key: str, songs: List[Song]):
+	os.makedirs(cache_dirpath(corpus_name), exist_ok=True)
+	path = entry_path(corpus_name, key)
+	# write then rename so an interrupted run never leaves a truncated entry
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'wb') as outfile:
+		pickle.dump(songs, outfile)
+	os.replace(tmp_path, path)
+
+def prune(corpus_name: str, live_keys: Iterable[str]) -> int:
+	"""delete entries for files that are gone or were parsed by an older
+	converter; returns how many were deleted"""
+	dirpath = cache_dirpath(corpus_name)
+	if not os.path.isdir(dirpath): return 0
+
+	live_filenames = set(key + '.pickle' for key in live_keys)
+	deleted = 0
+	for filename in os.listdir(dirpath):
+		if filename not in live_filenames:
+			os.remove(os.path.join(dirpath, filename))
+			deleted += 1
+	return deleted
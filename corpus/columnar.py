@@ -0,0 +1,291 @@
+import os, re, json, shutil
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+
+from measure import Measure, Song
+from chord import Chord
+
+# A columnar, memory-mappable version of a pickled List[Song]. Instead of
+# millions of small Song/Measure/Chord objects we keep one array per field:
+#
+#   measure_chord, measure_chord_name: indices into chords.json/chord_names.json
+#   measure_reps, measure_start, measure_end
+#   note_pitch (-1 for None, i.e. a rest in MARG), note_duration
+#   measure_note_offsets: notes of measure i are [offsets[i], offsets[i+1])
+#   song_measure_offsets: measures of song i, likewise
+#
+# meta.json also has a mode index (mode name -> sorted song ids), computed at
+# dump time by whoever knows how to classify that corpus, so picking out the
+# minor songs doesn't mean looking at any measures.
+#
+# Loading mmaps the arrays, and reading hands out SongView/MeasureView objects
+# that quack like Song/Measure (enough for SongStatSet.from_songs and friends)
+# and are built on demand, so nothing is resident but what you're looking at.
+
+array_names = [
+	'measure_chord',
+	'measure_chord_name',
+	'measure_reps',
+	'measure_start',
+	'measure_end',
+	'measure_note_offsets',
+	'song_measure_offsets',
+	'note_pitch',
+	'note_duration',
+]
+
+# not written by dump, but cached next to the arrays on first use
+chord_counts_name = 'song_chord_counts'
+
+def dump(songs: List[Song], dirpath: str, modes: Optional[List[str]] = None):
+	chords: List[Chord] = []
+	chord_ids: Dict[Chord, int] = {}
+	chord_names: List[str] = []
+	chord_name_ids: Dict[str, int] = {}
+
+	measure_chord = []
+	measure_chord_name = []
+	measure_reps = []
+	measure_start = []
+	measure_end = []
+	measure_note_offsets = [0]
+	song_measure_offsets = [0]
+	note_pitch = []
+	note_duration = []
+
+	for song in songs:
+		for measure in song.measures:
+			if measure.chord not in chord_ids:
+				chord_ids[measure.chord] = len(chords)
+				chords.append(measure.chord)
+			if measure.chord_name not in chord_name_ids:
+				chord_name_ids[measure.chord_name] = len(chord_names)
+				chord_names.append(measure.chord_name)
+			measure_chord.append(chord_ids[measure.chord])
+			measure_chord_name.append(chord_name_ids[measure.chord_name])
+			measure_reps.append(measure.reps)
+			measure_start.append(float(measure.start))
+			measure_end.append(float(measure.end))
+			for pitch, duration in measure.melody_notes:
+				note_pitch.append(-1 if pitch is None else pitch)
+				note_duration.append(float(duration))
+			measure_note_offsets.append(len(note_pitch))
+		song_measure_offsets.append(len(measure_chord))
+
+	arrays = {
+		'measure_chord': np.array(measure_chord, dtype=np.int32),
+		'measure_chord_name': np.array(measure_chord_name, dtype=np.int32),
+		'measure_reps': np.array(measure_reps, dtype=np.int32),
+		'measure_start': np.array(measure_start, dtype=np.float64),
+		'measure_end': np.array(measure_end, dtype=np.float64),
+		'measure_note_offsets': np.array(measure_note_offsets, dtype=np.int64),
+		'song_measure_offsets': np.array(song_measure_offsets, dtype=np.int64),
+		'note_pitch': np.array(note_pitch, dtype=np.int8),
+		'note_duration': np.array(note_duration, dtype=np.float64),
+	}
+	meta = {
+		'chords': [chord.stringify() for chord in chords],
+		'chord_names': chord_names,
+		'songs': [[song.name, song.meta] for song in songs],
+		'mode_index': {},
+	}
+	if modes is not None:
+		assert len(modes) == len(songs)
+		for i, mode in enumerate(modes):
+			meta['mode_index'].setdefault(mode, []).append(i)
+
+	# write everything next to the old store and swap it in at the end, so
+	# a reader never sees half a corpus (and mmaps of the old one stay valid)
+	tmp_dirpath = dirpath + '.tmp'
+	if os.path.exists(tmp_dirpath):
+		shutil.rmtree(tmp_dirpath)
+	os.makedirs(tmp_dirpath)
+	for name, array in arrays.items():
+		np.save(os.path.join(tmp_dirpath, name + '.npy'), array)
+	with open(os.path.join(tmp_dirpath, 'meta.json'), 'w') as outfile:
+		json.dump(meta, outfile)
+	if os.path.exists(dirpath):
+		shutil.rmtree(dirpath)
+	os.rename(tmp_dirpath, dirpath)
+
+class MeasureView:
+	__slots__ = ['chord', 'chord_name', 'start', 'end', 'reps', 'melody_notes']
+
+	def __init__(self, chord: Chord, chord_name: str, start: float, end: float, reps: int, melody_notes: List[Tuple[Optional[int], float]]):
+		self.chord = chord
+		self.chord_name = chord_name
+		self.start = start
+		self.end = end
+		self.reps = reps
+		self.melody_notes = melody_notes
+
+	def __repr__(self):
+		return 'MeasureView(chord={}, chord_name={}, start={}, end={}, reps={}, melody_notes={})'.format(repr(self.chord), repr(self.chord_name), self.start, self.end, self.reps, repr(self.melody_notes))
+
+	def materialize(self) -> Measure:
+		return Measure(self.chord, self.chord_name, self.start, self.end, self.reps, list(self.melody_notes))
+
+class ColumnarCorpus:
+	def __init__(self, chords: List[Chord], chord_names: List[str], songs: List[Tuple[str, str]], arrays: Dict[str, np.ndarray], mode_index: Dict[str, List[int]], pitch_shift: int = 0, dirpath: Optional[str] = None):
+		self.chords = chords
+		self.chord_names = chord_names
+		self.song_names_and_metas = songs
+		self.arrays = arrays
+		self.mode_index = mode_index
+		self.pitch_shift = pitch_shift
+		self.dirpath = dirpath
+		self.chord_counts: Optional[np.ndarray] = None
+		# derived corpora, so that calling song.modify_chord(f) on every song
+		# of a corpus only rewrites the vocabulary once per f
+		self.derived: Dict[Tuple, 'ColumnarCorpus'] = {}
+
+	@classmethod
+	def load(cls, dirpath: str, mmap: bool = True) -> 'ColumnarCorpus':
+		with open(os.path.join(dirpath, 'meta.json')) as infile:
+			meta = json.load(infile)
+		arrays = {name: np.load(os.path.join(dirpath, name + '.npy'), mmap_mode='r' if mmap else None) for name in array_names}
+		return cls(
+			[Chord.parse(s) for s in meta['chords']],
+			meta['chord_names'],
+			[(name, song_meta) for name, song_meta in meta['songs']],
+			arrays,
+			meta['mode_index'],
+			dirpath=dirpath)
+
+	def __len__(self) -> int:
+		return len(self.song_names_and_metas)
+
+	def __getitem__(self, i: int) -> 'SongView':
+		return SongView(self, i)
+
+	def __iter__(self) -> Iterator['SongView']:
+		for i in range(len(self)):
+			yield SongView(self, i)
+
+	def songs(self) -> List['SongView']:
+		return list(self)
+
+	def song_indices(self, modes: Optional[Iterable[str]] = None, name_pattern: Optional[str] = None) -> List[int]:
+		"""indices of songs with any of the given modes whose name matches the
+		regex (re.search); None means no filter"""
+		if modes is None:
+			indices: Iterable[int] = range(len(self))
+		else:
+			indices = sorted(i for mode in set(modes) for i in self.mode_index.get(mode, []))
+		if name_pattern is not None:
+			regex = re.compile(name_pattern)
+			indices = [i for i in indices if regex.search(self.song_names_and_metas[i][0])]
+		return list(indices)
+
+	def iter_songs(self, modes: Optional[Iterable[str]] = None, name_pattern: Optional[str] = None) -> Iterator['SongView']:
+		for i in self.song_indices(modes, name_pattern):
+			yield SongView(self, i)
+
+	# These rewrite the (small) chord vocabulary instead of every measure and
+	# share all the big arrays with the original. Pass the same function
+	# object each time (not a fresh lambda per song) to get the memoization.
+	def modify_chord(self, f: Callable[[Chord], Chord]) -> 'ColumnarCorpus':
+		key = ('modify_chord', f)
+		if key not in self.derived:
+			self.derived[key] = ColumnarCorpus([f(chord) for chord in self.chords], self.chord_names, self.song_names_and_metas, self.arrays, self.mode_index, self.pitch_shift, self.dirpath)
+		return self.derived[key]
+
+	def transpose(self, semitones: int) -> 'ColumnarCorpus':
+		key = ('transpose', semitones)
+		if key not in self.derived:
+			self.derived[key] = ColumnarCorpus([chord.transpose(semitones) for chord in self.chords], self.chord_names, self.song_names_and_metas, self.arrays, self.mode_index, self.pitch_shift + semitones, self.dirpath)
+		return self.derived[key]
+
+	def song_chord_counts(self) -> np.ndarray:
+		"""counts[song, chord id] = total reps of measures with that chord,
+		where chord ids index self.chords (the same for derived corpora)"""
+		if self.chord_counts is None:
+			self.chord_counts = self.load_or_compute_chord_counts()
+		return self.chord_counts
+
+	def load_or_compute_chord_counts(self) -> np.ndarray:
+		# materialized inside the store, so dumping a new corpus (which
+		# replaces the whole directory) is what invalidates it
+		path = None if self.dirpath is None else os.path.join(self.dirpath, chord_counts_name + '.npy')
+		if path is not None:
+			try:
+				counts = np.load(path)
+				if counts.shape == (len(self), len(self.chords)):
+					return counts
+			except (OSError, ValueError):
+				pass
+
+		offsets = self.arrays['song_measure_offsets']
+		measure_song = np.repeat(np.arange(len(self)), np.diff(offsets))
+		counts = np.zeros((len(self), len(self.chords)), dtype=np.int64)
+		np.add.at(counts, (measure_song, self.arrays['measure_chord']), self.arrays['measure_reps'])
+
+		if path is not None:
+			try:
+				tmp_path = path + '.tmp.npy'
+				np.save(tmp_path, counts)
+				os.replace(tmp_path, path)
+			except OSError:
+				pass # read-only store; we'll just compute it again next time
+		return counts
+
+	def measure_range(self, i: int) -> Tuple[int, int]:
+		offsets = self.arrays['song_measure_offsets']
+		return (int(offsets[i]), int(offsets[i + 1]))
+
+class SongView:
+	__slots__ = ['corpus', 'index']
+
+	def __init__(self, corpus: ColumnarCorpus, index: int):
+		self.corpus = corpus
+		self.index = index
+
+	@property
+	def name(self) -> str:
+		return self.corpus.song_names_and_metas[self.index][0]
+
+	@property
+	def meta(self) -> str:
+		return self.corpus.song_names_and_metas[self.index][1]
+
+	@property
+	def measures(self) -> List[MeasureView]:
+		corpus = self.corpus
+		arrays = corpus.arrays
+		a, b = corpus.measure_range(self.index)
+		note_offsets = arrays['measure_note_offsets'][a:b + 1].tolist()
+		base = note_offsets[0]
+		pitches = arrays['note_pitch'][base:note_offsets[-1]].tolist()
+		durations = arrays['note_duration'][base:note_offsets[-1]].tolist()
+		shift = corpus.pitch_shift % 12
+		if shift:
+			pitches = [None if p < 0 else (p + shift) % 12 for p in pitches]
+		else:
+			pitches = [None if p < 0 else p for p in pitches]
+		notes = list(zip(pitches, durations))
+
+		chords = corpus.chords
+		chord_names = corpus.chord_names
+		return [
+			MeasureView(chords[chord_id], chord_names[chord_name_id], start, end, reps, notes[note_start - base:note_end - base])
+			for chord_id, chord_name_id, start, end, reps, note_start, note_end in zip(
+				arrays['measure_chord'][a:b].tolist(),
+				arrays['measure_chord_name'][a:b].tolist(),
+				arrays['measure_start'][a:b].tolist(),
+				arrays['measure_end'][a:b].tolist(),
+				arrays['measure_reps'][a:b].tolist(),
+				note_offsets[:-1],
+				note_offsets[1:])
+		]
+
+	def __repr__(self):
+		return 'SongView({}, {}, {})'.format(repr(self.name), repr(self.meta), repr(self.measures))
+
+	def modify_chord(self, f: Callable[[Chord], Chord]) -> 'SongView':
+		return SongView(self.corpus.modify_chord(f), self.index)
+
+	def transpose(self, semitones: int) -> 'SongView':
+		return SongView(self.corpus.transpose(semitones), self.index)
+
+	def materialize(self) -> Song:
+		return Song(self.name, self.meta, [measure.materialize() for measure in self.measures])
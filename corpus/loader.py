@@ -0,0 +1,37 @@
+import importlib
+from typing import Iterable, Iterator, Optional
+
+import corpus.columnar as columnar
+
+corpus_names = ['rs', 'abc', 'marg']
+
+# Lazily iterate over songs from the columnar stores, e.g.
+#
+#   for song in iter_songs(sources=['rs', 'abc'], modes=['min']): ...
+#
+# Filters are applied to the per-corpus indexes before any song is touched:
+# sources decides which stores get opened at all, modes uses the mode index
+# written at dump time, and name_pattern (a regex, re.search'd) only looks at
+# song names. Modes are 'maj', 'min', and (rs only) 'mix'.
+
+def iter_songs(sources: Optional[Iterable[str]] = None, modes: Optional[Iterable[str]] = None, name_pattern: Optional[str] = None) -> Iterator[columnar.SongView]:
+	if sources is None:
+		sources = corpus_names
+	if modes is not None:
+		modes = list(modes)
+	for source in sources:
+		if source not in corpus_names:
+			raise ValueError('unknown corpus: {}'.format(source))
+		module = importlib.import_module('corpus.' + source)
+		yield from module.iter_songs(modes, name_pattern)
+
+def count_songs(sources: Optional[Iterable[str]] = None) -> dict:
+	"""{source: {mode: song count}}, straight from the indexes"""
+	if sources is None:
+		sources = corpus_names
+	ret = {}
+	for source in sources:
+		module = importlib.import_module('corpus.' + source)
+		store = columnar.ColumnarCorpus.load(module.columnar_path)
+		ret[source] = {mode: len(indices) for mode, indices in store.mode_index.items()}
+	return ret
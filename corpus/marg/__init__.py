@@ -1,14 +1,18 @@
 import os, csv, pickle, time
-from typing import List, Dict, Tuple, Union
+from typing import List, Dict, Tuple, Union, Optional, Iterable, Iterator
 from typing_extensions import Literal
 from collections import defaultdict, Counter
-import music21
 
 from measure import Measure, Song
+import corpus.columnar as columnar
 from chord import RelativeChord, RC, Chord
 
 cur_dirname = os.path.dirname(__file__)
 pickle_path = os.path.join(cur_dirname, 'marg.pickle')
+columnar_path = os.path.join(cur_dirname, 'marg.columnar')
+
+# song.meta is the key_mode column, which the paper says is always major
+mode_names = {'major': 'maj', 'minor': 'min'}
 marg_test_dirpath = os.path.join(cur_dirname, 'csv_test')
 marg_train_dirpath = os.path.join(cur_dirname, 'csv_train')
 
@@ -69,70 +73,80 @@ chord_merger: Dict[str, Union[RelativeChord, Literal['NC', 'pedal']]] = {
 	'pedal': 'pedal',
 }
 
+def list_sources() -> List[Tuple[str, ...]]:
+	sources = []
+	for dirpath in [marg_train_dirpath, marg_test_dirpath]:
+		for filename in sorted(os.listdir(dirpath)):
+			if filename.endswith('.csv'):
+				sources.append((os.path.join(dirpath, filename),))
+	return sources
+
+def parse_source(source: Tuple[str, ...]) -> List[Song]:
+	path, = source
+	filename = os.path.basename(path)
+	with open(path) as infile:
+		csv_reader = csv.DictReader(infile)
+		measure_label = None
+		measure = None
+		measures = []
+		i = 0
+		for row in csv_reader:
+			# this is not always an integer
+			# sometimes it's X1; I don't know what that means
+			tonic = 7 * int(row["key_fifths"]) % 12 # note that this is the tonic of the relative major (we're taking C for A minor)
+			# not that this *should* be a problem since the paper
+			# says all songs are in major key... :thinking:
+			mode = row["key_mode"]
+			abs_note_root = unscale(row["note_root"])
+			if abs_note_root is not None:
+				rel_note_root = (abs_note_root - tonic) % 12
+			else:
+				rel_note_root = None
+
+			melody_note = (rel_note_root, float(row["note_duration"]))
+
+			if row["measure"] != measure_label:
+				if measure is not None:
+					measures.append(measure)
+				measure_label = row["measure"]
+
+				chord_root = unscale(row["chord_root"])
+				if chord_root is not None:
+					relative_chord_root: int = (chord_root - tonic) % 12
+					relative_chord = chord_merger[row["chord_type"]]
+					if isinstance(relative_chord, str):
+						if relative_chord == 'NC':
+							chord = Chord(None, None)
+						else:
+							chord = Chord(relative_chord_root, None)
+					else:
+						chord = Chord(relative_chord_root, relative_chord)
+				else:
+					chord = Chord(None, None)
+
+				# TODO: sometimes chords probably change in a measure idk
+
+				measure = Measure(
+					chord=chord,
+					chord_name=row["chord_type"],
+					start=float(i),
+					end=float(i),
+					reps=1,
+					melody_notes=[melody_note],
+				)
+			else:
+				assert measure is not None
+				measure.melody_notes.append(melody_note)
+		if measure is not None:
+			measures.append(measure)
+	return [Song(filename, mode, measures)]
+
 def parse_songs() -> List[Song]:
 	print("Parsing CSV Leadsheet Database from MARG (Seoul National University)")
 	start_time = time.time()
 	songs: List[Song] = []
-	for dirpath in [marg_train_dirpath, marg_test_dirpath]:
-		print('-', dirpath)
-		for filename in os.listdir(dirpath):
-			if filename.endswith('.csv'):
-				with open(os.path.join(dirpath, filename)) as infile:
-					csv_reader = csv.DictReader(infile)
-					measure_label = None
-					measure = None
-					measures = []
-					i = 0
-					for row in csv_reader:
-						# this is not always an integer
-						# sometimes it's X1; I don't know what that means
-						tonic = 7 * int(row["key_fifths"]) % 12 # note that this is the tonic of the relative major (we're taking C for A minor)
-						# not that this *should* be a problem since the paper
-						# says all songs are in major key... :thinking:
-						mode = row["key_mode"]
-						abs_note_root = unscale(row["note_root"])
-						if abs_note_root is not None:
-							rel_note_root = (abs_note_root - tonic) % 12
-						else:
-							rel_note_root = None
-
-						melody_note = (rel_note_root, float(row["note_duration"]))
-
-						if row["measure"] != measure_label:
-							if measure is not None:
-								measures.append(measure)
-							measure_label = row["measure"]
-
-							chord_root = unscale(row["chord_root"])
-							if chord_root is not None:
-								relative_chord_root: int = (chord_root - tonic) % 12
-								relative_chord = chord_merger[row["chord_type"]]
-								if isinstance(relative_chord, str):
-									if relative_chord == 'NC':
-										chord = Chord(None, None)
-									else:
-										chord = Chord(relative_chord_root, None)
-								else:
-									chord = Chord(relative_chord_root, relative_chord)
-							else:
-								chord = Chord(None, None)
-
-							# TODO: sometimes chords probably change in a measure idk
-
-							measure = Measure(
-								chord=chord,
-								chord_name=row["chord_type"],
-								start=float(i),
-								end=float(i),
-								reps=1,
-								melody_notes=[melody_note],
-							)
-						else:
-							assert measure is not None
-							measure.melody_notes.append(melody_note)
-					if measure is not None:
-						measures.append(measure)
-				songs.append(Song(filename, mode, measures))
+	for source in list_sources():
+		songs.extend(parse_source(source))
 	print("Done in", time.time() - start_time, "seconds")
 	return songs
 
@@ -157,11 +171,20 @@ def tabulate_chord_types() -> Dict[str, int]:
 
 	return chord_type_dict
 
-def dump_songs():
+def dump_songs(songs: Optional[List[Song]] = None):
+	if songs is None:
+		songs = parse_songs()
 	with open(pickle_path, 'wb') as outfile:
-		pickle.dump(parse_songs(), outfile)
+		pickle.dump(songs, outfile)
+	columnar.dump(songs, columnar_path, [mode_names.get(song.meta, song.meta) for song in songs])
 
 def load_songs():
 	with open(pickle_path, 'rb') as infile:
 		songs = pickle.load(infile)
 	return songs
+
+def iter_songs(modes: Optional[Iterable[str]] = None, name_pattern: Optional[str] = None) -> Iterator[columnar.SongView]:
+	return columnar.ColumnarCorpus.load(columnar_path).iter_songs(modes, name_pattern)
+
+def load_columnar():
+	return columnar.ColumnarCorpus.load(columnar_path).songs()
@@ -0,0 +1,225 @@
+import argparse, importlib, os
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+from chord import Chord
+import corpus.columnar as columnar
+
+corpus_names = ['rs', 'abc', 'marg']
+
+# Which songs contain a chord progression, e.g.
+#
+#   song_counts(parse_progression('I V vi IV'))
+#     -> {'rs': {'let_it_be': 2, ...}, 'abc': {...}, 'marg': {...}}
+#
+# Each corpus gets one sequence of chord ids: every song's measures in order,
+# with runs of the same chord merged (so a chord held over two measures still
+# counts as one step of the progression) and a -1 between songs so matches
+# can't straddle them. A suffix array over that sequence turns "where does
+# this progression occur" into two binary searches, and the matches are a
+# contiguous slice of it, so counting them is free.
+#
+# Chords are relative to each song's key, so an exact match is the same
+# roman numerals; a transposed match is the same progression starting on any
+# scale degree. Matching is done at a "level": 'simplified' (root and
+# major/minor only, the default) or 'exact' (sevenths and inversions too).
+#
+# The index is built the first time it's needed and saved inside the corpus's
+# columnar store, next to the pickle. Dumping the corpus again replaces that
+# directory, which throws the index away with it.
+
+levels: Dict[str, Callable[[Chord], Chord]] = {
+	'simplified': Chord.simplified,
+	'exact': lambda chord: chord,
+}
+
+def suffix_array(seq: np.ndarray) -> np.ndarray:
+	"""positions of seq's suffixes in sorted order (prefix doubling: sort by
+	the first k elements, then use those ranks to sort by the first 2k)"""
+	n = len(seq)
+	if n == 0: return np.zeros(0, dtype=np.int64)
+	# ranks are >= 0; -1 means "past the end", which sorts before everything
+	rank = np.unique(seq, return_inverse=True)[1].astype(np.int64).reshape(-1)
+	k = 1
+	while True:
+		second = np.full(n, -1, dtype=np.int64)
+		second[:n - k] = rank[k:]
+		order = np.lexsort((second, rank))
+		changed = (rank[order][1:] != rank[order][:-1]) | (second[order][1:] != second[order][:-1])
+		rank = np.empty(n, dtype=np.int64)
+		rank[order] = np.concatenate([[0], np.cumsum(changed)])
+		if rank[order[-1]] == n - 1 or k >= n:
+			return order
+		k *= 2
+
+class CorpusProgressions:
+	def __init__(self, store: columnar.ColumnarCorpus, level: str, chord_ids: Dict[Chord, int], seq: np.ndarray, song_starts: np.ndarray, suffixes: np.ndarray):
+		self.store = store
+		self.level = level
+		self.chord_ids = chord_ids # level chord -> id in seq
+		self.seq = seq
+		self.song_starts = song_starts # song i is seq[song_starts[i]:song_starts[i+1] - 1], then a -1
+		self.suffixes = suffixes
+		self.seq_list = seq.tolist() # for the binary search, which compares short slices
+
+	@classmethod
+	def sequence(cls, store: columnar.ColumnarCorpus, level: str) -> Tuple[Dict[Chord, int], np.ndarray, np.ndarray]:
+		key = levels[level]
+		chord_ids: Dict[Chord, int] = {}
+		vocab_ids = []
+		for chord in store.chords:
+			vocab_ids.append(chord_ids.setdefault(key(chord), len(chord_ids)))
+
+		offsets = store.arrays['song_measure_offsets']
+		measure_ids = np.array(vocab_ids, dtype=np.int32)[store.arrays['measure_chord']] if len(vocab_ids) else np.zeros(0, dtype=np.int32)
+		measure_song = np.repeat(np.arange(len(store)), np.diff(offsets))
+		# keep a measure if it starts a song or changes the chord
+		keep = np.ones(len(measure_ids), dtype=bool)
+		keep[1:] = (measure_ids[1:] != measure_ids[:-1]) | (measure_song[1:] != measure_song[:-1])
+		kept_ids = measure_ids[keep]
+		kept_song = measure_song[keep]
+
+		# each song then gets a -1 after it, so everything in song i moves
+		# right by i
+		lengths = np.bincount(kept_song, minlength=len(store)) + 1
+		song_starts = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+		seq = np.full(song_starts[-1], -1, dtype=np.int32)
+		seq[np.arange(len(kept_ids)) + kept_song] = kept_ids
+		return chord_ids, seq, song_starts
+
+	@classmethod
+	def build(cls, store: columnar.ColumnarCorpus, level: str = 'simplified') -> 'CorpusProgressions':
+		chord_ids, seq, song_starts = cls.sequence(store, level)
+		return cls(store, level, chord_ids, seq, song_starts, suffix_array(seq))
+
+	@classmethod
+	def load(cls, store: columnar.ColumnarCorpus, level: str = 'simplified') -> 'CorpusProgressions':
+		"""the saved index for this store, building and saving it if needed"""
+		chord_ids, seq, song_starts = cls.sequence(store, level)
+		path = None if store.dirpath is None else os.path.join(store.dirpath, 'progression_suffixes_{}.npy'.format(level))
+		if path is not None:
+			try:
+				suffixes = np.load(path)
+				if suffixes.shape == seq.shape:
+					return cls(store, level, chord_ids, seq, song_starts, suffixes)
+			except (OSError, ValueError):
+				pass
+
+		suffixes = suffix_array(seq)
+		if path is not None:
+			try:
+				tmp_path = path + '.tmp.npy'
+				np.save(tmp_path, suffixes)
+				os.replace(tmp_path, path)
+			except OSError:
+				pass # read-only store; we'll just build it again next time
+		return cls(store, level, chord_ids, seq, song_starts, suffixes)
+
+	def search(self, ids: List[int]) -> Tuple[int, int]:
+		"""[lo, hi) range of self.suffixes that start with ids"""
+		m = len(ids)
+		seq = self.seq_list
+		suffixes = self.suffixes
+		lo, hi = 0, len(suffixes)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			p = int(suffixes[mid])
+			if seq[p:p + m] < ids: lo = mid + 1
+			else: hi = mid
+		start = lo
+		hi = len(suffixes)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			p = int(suffixes[mid])
+			if seq[p:p + m] <= ids: lo = mid + 1
+			else: hi = mid
+		return (start, lo)
+
+	def positions(self, progression: List[Chord]) -> np.ndarray:
+		"""where in self.seq the progression starts"""
+		key = levels[self.level]
+		ids = []
+		for chord in progression:
+			chord_id = self.chord_ids.get(key(chord))
+			if chord_id is None: return np.zeros(0, dtype=np.int64)
+			# merge runs in the query the same way as in the corpus
+			if not ids or ids[-1] != chord_id:
+				ids.append(chord_id)
+		if not ids: return np.zeros(0, dtype=np.int64)
+		lo, hi = self.search(ids)
+		return self.suffixes[lo:hi]
+
+	def song_counts(self, progression: List[Chord], transposed: bool = False) -> Dict[str, int]:
+		"""{song name: number of occurrences}, in corpus order"""
+		if transposed:
+			# unique because N.C. transposes to itself, so a progression of
+			# nothing but N.C. would otherwise match 12 times over
+			positions = np.unique(np.concatenate([self.positions([chord.transpose(steps) for chord in progression]) for steps in range(12)]))
+		else:
+			positions = self.positions(progression)
+		songs, counts = np.unique(np.searchsorted(self.song_starts, positions, side='right') - 1, return_counts=True)
+		names = self.store.song_names_and_metas
+		return {names[song][0]: int(count) for song, count in zip(songs.tolist(), counts.tolist())}
+
+indexes: Dict[Tuple[str, str], CorpusProgressions] = {}
+
+def load_index(source: str, level: str = 'simplified') -> CorpusProgressions:
+	if source not in corpus_names:
+		raise ValueError('unknown corpus: {}'.format(source))
+	if level not in levels:
+		raise ValueError('unknown level: {}'.format(level))
+	if (source, level) not in indexes:
+		module = importlib.import_module('corpus.' + source)
+		indexes[(source, level)] = CorpusProgressions.load(columnar.ColumnarCorpus.load(module.columnar_path), level)
+	return indexes[(source, level)]
+
+def song_counts(progression: List[Chord], sources: Optional[Iterable[str]] = None, level: str = 'simplified', transposed: bool = False) -> Dict[str, Dict[str, int]]:
+	"""{source: {song name: number of occurrences}}"""
+	if sources is None:
+		sources = corpus_names
+	return {source: load_index(source, level).song_counts(progression, transposed) for source in sources}
+
+def count(progression: List[Chord], sources: Optional[Iterable[str]] = None, level: str = 'simplified', transposed: bool = False) -> int:
+	"""total occurrences"""
+	return sum(sum(counts.values()) for counts in song_counts(progression, sources, level, transposed).values())
+
+def song_count(progression: List[Chord], sources: Optional[Iterable[str]] = None, level: str = 'simplified', transposed: bool = False) -> int:
+	"""number of songs the progression occurs in at least once"""
+	return sum(len(counts) for counts in song_counts(progression, sources, level, transposed).values())
+
+def parse_progression(s: str) -> List[Chord]:
+	"""'I V vi IV' -> chords, using the roman numerals Chord.to_roman_numeral
+	produces for the chords in the corpora"""
+	for source in corpus_names:
+		module = importlib.import_module('corpus.' + source)
+		if os.path.exists(module.columnar_path):
+			columnar.ColumnarCorpus.load(module.columnar_path)
+	numerals = {}
+	for chord in list(Chord.vocabulary):
+		numerals.setdefault(chord.to_roman_numeral(), chord)
+	ret = []
+	for token in s.replace('-', ' ').replace('–', ' ').split():
+		if token not in numerals:
+			raise ValueError('unknown roman numeral: {}'.format(token))
+		ret.append(numerals[token])
+	return ret
+
+def main():
+	parser = argparse.ArgumentParser(description='Find corpus songs containing a chord progression.')
+	parser.add_argument('progression', nargs='+', help='roman numerals relative to the key, e.g. I V vi IV')
+	parser.add_argument('--sources', nargs='+', default=corpus_names, help='which corpora to search (default: all)')
+	parser.add_argument('--exact', action='store_true', help='match sevenths and inversions too, not just root and major/minor')
+	parser.add_argument('--transposed', action='store_true', help='also match the progression starting on any other scale degree')
+	parser.add_argument('-n', type=int, default=20, help='how many songs to list per corpus')
+	args = parser.parse_args()
+
+	progression = parse_progression(' '.join(args.progression))
+	level = 'exact' if args.exact else 'simplified'
+	results = song_counts(progression, args.sources, level, args.transposed)
+	for source, counts in results.items():
+		print('{}: {} occurrences in {} songs'.format(source, sum(counts.values()), len(counts)))
+		for name, n in sorted(counts.items(), key=lambda p: -p[1])[:args.n]:
+			print('  {:4} {}'.format(n, name))
+
+if __name__ == '__main__':
+	main()
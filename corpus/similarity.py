@@ -0,0 +1,190 @@
+import importlib, os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+
+from chord import Chord, C
+import corpus.columnar as columnar
+from corpus.progressions import CorpusProgressions
+
+corpus_names = ['rs', 'abc', 'marg']
+
+# "Which corpus songs sound like this harmonization?"
+#
+# Every song gets a fingerprint: how much of it is spent on each of the 24
+# simplified triads (weighted by reps), and how often it moves from one to
+# another (runs of the same chord merged, like corpus.progressions). Both
+# halves are normalized to sum to 1, concatenated, and the whole vector is
+# scaled to unit length, so similarity is a dot product and "most similar to
+# x" over a corpus is one matrix-vector product and an argpartition.
+# Everything is relative to the song's key, like the chords themselves.
+#
+# N.C. and pedal chords don't count toward either half.
+#
+# The brute-force kernel takes well under a millisecond for all our corpora
+# put together; for much bigger ones, build_approximate() clusters the
+# fingerprints (k-means) and nearest(..., approximate=True) only scores the
+# songs in the few clusters closest to the query.
+
+simple_chords = C.all_simple_chords
+simple_chord_index = {chord: i for i, chord in enumerate(simple_chords)}
+n_chords = len(simple_chords)
+dimensions = n_chords + n_chords * n_chords
+
+# how much the transition half counts relative to the chord half
+transition_weight = 1.0
+
+def feature_of(chord: Chord) -> int:
+	"""index into simple_chords, or -1 for N.C./pedals"""
+	if chord.root is None or chord.relative_chord is None: return -1
+	return simple_chord_index[chord.simplified()]
+
+def normalize_rows(chord_part: np.ndarray, transition_part: np.ndarray) -> np.ndarray:
+	chord_part = chord_part / np.maximum(chord_part.sum(axis=1, keepdims=True), 1e-12)
+	transition_part = transition_weight * transition_part / np.maximum(transition_part.sum(axis=1, keepdims=True), 1e-12)
+	ret = np.concatenate([chord_part, transition_part], axis=1)
+	ret /= np.maximum(np.linalg.norm(ret, axis=1, keepdims=True), 1e-12)
+	return ret.astype(np.float32)
+
+def fingerprint(chords: Sequence[Chord], reps: Optional[Sequence[float]] = None) -> np.ndarray:
+	"""fingerprint of one harmonization, e.g. the chords the predictor picked
+	(relative to the key, one per measure)"""
+	if reps is None:
+		reps = [1] * len(chords)
+	chord_part = np.zeros((1, n_chords))
+	transition_part = np.zeros((1, n_chords * n_chords))
+	last = None
+	for chord, r in zip(chords, reps):
+		f = feature_of(chord)
+		if f >= 0:
+			chord_part[0, f] += r
+		# same run merging as the corpus: only a change of chord is a step
+		if chord is last: continue
+		if last is not None and f >= 0 and feature_of(last) >= 0:
+			transition_part[0, feature_of(last) * n_chords + f] += 1
+		last = chord
+	return normalize_rows(chord_part, transition_part)[0]
+
+def compute_fingerprints(store: columnar.ColumnarCorpus) -> np.ndarray:
+	features = np.array([feature_of(chord) for chord in store.chords], dtype=np.int64)
+
+	# chord half: the per-song chord counts, merged into triads
+	merge = np.zeros((len(store.chords), n_chords))
+	vocab = np.flatnonzero(features >= 0)
+	merge[vocab, features[vocab]] = 1
+	chord_part = store.song_chord_counts() @ merge
+
+	# transition half: consecutive pairs in the merged-runs sequence
+	chord_ids, seq, song_starts = CorpusProgressions.sequence(store, 'exact')
+	level_features = np.full(len(chord_ids) + 1, -1) # the extra slot is for the -1 separators
+	for chord, chord_id in chord_ids.items():
+		level_features[chord_id] = feature_of(chord)
+	seq_features = level_features[seq]
+	a, b = seq_features[:-1], seq_features[1:]
+	valid = (a >= 0) & (b >= 0)
+	positions = np.flatnonzero(valid)
+	songs = np.searchsorted(song_starts, positions, side='right') - 1
+	transition_part = np.zeros((len(store), n_chords * n_chords))
+	np.add.at(transition_part, (songs, a[valid] * n_chords + b[valid]), 1)
+
+	return normalize_rows(chord_part, transition_part)
+
+def load_fingerprints(store: columnar.ColumnarCorpus) -> np.ndarray:
+	"""store's fingerprints, computed once and then saved inside it"""
+	path = None if store.dirpath is None else os.path.join(store.dirpath, 'fingerprints.npy')
+	if path is not None:
+		try:
+			fingerprints = np.load(path)
+			if fingerprints.shape == (len(store), dimensions):
+				return fingerprints
+		except (OSError, ValueError):
+			pass
+
+	fingerprints = compute_fingerprints(store)
+	if path is not None:
+		try:
+			tmp_path = path + '.tmp.npy'
+			np.save(tmp_path, fingerprints)
+			os.replace(tmp_path, path)
+		except OSError:
+			pass # read-only store; we'll just compute them again next time
+	return fingerprints
+
+class SimilarityIndex:
+	def __init__(self, songs: List[Tuple[str, str]], fingerprints: np.ndarray):
+		self.songs = songs # (source, song name), one per row
+		self.fingerprints = fingerprints
+		# set by build_approximate
+		self.centroids: Optional[np.ndarray] = None
+		self.lists: List[np.ndarray] = []
+
+	@classmethod
+	def load(cls, sources: Optional[Iterable[str]] = None) -> 'SimilarityIndex':
+		if sources is None:
+			sources = corpus_names
+		songs = []
+		matrices = []
+		for source in sources:
+			module = importlib.import_module('corpus.' + source)
+			store = columnar.ColumnarCorpus.load(module.columnar_path)
+			songs.extend((source, name) for name, _ in store.song_names_and_metas)
+			matrices.append(load_fingerprints(store))
+		return cls(songs, np.concatenate(matrices) if matrices else np.zeros((0, dimensions), dtype=np.float32))
+
+	def build_approximate(self, n_lists: Optional[int] = None, iterations: int = 10, seed: int = 0):
+		"""cluster the fingerprints into n_lists groups (default about
+		sqrt(songs)) for nearest(..., approximate=True)"""
+		n = len(self.fingerprints)
+		if n_lists is None:
+			n_lists = max(1, int(np.sqrt(n)))
+		n_lists = min(n_lists, n)
+		rng = np.random.default_rng(seed)
+		# fitting on a sample is plenty to place the centroids
+		sample = self.fingerprints[np.sort(rng.choice(n, min(n, 50 * n_lists), replace=False))]
+		centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+		for _ in range(iterations):
+			# rows are unit length, so the closest centroid is the one with
+			# the biggest dot product (once centroids are renormalized)
+			assignment = np.argmax(sample @ centroids.T, axis=1)
+			# sum each cluster's members in one pass (empty clusters keep
+			# their old centroid); the mean's scale doesn't matter
+			order = np.argsort(assignment, kind='stable')
+			clusters, starts = np.unique(assignment[order], return_index=True)
+			centroids[clusters] = np.add.reduceat(sample[order], starts, axis=0)
+			centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+		assignment = np.argmax(self.fingerprints @ centroids.T, axis=1)
+		self.centroids = centroids
+		self.lists = [np.flatnonzero(assignment == i) for i in range(n_lists)]
+
+	def nearest(self, query: np.ndarray, k: int = 10, approximate: bool = False, n_probe: int = 4) -> List[Tuple[float, str, str]]:
+		"""[(similarity, source, song name)], most similar first"""
+		# nothing to compare (no chords that count), and every song would
+		# tie at 0
+		if not np.any(query): return []
+		if approximate:
+			if self.centroids is None:
+				self.build_approximate()
+			n_probe = min(n_probe, len(self.lists))
+			closest_lists = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+			candidates = np.concatenate([self.lists[i] for i in closest_lists])
+		else:
+			candidates = None
+
+		matrix = self.fingerprints if candidates is None else self.fingerprints[candidates]
+		scores = matrix @ query
+		k = min(k, len(scores))
+		if k == 0: return []
+		top = np.argpartition(-scores, k - 1)[:k]
+		top = top[np.argsort(-scores[top], kind='stable')]
+		rows = top if candidates is None else candidates[top]
+		return [(float(scores[i]), *self.songs[row]) for i, row in zip(top.tolist(), rows.tolist())]
+
+	def similar_songs(self, chords: Sequence[Chord], k: int = 10, approximate: bool = False) -> List[Tuple[float, str, str]]:
+		return self.nearest(fingerprint(chords), k, approximate)
+
+indexes: Dict[Tuple[str, ...], SimilarityIndex] = {}
+
+def load_index(sources: Optional[Iterable[str]] = None) -> SimilarityIndex:
+	key = tuple(corpus_names if sources is None else sources)
+	if key not in indexes:
+		indexes[key] = SimilarityIndex.load(key)
+	return indexes[key]
@@ -0,0 +1,383 @@
+import hashlib, json, os, threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import corpus.rs
+import corpus.abc
+import corpus.marg
+import corpus.similarity
+from hmmpredictor import SongCounts, SongStatSet, StreamingHarmonizer, linearly_mixed_hmm_predict, mix_stat_sets
+from chord import Chord
+from render import RenderTable
+
+# Everything between "here's a request" and "here's the response", shared by
+# the websocket server and the batch CLI. Requests and responses are the JSON
+# objects the client sends and receives, as dicts.
+
+# one function object so the columnar corpora only collapse their chord
+# vocabularies once, rather than once per song
+def beta_collapse(chord: Chord) -> Chord:
+	return chord.beta_collapse()
+
+# Responses to harmonize requests, keyed by everything in the request that
+# can change the response (see cache_key). Filled by real requests and, with
+# the server's --speculate, by guesses at the next ones.
+class ResponseCache:
+	def __init__(self, max_entries: int = 256):
+		self.max_entries = max_entries
+		self.entries: 'OrderedDict[str, dict]' = OrderedDict()
+		# the server speculates on another thread
+		self.lock = threading.Lock()
+
+	def get(self, key: str) -> Optional[dict]:
+		with self.lock:
+			response = self.entries.get(key)
+			if response is not None:
+				self.entries.move_to_end(key)
+			return response
+
+	def __contains__(self, key: str) -> bool:
+		return key in self.entries
+
+	def put(self, key: str, response: dict):
+		with self.lock:
+			self.entries[key] = response
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.max_entries:
+				self.entries.popitem(last=False)
+
+# which stat sets each mode needs
+mode_stat_sets = {
+	'major': ['major'],
+	'parallel-minor': ['minor'],
+	'relative-minor': ['minor'],
+	'mixed-parallel': ['major', 'minor'],
+	'mixed-relative': ['major', 'minor'],
+}
+
+class WarmingUp(Exception):
+	"""the model can't do this mode yet; see build_model_stages"""
+	def __init__(self, mode: str, ready_modes: List[str]):
+		super().__init__('still loading the model for {}'.format(mode))
+		self.mode = mode
+		self.ready_modes = ready_modes
+
+# Named stat sets a request can mix with arbitrary weights instead of picking
+# a mode: {'weights': {'rs:major': 0.5, 'abc:major': 0.3, 'marg:major': 0.2}}.
+# 'major', 'minor', and 'relative-minor' are all the corpora together, like
+# the modes use; '<corpus>:<mode>' is one corpus (rs major includes its
+# mixolydian songs). Weights are relative; they're scaled to add up to 1.
+corpus_modes = {
+	'rs': ['major', 'minor'],
+	'abc': ['major', 'minor'],
+	'marg': ['major'],
+}
+
+def stat_set_names() -> List[str]:
+	names = ['major', 'minor', 'relative-minor']
+	for source, modes in corpus_modes.items():
+		for mode in modes:
+			names.append('{}:{}'.format(source, mode))
+			if mode == 'minor':
+				names.append('{}:relative-minor'.format(source))
+	return names
+
+class Model:
+	# parallel_minor_stat_set is None while it's still being built, in which
+	# case only major mode works. corpus_stat_sets are the '<corpus>:<mode>'
+	# ones (major and minor; relative minor is derived here)
+	def __init__(self, major_stat_set: SongStatSet, parallel_minor_stat_set: Optional[SongStatSet], corpus_stat_sets: Optional[Dict[str, SongStatSet]] = None):
+		self.major_stat_set = major_stat_set
+		self.parallel_minor_stat_set = parallel_minor_stat_set
+		# the same stats as recounting [song.transpose(-3) for song in minor_songs]
+		self.relative_minor_stat_set = None if parallel_minor_stat_set is None else parallel_minor_stat_set.transposed(-3)
+
+		# see stat_set_names
+		self.named_stat_sets: Dict[str, SongStatSet] = {'major': major_stat_set}
+		if self.parallel_minor_stat_set is not None and self.relative_minor_stat_set is not None:
+			self.named_stat_sets['minor'] = self.parallel_minor_stat_set
+			self.named_stat_sets['relative-minor'] = self.relative_minor_stat_set
+		for name, stat_set in (corpus_stat_sets or {}).items():
+			self.named_stat_sets[name] = stat_set
+			if name.endswith(':minor'):
+				self.named_stat_sets[name[:-len('minor')] + 'relative-minor'] = stat_set.transposed(-3)
+
+		# compile them for mixing now, so worker processes share that too
+		for stat_set in self.named_stat_sets.values():
+			stat_set.compiled()
+
+		stat_sets = [stat_set for stat_set in [self.major_stat_set, self.parallel_minor_stat_set, self.relative_minor_stat_set] if stat_set is not None]
+		self.all_chords = list(sorted(set().union(*(stat_set.all_chords() for stat_set in stat_sets))))
+		self.render_table = RenderTable(self.all_chords)
+		self.all_chords_cache: Dict[Tuple[int, int], List[dict]] = {}
+		# loaded last by build_model_stages
+		self.similarity_index: Optional[corpus.similarity.SimilarityIndex] = None
+		# per model, so a reload starts over with an empty one
+		self.response_cache = ResponseCache()
+
+	def ready_modes(self) -> List[str]:
+		built = ['major'] + ([] if self.parallel_minor_stat_set is None else ['minor'])
+		return [mode for mode, needed in mode_stat_sets.items() if all(name in built for name in needed)]
+
+	def ready(self) -> bool:
+		return self.parallel_minor_stat_set is not None
+
+	def productionize_chord(self, chord: Chord, key_signature: int, score: float, bottom_bass: int):
+		return self.render_table.productionize(chord, key_signature, score, bottom_bass)
+
+	# every response lists all chords, which only depends on these two
+	def productionized_all_chords(self, key_signature: int, bottom_bass: int):
+		key = (key_signature, bottom_bass)
+		if key not in self.all_chords_cache:
+			self.all_chords_cache[key] = [self.productionize_chord(c, key_signature, 0, bottom_bass) for c in self.all_chords]
+		return self.all_chords_cache[key]
+
+	def stat_sets_for_mode(self, mode: str, minorness: float) -> List[Tuple[float, SongStatSet]]:
+		if mode in mode_stat_sets and mode not in self.ready_modes():
+			raise WarmingUp(mode, self.ready_modes())
+		if mode == 'major': return [(1.0, self.major_stat_set)]
+		elif mode == 'parallel-minor': return [(1.0, self.parallel_minor_stat_set)]
+		elif mode == 'relative-minor': return [(1.0, self.relative_minor_stat_set)]
+		elif mode == 'mixed-parallel': return [(1.0 - minorness, self.major_stat_set), (minorness, self.parallel_minor_stat_set)]
+		elif mode == 'mixed-relative': return [(1.0 - minorness, self.major_stat_set), (minorness, self.relative_minor_stat_set)]
+		else: return [(1.0, self.major_stat_set)] # ?????
+
+	def stat_sets_for_weights(self, weights: Dict[str, float]) -> List[Tuple[float, SongStatSet]]:
+		"""weights are {name: weight} with names from stat_set_names()"""
+		total = 0.0
+		for name, weight in weights.items():
+			if name not in stat_set_names():
+				raise ValueError('unknown stat set: {}'.format(name))
+			if name not in self.named_stat_sets:
+				raise WarmingUp(name, self.ready_modes())
+			if not weight >= 0:
+				raise ValueError('weights must be nonnegative: {}'.format(weight))
+			total += weight
+		if total <= 0:
+			raise ValueError('weights must not all be zero')
+		# in a fixed order, so the same weights mix the same way
+		return [(weights[name] / total, self.named_stat_sets[name]) for name in sorted(weights) if weights[name] > 0]
+
+def build_model_stages(similarity_index: bool = True) -> Iterator[Model]:
+	"""yields a major-only model as soon as that's built, then the full one;
+	after that, loads the full one's similarity index, unless told not to"""
+	rs_songs = corpus.rs.load_columnar()
+	abc_songs = corpus.abc.load_columnar()
+	marg_songs = corpus.marg.load_columnar()
+	print("loaded songs")
+
+	# each corpus is counted once; the combined stats are the sums
+	def count(songs) -> SongCounts:
+		return SongCounts.from_songs([song.modify_chord(beta_collapse) for song in songs])
+
+	major_counts = {
+		'rs': count(rs_songs['maj'] + rs_songs['mix']),
+		'abc': count(abc_songs['maj']),
+		'marg': count(marg_songs),
+	}
+	corpus_stat_sets = {source + ':major': SongStatSet.from_counts(counts) for source, counts in major_counts.items()}
+	major_stat_set = SongStatSet.from_counts(major_counts['rs'] + major_counts['abc'] + major_counts['marg'])
+	yield Model(major_stat_set, None, corpus_stat_sets)
+
+	minor_counts = {
+		'rs': count(rs_songs['min']),
+		'abc': count(abc_songs['min']),
+	}
+	corpus_stat_sets.update((source + ':minor', SongStatSet.from_counts(counts)) for source, counts in minor_counts.items())
+	minor_stat_set = SongStatSet.from_counts(minor_counts['rs'] + minor_counts['abc'])
+	model = Model(major_stat_set, minor_stat_set, corpus_stat_sets)
+	yield model
+
+	# only "sounds like" requests need it, so it comes last, but it's still
+	# part of building the model: with --lazy that happens off the event
+	# loop, and with -w before the workers fork, so they share it. Not
+	# load_index, which would hand back the same index after a reload.
+	if similarity_index:
+		model.similarity_index = corpus.similarity.SimilarityIndex.load()
+
+def build_model(similarity_index: bool = True) -> Model:
+	for model in build_model_stages(similarity_index):
+		pass
+	return model
+
+def corpus_signature() -> Optional[Tuple]:
+	"""changes whenever a corpus build_model reads is dumped again; None
+	while one is missing (e.g. in the middle of being dumped)"""
+	ret = []
+	for module in [corpus.rs, corpus.abc, corpus.marg]:
+		try:
+			# dumping writes a new directory and renames it into place, so
+			# the inode changes even if the mtime doesn't
+			st = os.stat(os.path.join(module.columnar_path, 'meta.json'))
+		except OSError:
+			return None
+		ret.append((st.st_ino, st.st_mtime_ns))
+	return tuple(ret)
+
+# Live mode: the client sends {'seq', 'live': {...}} once per finished
+# measure, with that measure's MIDI pitches in 'notes'. The first message (or
+# one with 'reset') sets the model up from keySignature, mode, minorness,
+# jazziness, firstWeight, and lag; 'end' flushes the rest of the piece.
+def handle_live(model: Model, live: dict, state: dict) -> dict:
+	if live.get('reset') or 'harmonizer' not in state:
+		state['key_signature'] = live['keySignature']
+		state['harmonizer'] = StreamingHarmonizer(
+			model.stat_sets_for_weights(live['weights']) if live.get('weights') else model.stat_sets_for_mode(live['mode'], live.get('minorness', 0.0)),
+			lag=live.get('lag', 2),
+			jazziness=live.get('jazziness', 0.0),
+			first_note_weight=live.get('firstWeight', 1.0))
+	harmonizer: StreamingHarmonizer = state['harmonizer']
+	key_signature = state['key_signature']
+	bottom_bass = live['bottomBass']
+	midi_root_of_major = key_signature * 7 % 12
+
+	def productionize_committed(t: int, chord: Chord):
+		return {'measure': t, 'value': model.productionize_chord(chord, key_signature, 1.0, bottom_bass)}
+
+	if live.get('end'):
+		return {'committed': [productionize_committed(t, chord) for t, chord in harmonizer.flush()]}
+
+	t = harmonizer.measures_seen
+	committed, provisional = harmonizer.push([(pitch - midi_root_of_major) % 12 for pitch in live['notes']])
+	return {
+		'measure': t,
+		'committed': [productionize_committed(*committed)] if committed else [],
+		'provisional': model.productionize_chord(provisional, key_signature, 1.0, bottom_bass),
+	}
+
+# "Sounds like": the client sends {'seq', 'similar': {'chords': [...],
+# 'keySignature', 'count'}} with the 'value' of each chord of the current
+# harmonization, and gets back the most similar corpus songs.
+def handle_similar(model: Model, similar: dict) -> List[dict]:
+	if model.similarity_index is None:
+		raise WarmingUp('similar songs', model.ready_modes())
+	key_signature = similar['keySignature']
+	chords = [Chord.parse(value).absolute_to_relative(key_signature) for value in similar['chords']]
+	return [{'source': source, 'name': name, 'score': score} for score, source, name in model.similarity_index.similar_songs(chords, similar.get('count', 10))]
+
+def default_constraints(music: dict, chord_length: float) -> List[dict]:
+	# what we harmonize when the client doesn't have chords yet
+	last_end = max(note['end'] for note in music['notes'])
+	return [{'time': i * chord_length, 'locked': False} for i in range(1 + int(last_end // chord_length))]
+
+def cache_key(ans: dict) -> str:
+	"""the same for any two requests harmonize answers the same way, up to
+	seq (mostly; it doesn't try hard)"""
+	constraints = ans['constraints'] or default_constraints(ans['music'], ans['chordLength'])
+	preserve = ans['preserve'] and bool(ans['constraints'])
+	relevant = dict(ans)
+	del relevant['seq']
+	relevant['preserve'] = preserve
+	# the values of unlocked chords only matter if we're preserving them, and
+	# the client always sends back whatever we last told it
+	relevant['constraints'] = [{'time': c['time'], 'locked': c['locked'], 'value': c.get('value') if c['locked'] or preserve else None} for c in constraints]
+	if ans.get('weights'):
+		# the weights replace the mode, and the request might not have one
+		relevant['mode'] = relevant['minorness'] = None
+	elif ans['mode'] not in ('mixed-parallel', 'mixed-relative'):
+		relevant['minorness'] = None
+	if ans['seed'] is None:
+		relevant['determinismWeight'] = None
+	return hashlib.sha1(json.dumps(relevant, sort_keys=True).encode('utf-8')).hexdigest()
+
+def request_stat_sets(model: Model, ans: dict) -> List[Tuple[float, SongStatSet]]:
+	return model.stat_sets_for_weights(ans['weights']) if ans.get('weights') else model.stat_sets_for_mode(ans['mode'], ans['minorness'])
+
+def harmonize_cost(model: Model, ans: dict) -> int:
+	"""roughly proportional to how long harmonize(model, ans) takes: the
+	predictor does about measures * chords^2 work, with the chords of the mix
+	it decodes with (which harmonize then gets from the mix cache)"""
+	measures = len(ans['constraints'] or default_constraints(ans['music'], ans['chordLength']))
+	chords = len(mix_stat_sets(request_stat_sets(model, ans), ans['firstWeight']).appearance_chords)
+	return measures * chords ** 2
+
+def cached_harmonize(model: Model, ans: dict, low_memory: bool = False) -> Tuple[dict, bool]:
+	"""harmonize, but from model.response_cache if we can; also says whether
+	it was a cache hit"""
+	key = cache_key(ans)
+	response = model.response_cache.get(key)
+	if response is not None:
+		return dict(response, seq=ans['seq']), True
+	response = harmonize(model, ans, low_memory)
+	model.response_cache.put(key, response)
+	return response, False
+
+# beam_width gives a quick approximate answer; see linearly_mixed_hmm_predict
+def harmonize(model: Model, ans: dict, low_memory: bool = False, beam_width: Optional[int] = None, should_stop: Optional[Callable[[], bool]] = None) -> dict:
+	seq_number = ans['seq']
+	music = ans['music']
+	chord_length = ans['chordLength']
+	jazziness = ans['jazziness']
+	first_weight = ans['firstWeight']
+	determinism_weight = ans['determinismWeight']
+	seed = ans['seed']
+	bottom_bass = ans['bottomBass']
+
+	# this is a p bad name tbh
+	constraints = ans['constraints'] # Optional[List[{'time': float, 'value': str, 'locked': bool}]]
+	raw_notes = music['notes']
+	key_signature = ans['keySignature']
+	minorness = ans.get('minorness')
+	tolerance = ans['tolerance']
+	mode = ans.get('mode') # None if there are weights instead
+	preserve = ans['preserve'] # preserve even unlocked stuff
+
+	# before anything else, in case this mode isn't loaded yet
+	stat_set_list = request_stat_sets(model, ans)
+
+	midi_root_of_major = key_signature * 7 % 12
+	# even for relative minor we're going to use the major root for simplicity;
+	# we can transpose all the data, so it's fine.
+	if not constraints:
+		constraints = default_constraints(music, chord_length)
+		preserve = False
+
+	grouped_notes = []
+
+	notes_ix = 0
+	# get all but last measure
+	for constraint, next_constraint in zip(constraints, constraints[1:]):
+		start = constraint['time']
+		end = next_constraint['time']
+
+		group = []
+		while notes_ix < len(raw_notes) and raw_notes[notes_ix]['start'] < end - tolerance:
+			group.append((raw_notes[notes_ix]['pitch'] - midi_root_of_major) % 12)
+			notes_ix += 1
+		grouped_notes.append(group)
+
+	# followed by last group
+	last_group = []
+	while notes_ix < len(raw_notes):
+		last_group.append((raw_notes[notes_ix]['pitch'] - midi_root_of_major) % 12)
+		notes_ix += 1
+	grouped_notes.append(last_group)
+
+	assert len(grouped_notes) == len(constraints)
+
+	print('------------------------')
+	print('constraints:', constraints)
+	locked_chords = [Chord.parse(constraint['value']).absolute_to_relative(key_signature) if constraint['locked'] else None for constraint in constraints]
+
+	if preserve:
+		preserve_chords = [Chord.parse(constraint['value']).absolute_to_relative(key_signature) for constraint in constraints]
+	else:
+		preserve_chords = None
+
+	chords = linearly_mixed_hmm_predict(stat_set_list, grouped_notes, locked_chords, preserve_chords, jazziness=jazziness, seed=seed, first_note_weight=first_weight, determinism_weight=determinism_weight, low_memory=low_memory, beam_width=beam_width, should_stop=should_stop)
+	res = []
+	for i, ((chord_score, chord), suggestion, scored_chord_list) in enumerate(chords):
+		res.append({
+			'time': constraints[i]['time'],
+			'value': model.productionize_chord(chord, key_signature, chord_score, bottom_bass),
+			'suggestion': model.productionize_chord(suggestion[1], key_signature, suggestion[0], bottom_bass) if suggestion else None,
+			'locked': i < len(locked_chords) and locked_chords[i] is not None,
+			'recommendations': [model.productionize_chord(c, key_signature, s, bottom_bass) for (s, c) in scored_chord_list],
+		})
+	print('------------------------')
+	print('result:', res)
+	return {
+		'seq': seq_number,
+		'allChords': model.productionized_all_chords(key_signature, bottom_bass),
+		'result': res,
+	}
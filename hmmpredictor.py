@@ -1,9 +1,13 @@
 import pickle
 import os
-from collections import defaultdict, Counter
-from typing import Dict, List, Iterable, Set, Tuple, TypeVar, Optional
+from collections import defaultdict, Counter, OrderedDict
+from typing import Any, Callable, Dict, List, Iterable, Iterator, Mapping, Sequence, Set, Tuple, TypeVar, Optional
+import heapq
 import math
 import random
+import threading
+from array import array
+import numpy as np
 
 from measure import Measure, Song
 from chord import Chord
@@ -43,26 +47,23 @@ def compute_transition_log_probs(seen_chords: Dict[Chord, int], transitions: Dic
 	
 	return (transition_log_probs, back_transition_log_probs)
 
-class SongStatSet:
+# What SongStatSet.from_songs counts. Counts of different sets of songs add
+# up to the counts of all of them, so we can count each corpus once and get
+# stat sets for any combination of them without going over the songs again.
+class SongCounts:
 	def __init__(self,
-			seen_log_probs: Dict[Chord, float],
-			transition_log_probs: Dict[Chord, Dict[Chord, float]],
-			back_transition_log_probs: Dict[Chord, Dict[Chord, float]],
-			first_appearances: Dict[Chord, Dict[int, int]], # chord -> semitone -> #. Only counts first note in each chord
-			nonfirst_appearances: Dict[Chord, Dict[int, int]], # chord -> semitone -> #. Complement of above
+			seen_chords: Dict[Chord, int],
+			transitions: Dict[Chord, Dict[Chord, int]], # chord -> chord -> #
+			first_appearances: Dict[Chord, Dict[int, int]], # chord -> semitone -> #
+			nonfirst_appearances: Dict[Chord, Dict[int, int]], # chord -> semitone -> #
 			):
-
-		self.seen_log_probs = seen_log_probs
-		self.transition_log_probs = transition_log_probs
-		self.back_transition_log_probs = back_transition_log_probs
+		self.seen_chords = seen_chords
+		self.transitions = transitions
 		self.first_appearances = first_appearances
 		self.nonfirst_appearances = nonfirst_appearances
 
-	def all_chords(self):
-		return self.seen_log_probs.keys()
-
 	@classmethod
-	def from_songs(cls, all_songs: List[Song]):
+	def from_songs(cls, all_songs: List[Song]) -> 'SongCounts':
 		seen_chords: Dict[Chord, int] = Counter()
 		transitions: Dict[Chord, Dict[Chord, int]] = defaultdict(Counter) # chord -> chord -> #
 		first_appearances: Dict[Chord, Dict[int, int]] = defaultdict(Counter) # chord -> semitone -> #
@@ -84,12 +85,143 @@ class SongStatSet:
 
 				prev_measure = measure
 
-		seen_log_probs: Dict[Chord, float] = compute_seen_log_probs(seen_chords)
-		transition_log_probs, back_transition_log_probs = compute_transition_log_probs(seen_chords, transitions)
-		first_appearances = first_appearances
-		nonfirst_appearances = nonfirst_appearances
+		return cls(seen_chords, transitions, first_appearances, nonfirst_appearances)
+
+	def __add__(self, other: 'SongCounts') -> 'SongCounts':
+		def add_nested(a: Dict[Chord, Dict], b: Dict[Chord, Dict]) -> Dict[Chord, Dict]:
+			ret: Dict[Chord, Dict] = defaultdict(Counter)
+			for d in [a, b]:
+				for key, counts in d.items():
+					ret[key].update(counts)
+			return ret
+		seen_chords: Dict[Chord, int] = Counter(self.seen_chords)
+		seen_chords.update(other.seen_chords)
+		return SongCounts(
+			seen_chords,
+			add_nested(self.transitions, other.transitions),
+			add_nested(self.first_appearances, other.first_appearances),
+			add_nested(self.nonfirst_appearances, other.nonfirst_appearances))
+
+class SongStatSet:
+	def __init__(self,
+			seen_log_probs: Dict[Chord, float],
+			transition_log_probs: Dict[Chord, Dict[Chord, float]],
+			back_transition_log_probs: Dict[Chord, Dict[Chord, float]],
+			first_appearances: Dict[Chord, Dict[int, int]], # chord -> semitone -> #. Only counts first note in each chord
+			nonfirst_appearances: Dict[Chord, Dict[int, int]], # chord -> semitone -> #. Complement of above
+			):
+
+		self.seen_log_probs = seen_log_probs
+		self.transition_log_probs = transition_log_probs
+		self.back_transition_log_probs = back_transition_log_probs
+		self.first_appearances = first_appearances
+		self.nonfirst_appearances = nonfirst_appearances
+		self.compiled_stats: Optional['CompiledStatSet'] = None
+
+	def all_chords(self):
+		return self.seen_log_probs.keys()
+
+	@classmethod
+	def from_songs(cls, all_songs: List[Song]):
+		return cls.from_counts(SongCounts.from_songs(all_songs))
+
+	@classmethod
+	def from_counts(cls, counts: 'SongCounts'):
+		seen_log_probs: Dict[Chord, float] = compute_seen_log_probs(counts.seen_chords)
+		transition_log_probs, back_transition_log_probs = compute_transition_log_probs(counts.seen_chords, counts.transitions)
+		return cls(seen_log_probs, transition_log_probs, back_transition_log_probs, counts.first_appearances, counts.nonfirst_appearances)
+
+	def compiled(self) -> 'CompiledStatSet':
+		if self.compiled_stats is None:
+			self.compiled_stats = CompiledStatSet(self)
+		return self.compiled_stats
+
+	def transposed(self, steps: int) -> 'SongStatSet':
+		"""these stats as if every song had been transposed by steps, without
+		recounting or copying anything; see TransposedSongStatSet"""
+		if steps % 12 == 0:
+			return self
+		return TransposedSongStatSet(self, steps)
+
+K = TypeVar('K')
+V = TypeVar('V')
+
+class KeyMappedView(Mapping):
+	"""Read-only view of base with every key sent through a bijection:
+	view[key] == wrap(base[to_base(key)]). Missing keys give missing()
+	without inserting anything into base, even if it's a defaultdict."""
+	def __init__(self, base: Mapping, to_base: Callable, from_base: Callable, missing: Callable[[], V], wrap: Optional[Callable] = None):
+		self.base = base
+		self.to_base = to_base
+		self.from_base = from_base
+		self.missing = missing
+		self.wrap = wrap
+
+	def __getitem__(self, key):
+		base_key = self.to_base(key)
+		if base_key not in self.base:
+			return self.missing()
+		value = self.base[base_key]
+		return value if self.wrap is None else self.wrap(value)
 
-		return cls(seen_log_probs, transition_log_probs, back_transition_log_probs, first_appearances, nonfirst_appearances)
+	def __contains__(self, key) -> bool:
+		return self.to_base(key) in self.base
+
+	def get(self, key, default=None):
+		return self[key] if key in self else default
+
+	def __iter__(self) -> Iterator:
+		return (self.from_base(key) for key in self.base)
+
+	def __len__(self) -> int:
+		return len(self.base)
+
+class TransposedSongStatSet(SongStatSet):
+	"""A SongStatSet whose dicts are views onto another one's, with chords
+	transposed by steps and melody notes rotated by steps, which is exactly
+	what from_songs would count on the transposed songs. (Transposition is a
+	bijection on chords and on pitch classes, so counts and log probs carry
+	over unchanged.) relative minor is parallel minor transposed by -3, and
+	any mode rotation of the major stats is one of these too."""
+	def __init__(self, base: SongStatSet, steps: int):
+		self.base = base
+		self.steps = steps
+
+		def chord_to_base(chord: Chord) -> Chord: return chord.transpose(-steps)
+		def chord_from_base(chord: Chord) -> Chord: return chord.transpose(steps)
+		def note_to_base(note: Optional[int]) -> Optional[int]: return None if note is None else (note - steps) % 12
+		def note_from_base(note: Optional[int]) -> Optional[int]: return None if note is None else (note + steps) % 12
+
+		def chords(d: Mapping, missing: Callable, wrap: Optional[Callable] = None) -> KeyMappedView:
+			return KeyMappedView(d, chord_to_base, chord_from_base, missing, wrap)
+		def log_probs(d: Mapping) -> KeyMappedView:
+			return chords(d, lambda: -1e3)
+		def counts(d: Mapping) -> KeyMappedView:
+			return KeyMappedView(d, note_to_base, note_from_base, lambda: 0)
+
+		super().__init__(
+			log_probs(base.seen_log_probs),
+			chords(base.transition_log_probs, lambda: log_probs({}), log_probs),
+			chords(base.back_transition_log_probs, lambda: log_probs({}), log_probs),
+			chords(base.first_appearances, lambda: counts({}), counts),
+			chords(base.nonfirst_appearances, lambda: counts({}), counts),
+		)
+
+	def transposed(self, steps: int) -> SongStatSet:
+		# don't stack views on views
+		return self.base.transposed(self.steps + steps)
+
+# Rotations of the major stats into other modes: steps such that, e.g., the
+# dorian tonic (II in major) ends up at 0.
+mode_rotations = {
+	'ionian': 0,
+	'dorian': -2,
+	'phrygian': -4,
+	'lydian': -5,
+	'mixolydian': -7,
+	'aeolian': -9,
+	'locrian': -11,
+}
 
 # viterbi
 # input: list of lists of semitones-above-root, each sublist is a measure
@@ -100,34 +232,392 @@ class SongStatSet:
 
 
 T = TypeVar('T')
-T1 = TypeVar('T1')
-T2 = TypeVar('T2')
 
 def union_all(sets: Iterable[Iterable[T]]) -> Set[T]:
 	s: Set[T] = set()
 	return s.union(*sets)
 
-def linearly_mix_dicts(dicts: List[Tuple[float, Dict[T, float]]], default: float) -> Dict[T, float]:
-	ret: Dict[T, float] = defaultdict(lambda: default)
-	for key in union_all(d.keys() for _weight, d in dicts):
-		ret[key] = sum(weight * d[key] for weight, d in dicts)
-	return ret
+# wow it's a thing https://en.wikipedia.org/wiki/LogSumExp
+def log_sum_exp_rows(xs: np.ndarray) -> np.ndarray:
+	"""log(sum(exp(row))) for each row of xs, shifted by the row's max so
+	nothing overflows; a row of all -inf gives -inf"""
+	m = xs.max(axis=1)
+	# -inf - -inf would be nan
+	m[~np.isfinite(m)] = 0.0
+	with np.errstate(divide='ignore'): # log(0) = -inf is what we want
+		return m + np.log(np.exp(xs - m[:, None]).sum(axis=1))
+
+def sampling_weights(log_weights: List[float]) -> List[float]:
+	"""exp of each, scaled so the biggest is 1; a long song's total log probs
+	are so negative that exp would make them all 0"""
+	m = max(log_weights)
+	if not math.isfinite(m):
+		m = 0.0
+	return [math.exp(x - m) for x in log_weights]
+
+# The "total" prefix log probs: if chord ci is in measure #i, the log of the
+# total probability of all chords up to there (not the total of log
+# probabilities). Only sampling (seed is not None) needs them, so they're
+# computed separately, a whole measure at a time, and only then.
+# weighted_transitions[ci, pci] is transition_weight * log P(ci | pci) (note
+# the transpose, so each chord's sum over previous chords is a row).
+def total_prefix_row(
+		app: Sequence[float],
+		prev_total: Optional[Sequence[float]], # None for the first measure
+		prev_opt: Optional[Sequence[float]],
+		prev_locked_index: Optional[int],
+		weighted_seen: np.ndarray,
+		weighted_transitions: np.ndarray,
+		appearance_weight: float,
+) -> List[float]:
+	weighted_app = appearance_weight * np.asarray(app)
+	if prev_total is None:
+		return (weighted_seen + weighted_app).tolist()
+	if prev_locked_index is not None:
+		# everything goes through the locked chord, and like the optimal
+		# prefixes we only count its best way there
+		prev = weighted_transitions[:, prev_locked_index] + prev_opt[prev_locked_index]
+	else:
+		prev = log_sum_exp_rows(weighted_transitions + np.asarray(prev_total)[None, :])
+	return (prev + weighted_app).tolist()
+
+# Melody notes are pitch classes (or None, which the corpora have a few of);
+# appearance arrays have one column for each.
+note_columns: List[Optional[int]] = list(range(12)) + [None]
+note_column = {note: i for i, note in enumerate(note_columns)}
+
+def dict_vector(d: Mapping[Chord, float], index: Dict[Chord, int]) -> Tuple[np.ndarray, np.ndarray]:
+	"""(values with -1e3 where d has nothing, which entries d has)"""
+	values = np.full(len(index), -1e3)
+	known = np.zeros(len(index), dtype=bool)
+	for chord, value in d.items():
+		values[index[chord]] = value
+		known[index[chord]] = True
+	return values, known
+
+def dict_matrix(d: Mapping[Chord, Mapping[Chord, float]], index: Dict[Chord, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+	"""(values, which entries d has, which rows d has)"""
+	values = np.full((len(index), len(index)), -1e3)
+	known = np.zeros((len(index), len(index)), dtype=bool)
+	rows = np.zeros(len(index), dtype=bool)
+	for c1, row in d.items():
+		i = index[c1]
+		rows[i] = True
+		for c2, value in row.items():
+			values[i, index[c2]] = value
+			known[i, index[c2]] = True
+	return values, known, rows
+
+class CompiledStatSet:
+	"""A SongStatSet as arrays over its own chords (sorted), so mixing is
+	array arithmetic instead of dict lookups. Built once per stat set, by
+	reading its dicts without inserting anything into them."""
+	def __init__(self, stat_set: SongStatSet):
+		chord_set = set(stat_set.seen_log_probs.keys()) | set(stat_set.first_appearances.keys()) | set(stat_set.nonfirst_appearances.keys())
+		for d in [stat_set.transition_log_probs, stat_set.back_transition_log_probs]:
+			for chord, row in d.items():
+				chord_set.add(chord)
+				chord_set.update(row.keys())
+		self.chords: List[Chord] = sorted(chord_set)
+		index = {chord: i for i, chord in enumerate(self.chords)}
+
+		self.seen, self.seen_known = dict_vector(stat_set.seen_log_probs, index)
+		self.transition, self.transition_known, self.transition_rows = dict_matrix(stat_set.transition_log_probs, index)
+		self.back_transition, self.back_transition_known, self.back_transition_rows = dict_matrix(stat_set.back_transition_log_probs, index)
+
+		self.first_counts = np.zeros((len(self.chords), len(note_columns)))
+		self.nonfirst_counts = np.zeros((len(self.chords), len(note_columns)))
+		self.appearance_known = np.zeros((len(self.chords), len(note_columns)), dtype=bool)
+		self.appearance_rows = np.zeros(len(self.chords), dtype=bool)
+		for counts, d in [(self.first_counts, stat_set.first_appearances), (self.nonfirst_counts, stat_set.nonfirst_appearances)]:
+			for chord, notes in d.items():
+				self.appearance_rows[index[chord]] = True
+				for note, count in notes.items():
+					counts[index[chord], note_column[note]] = count
+					self.appearance_known[index[chord], note_column[note]] = True
+		self.appearance_log_probs_by_weight: Dict[float, np.ndarray] = {}
+
+	def appearance_log_probs(self, first_note_weight: float) -> np.ndarray:
+		"""log P(note | chord), counting first notes first_note_weight times;
+		-1e3 where unknown"""
+		if first_note_weight not in self.appearance_log_probs_by_weight:
+			values = np.full(self.first_counts.shape, -1e3)
+			first_counts = self.first_counts.tolist()
+			nonfirst_counts = self.nonfirst_counts.tolist()
+			for ci in np.flatnonzero(self.appearance_rows).tolist():
+				note_total = first_note_weight * sum(first_counts[ci]) + sum(nonfirst_counts[ci])
+				for col in np.flatnonzero(self.appearance_known[ci]).tolist():
+					weight = first_note_weight * first_counts[ci][col] + nonfirst_counts[ci][col]
+					# math.log rather than np.log, which is sometimes an ulp off
+					values[ci, col] = math.log(weight / note_total)
+			self.appearance_log_probs_by_weight[first_note_weight] = values
+		return self.appearance_log_probs_by_weight[first_note_weight]
+
+class MixedStats:
+	"""Log probs mixed from weighted stat sets, as arrays over one shared chord
+	index, plus one more slot at the end for chords none of them know."""
+	def __init__(self,
+			chords: List[Chord],
+			seen_log_probs: np.ndarray, # (K + 1,)
+			transition_log_probs: np.ndarray, # (K + 1, K + 1), [from, to]
+			back_transition_log_probs: np.ndarray, # (K + 1, K + 1), [to, from]
+			appearance_log_probs: np.ndarray, # (K + 1, note columns), already accounts for first_note_weight
+			appearance_chords: List[Chord], # the ones we've seen melody notes over
+			key: Optional[Tuple] = None, # the same for stats mixed from the same stat sets the same way
+			):
+		self.chords = chords
+		self.index = {chord: i for i, chord in enumerate(chords)}
+		self.unknown = len(chords)
+		self.seen_log_probs = seen_log_probs
+		self.transition_log_probs = transition_log_probs
+		self.back_transition_log_probs = back_transition_log_probs
+		self.appearance_log_probs = appearance_log_probs
+		self.appearance_rows = appearance_log_probs.tolist()
+		self.appearance_chords = appearance_chords
+		self.key = key
+
+	def indices(self, chords: List[Chord]) -> List[int]:
+		return [self.index.get(chord, self.unknown) for chord in chords]
+
+	def seen_log_probs_list(self, chords: List[Chord]) -> List[float]:
+		return self.seen_log_probs[self.indices(chords)].tolist()
+
+	def transition_table(self, chords: List[Chord]) -> List[List[float]]:
+		"""[i][j] = log P(chords[j] next | chords[i])"""
+		ix = self.indices(chords)
+		return self.transition_log_probs[np.ix_(ix, ix)].tolist()
+
+	def back_transition_table(self, chords: List[Chord]) -> List[List[float]]:
+		"""[i][j] = log P(chords[j] before | chords[i])"""
+		ix = self.indices(chords)
+		return self.back_transition_log_probs[np.ix_(ix, ix)].tolist()
+
+	def appearance_log_prob(self, chord: Chord, notes: List[int], first_note_weight: float) -> float:
+		"""log prob of a measure's melody given its chord"""
+		row = self.appearance_rows[self.index.get(chord, self.unknown)]
+		return sum(row[note_column[note]] * (first_note_weight if i == 0 else 1) for i, note in enumerate(notes))
+
+# Mixing is linear in the log domain (see linearly_mixed_hmm_predict): each
+# entry is the weighted sum, over the stat sets, of its log prob there (-1e3
+# if it doesn't have one), or just -1e3 if none of them have one. There's one
+# exception, which is The Problem: we assume P(a|b) = P(ab)/P(b) so, in terms
+# of what we store, P(a|b)P(b) = P(b|a)P(a). But if, say, a appears and b
+# doesn't, this breaks --- P(a|b) and P(b|a) are both the infinitely low
+# probability sentinel. So in that case (no stat set has any transitions from
+# a) we make P(b|a) equal to P(b).
+#
+# Any number of weighted stat sets works. The sums go stat set by stat set in
+# order, so the results are exactly what summing entry by entry would give.
+# Mixing is cheap but not free, and most requests use one of a few mixes, so
+# we keep the last few around. (Like AppearanceCache, this holds on to the
+# stat sets in its keys until they age out.)
+mixed_cache: 'OrderedDict[Tuple, MixedStats]' = OrderedDict()
+mixed_cache_size = 32
+# the server speculates on another thread
+mixed_cache_lock = threading.Lock()
+
+def mix_stat_sets(weighted_stat_sets: List[Tuple[float, SongStatSet]], first_note_weight: float) -> MixedStats:
+	# stat sets hash by identity, and holding on to them here means the ids
+	# can't be reused
+	key = (tuple(weighted_stat_sets), first_note_weight)
+	with mixed_cache_lock:
+		mixed = mixed_cache.get(key)
+		if mixed is not None:
+			mixed_cache.move_to_end(key)
+			return mixed
+	mixed = compute_mixed_stats(weighted_stat_sets, first_note_weight, key)
+	with mixed_cache_lock:
+		mixed_cache[key] = mixed
+		while len(mixed_cache) > mixed_cache_size:
+			mixed_cache.popitem(last=False)
+	return mixed
+
+def compute_mixed_stats(weighted_stat_sets: List[Tuple[float, SongStatSet]], first_note_weight: float, key: Optional[Tuple] = None) -> MixedStats:
+	compiled = [(stat_weight, stat_set.compiled()) for stat_weight, stat_set in weighted_stat_sets]
+	chords = sorted(union_all(c.chords for _weight, c in compiled))
+	index = {chord: i for i, chord in enumerate(chords)}
+	size = len(chords) + 1 # the last one's for unknown chords
+	# where each stat set's chords go in ours
+	positions = [np.array([index[chord] for chord in c.chords], dtype=np.int64) for _weight, c in compiled]
+
+	def mix(shape: Tuple[int, ...], parts: List[Tuple[float, Any, np.ndarray, np.ndarray]]) -> np.ndarray:
+		"""the weighted sum of parts, each (weight, where it goes, values,
+		which values it knows), with -1e3 wherever none of them know"""
+		total = np.zeros(shape)
+		known_anywhere = np.zeros(shape, dtype=bool)
+		for weight, where, values, known in parts:
+			aligned = np.full(shape, -1e3)
+			aligned[where] = values
+			total += weight * aligned
+			known_anywhere[where] |= known
+		return np.where(known_anywhere, total, -1e3)
+
+	seen_log_probs = mix((size,), [(w, pos, c.seen, c.seen_known) for (w, c), pos in zip(compiled, positions)])
+	transition_log_probs = mix((size, size), [(w, np.ix_(pos, pos), c.transition, c.transition_known) for (w, c), pos in zip(compiled, positions)])
+	back_transition_log_probs = mix((size, size), [(w, np.ix_(pos, pos), c.back_transition, c.back_transition_known) for (w, c), pos in zip(compiled, positions)])
+	# The Problem
+	transition_rows = np.zeros(size, dtype=bool)
+	back_transition_rows = np.zeros(size, dtype=bool)
+	for (_weight, c), pos in zip(compiled, positions):
+		transition_rows[pos] |= c.transition_rows
+		back_transition_rows[pos] |= c.back_transition_rows
+	transition_log_probs[~transition_rows] = seen_log_probs
+	back_transition_log_probs[~back_transition_rows] = seen_log_probs
+
+	appearance_log_probs = mix((size, len(note_columns)), [(w, pos, c.appearance_log_probs(first_note_weight), c.appearance_known) for (w, c), pos in zip(compiled, positions)])
+	appearance_rows = np.zeros(size, dtype=bool)
+	for (_weight, c), pos in zip(compiled, positions):
+		appearance_rows[pos] |= c.appearance_rows
+	appearance_chords = [chords[i] for i in np.flatnonzero(appearance_rows).tolist()]
+
+	return MixedStats(chords, seen_log_probs, transition_log_probs, back_transition_log_probs, appearance_log_probs, appearance_chords, key)
+
+# A measure's appearance row (its melody's log prob under each chord in
+# order) only depends on the mixed stats, the chord order, and the measure's
+# notes; and melodies repeat a lot, so rows are cached here across requests
+# and sessions, least recently used out first. The key is the notes in order,
+# not just the first note and the multiset of the rest: the sum's rounding
+# depends on the order, and a hit should give exactly what a miss would have.
+# Callers mustn't modify the rows they get.
+class AppearanceCache:
+	def __init__(self, max_rows: int = 65536, max_tables: int = 64):
+		self.max_rows = max_rows
+		self.max_tables = max_tables
+		# (mixed stats key, chord order) -> id, so row keys don't have to
+		# hash the whole chord order every time
+		self.tables: 'OrderedDict[Tuple, int]' = OrderedDict()
+		self.next_table_id = 0
+		self.rows: 'OrderedDict[Tuple, List[float]]' = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		# the server speculates on another thread
+		self.lock = threading.Lock()
+
+	def table_id(self, mixed: MixedStats, all_chords: List[Chord]) -> Optional[int]:
+		if mixed.key is None: return None
+		key = (mixed.key, tuple(all_chords))
+		with self.lock:
+			table_id = self.tables.get(key)
+			if table_id is None:
+				table_id = self.next_table_id
+				self.next_table_id += 1
+				self.tables[key] = table_id
+				# a forgotten table's rows can't be hit again and age out
+				while len(self.tables) > self.max_tables:
+					self.tables.popitem(last=False)
+			else:
+				self.tables.move_to_end(key)
+			return table_id
+
+	def row(self, table_id: Optional[int], mixed: MixedStats, all_chords: List[Chord], notes: List[int], first_note_weight: float) -> List[float]:
+		if table_id is None:
+			return [mixed.appearance_log_prob(chord, notes, first_note_weight) for chord in all_chords]
+		key = (table_id, tuple(notes))
+		with self.lock:
+			row = self.rows.get(key)
+			if row is not None:
+				self.hits += 1
+				self.rows.move_to_end(key)
+				return row
+			self.misses += 1
+		row = [mixed.appearance_log_prob(chord, notes, first_note_weight) for chord in all_chords]
+		with self.lock:
+			self.rows[key] = row
+			while len(self.rows) > self.max_rows:
+				self.rows.popitem(last=False)
+				self.evictions += 1
+		return row
+
+	def clear(self):
+		with self.lock:
+			# table ids keep counting up, so a decode that's still running
+			# with an old one can't read another table's rows
+			self.tables.clear()
+			self.rows.clear()
+
+	def stats(self) -> Dict[str, float]:
+		lookups = self.hits + self.misses
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'hitRate': self.hits / lookups if lookups else 0.0,
+			'rows': len(self.rows),
+			'evictions': self.evictions,
+		}
+
+appearance_cache = AppearanceCache()
+
+def clear_caches():
+	"""forget every cached mix and appearance row, along with the stat sets
+	they hold on to; for when the stat sets are replaced, like on a reload"""
+	with mixed_cache_lock:
+		mixed_cache.clear()
+	appearance_cache.clear()
 
-def linearly_mix_dicts_of_dicts(dicts: List[Tuple[float, Dict[T1, Dict[T2, float]]]], default: float, ddict: Dict[T2, float]) -> Dict[T1, Dict[T2, float]]:
-	ret: Dict[T1, Dict[T2, float]] = defaultdict(lambda: ddict.copy())
-	for key in union_all(d.keys() for _weight, d in dicts):
-		ret[key] = linearly_mix_dicts([(weight, d[key]) for weight, d in dicts], default)
+def chord_ranks(all_chords: List[Chord]) -> np.ndarray:
+	"""each chord's position in sorted(all_chords), to break ties between
+	scores the way sorting (score, chord) pairs would, without comparing
+	chords over and over"""
+	ranks = np.empty(len(all_chords), dtype=np.int64)
+	ranks[sorted(range(len(all_chords)), key=all_chords.__getitem__)] = np.arange(len(all_chords))
+	return ranks
+
+def top_indices(scores: np.ndarray, ranks: np.ndarray, count: int) -> List[List[int]]:
+	"""for each row of scores, the indices of the count best, best first,
+	with ties going to the higher rank. Partitioning finds each row's
+	count-th best score and only what's at least that good gets sorted."""
+	rows, K = scores.shape
+	count = min(count, K)
+	if count == 0:
+		return [[] for _ in range(rows)]
+	thresholds = np.partition(scores, K - count, axis=1)[:, K - count]
+	ret = []
+	for row, threshold in zip(scores, thresholds):
+		candidates = np.flatnonzero(row >= threshold)
+		# the last key is the primary one
+		order = np.lexsort((-ranks[candidates], -row[candidates]))
+		ret.append(candidates[order[:count]].tolist())
 	return ret
 
-# wow it's a thing https://en.wikipedia.org/wiki/LogSumExp
-def log_sum_exp(xs: List[float]) -> float:
-	m = max(xs)
-	try:
-		s = sum(math.exp(x - m) for x in xs)
-		return m + math.log(s)
-	except ValueError:
-		print('error sad sad sad')
-		return -1e3
+# the recommendations for one measure, given scores[ci], the optimal log prob
+# with chord ci there, and top, the indices of the best few (top_indices)
+def recommend_measure(scores: List[float], top: List[int], all_chords: List[Chord], suggested_index: int, chosen_index: int) -> Tuple[Tuple[float, Chord], Optional[Tuple[float, Chord]], List[Tuple[float, Chord]]]:
+	max_score = scores[top[0]]
+	shown = list(top)
+
+	# FIXME lol
+	if chosen_index not in shown:
+		shown[-1] = chosen_index
+		if suggested_index not in shown:
+			shown[-2] = suggested_index
+	elif suggested_index not in shown:
+		if chosen_index == shown[-1]:
+			shown[-2] = suggested_index
+		else:
+			shown[-1] = suggested_index
+
+	def scored(ci: int) -> Tuple[float, Chord]:
+		return (math.exp(scores[ci] - max_score), all_chords[ci])
+
+	# for mypy
+	ret_scored_suggested = None if suggested_index == chosen_index else scored(suggested_index)
+
+	return (scored(chosen_index), ret_scored_suggested, [scored(ci) for ci in shown])
+
+class DecodeCancelled(Exception):
+	pass
+
+def check_stop(should_stop: Optional[Callable[[], bool]]):
+	if should_stop is not None and should_stop():
+		raise DecodeCancelled()
+
+def decoded_chords(mixed: MixedStats, locked_chords: List[Optional[Chord]], preserve_chords: Optional[List[Chord]]) -> List[Chord]:
+	"""the chords a decode considers, in the order it breaks ties in"""
+	all_chords_set = set(mixed.appearance_chords) | set(c for c in locked_chords if c)
+	if preserve_chords:
+		all_chords_set |= set(preserve_chords)
+	return list(all_chords_set)
 
 # actualy we follow mysong in linearly mixing log-domain stats from multiple
 # databases
@@ -141,6 +631,9 @@ def linearly_mixed_hmm_predict(
 		first_note_weight: float = 1.0,
 		seed: Optional[int] = None,
 		determinism_weight: float = 1.0, # higher means it's "rigged" more towards likelier chords; ignored if seed is None
+		low_memory: bool = False, # see checkpointed_decode; same results, O(sqrt(n) * K) memory
+		beam_width: Optional[int] = None, # approximate: only consider the beam_width best chords in the neighboring measure; O(n * K * beam_width) instead of O(n * K^2)
+		should_stop: Optional[Callable[[], bool]] = None, # checked before each measure; if it says so, raises DecodeCancelled
 ) -> List[Tuple[Tuple[float, Chord], Optional[Tuple[float, Chord]], List[Tuple[float, Chord]]]]: # (chosen, suggested if different, list of recs) each with score.
 	print('predict start')
 
@@ -148,66 +641,36 @@ def linearly_mixed_hmm_predict(
 	appearance_weight = 1.0 + jazziness
 	transition_weight = 1.0 - jazziness
 
-	weighted_seen_log_probs = linearly_mix_dicts([(stat_weight, stat_set.seen_log_probs) for stat_weight, stat_set in weighted_stat_sets], -1e3)
-
-	# The Problem: we assume P(a|b) = P(ab)/P(b) so, in terms of what we store,
-	# P(a|b)P(b) = P(b|a)P(a).
-	# But if, say, a appears and b doesn't, this breaks --- P(a|b) and P(b|a)
-	# are both the infinitely low probability sentinel.
-	# So in that case we can make P(a|b) equal to P(a).
-
-	weighted_transition_log_probs = linearly_mix_dicts_of_dicts([(stat_weight, stat_set.transition_log_probs) for stat_weight, stat_set in weighted_stat_sets], -1e3, weighted_seen_log_probs)
-	weighted_back_transition_log_probs = linearly_mix_dicts_of_dicts([(stat_weight, stat_set.back_transition_log_probs) for stat_weight, stat_set in weighted_stat_sets], -1e3, weighted_seen_log_probs)
-
-	# compute the log probs for appearance here, taking into account first note weight
-	weighted_appearance_log_probs_list: List[Tuple[float, Dict[Chord, Dict[int, float]]]] = []
-	for stat_weight, stat_set in weighted_stat_sets:
-		single_appearance_log_probs: Dict[Chord, Dict[int, float]] = defaultdict(lambda: defaultdict(lambda: -1e3))
-		for chord in set(stat_set.first_appearances.keys()) | set(stat_set.nonfirst_appearances.keys()):
-			first_notes = stat_set.first_appearances[chord]
-			nonfirst_notes = stat_set.nonfirst_appearances[chord]
-
-			note_total: float = first_note_weight * sum(first_notes.values()) + sum(nonfirst_notes.values())
-			for note in set(first_notes.keys()) | set(nonfirst_notes.keys()):
-				weight = first_note_weight * first_notes[note] + nonfirst_notes[note]
-				single_appearance_log_probs[chord][note] = math.log(weight / note_total)
-		weighted_appearance_log_probs_list.append((stat_weight, single_appearance_log_probs))
-	appearance_log_probs_def: Dict[int, float] = defaultdict(lambda: -1e3)
-	appearance_log_probs = linearly_mix_dicts_of_dicts(weighted_appearance_log_probs_list, -1e3, appearance_log_probs_def)
+	mixed = mix_stat_sets(weighted_stat_sets, first_note_weight)
 	print('mixed')
 
-	all_chords_set = set(appearance_log_probs.keys()) | set(c for c in locked_chords if c)
-	if preserve_chords:
-		all_chords_set |= set(preserve_chords)
-	all_chords = list(all_chords_set)
+	all_chords = decoded_chords(mixed, locked_chords, preserve_chords)
 	print('all', len(all_chords))
 
 	inv_all_chords = {chord: i for i, chord in enumerate(all_chords)}
 
-	# if chord in measure #i, its log prob based on melody alone
-	chord_appearance_log_probs_table: List[List[float]] = []
-	for i, notes in enumerate(measures):
-		row = []
-		for chord in all_chords:
-			row.append(sum(appearance_log_probs[chord][note] * (first_note_weight if i == 0 else 1) for i, note in enumerate(notes)))
-		chord_appearance_log_probs_table.append(row)
+	n = len(measures)
 
-	print('app')
+	weighted_seen_log_probs_list = mixed.seen_log_probs_list(all_chords)
 
-	n = len(measures)
+	weighted_transition_log_probs_table = mixed.transition_table(all_chords)
+	weighted_back_transition_log_probs_table = mixed.back_transition_table(all_chords)
 
-	weighted_seen_log_probs_list = [weighted_seen_log_probs[chord] for chord in all_chords]
+	# the beam is for quick first answers; those don't need to save memory
+	if low_memory and beam_width is None:
+		return checkpointed_decode(all_chords, measures, mixed, locked_chords, preserve_chords, weighted_seen_log_probs_list, weighted_transition_log_probs_table, weighted_back_transition_log_probs_table, number_of_recommendations, appearance_weight, transition_weight, first_note_weight, seed, determinism_weight, should_stop=should_stop)
 
-	weighted_transition_log_probs_table = [[weighted_transition_log_probs[c1][c2] for c2 in all_chords] for c1 in all_chords]
-	weighted_back_transition_log_probs_table = [[weighted_back_transition_log_probs[c1][c2] for c2 in all_chords] for c1 in all_chords]
+	# if chord in measure #i, its log prob based on melody alone
+	table_id = appearance_cache.table_id(mixed, all_chords)
+	chord_appearance_log_probs_table: List[List[float]] = [appearance_cache.row(table_id, mixed, all_chords, notes, first_note_weight) for notes in measures]
+
+	print('app')
 
 	# if chord in measure #i, the optimal previous chord, OR the locked chord
 	# if one is supplied
 	best_previous_chord_table: List[List[Optional[Chord]]] = [[None for _ in all_chords] for _ in range(n)]
 	# if chord in measure #i, the optimal log prob of chords up to here
 	opt_prefix_log_prob_table: List[List[float]] = [[-1e3 for _ in all_chords] for _ in range(n)]
-	# if chord in measure #i, the log of total probability of chords up to here (not total of log probabilities)
-	total_prefix_log_prob_table: List[List[float]] = [[-1e3 for _ in all_chords] for _ in range(n)]
 	print('probs')
 
 	# if chord in measure #i, the optimal next chord, OR the locked chord if
@@ -221,18 +684,26 @@ def linearly_mixed_hmm_predict(
 			return locked_chords[i]
 		return None
 
+	def candidates(row: List[float]) -> Iterable[int]:
+		"""indices of the chords worth considering as a neighbor, given that
+		measure's row of optimal log probs"""
+		if beam_width is None or beam_width >= len(all_chords):
+			return range(len(all_chords))
+		return sorted(heapq.nlargest(beam_width, range(len(all_chords)), key=row.__getitem__))
+
 	# The probability that the melody and chord sequence would exist is Π_measures P(melody|chord) * P(c_1) * Π_transitions P(c_i+1|c_i)
 	# Note that P(c_1) * Π_transitions P(c_i+1|c_i) = P(c_1) * Π_transitions P(c_i and c_i+1)/P(c_i)
 	# = (Π_transitions P(c_i and c_i+1)) / (Π_1<i<n P(c_i)), which is forwards-backwards symmetric
 
 	# forward
 	for i in range(n):
+		check_stop(should_stop)
 		if i == 0:
 			for ci, chord in enumerate(all_chords):
 				lp = transition_weight * weighted_seen_log_probs_list[ci] + appearance_weight * chord_appearance_log_probs_table[i][ci]
 				opt_prefix_log_prob_table[i][ci] = lp
-				total_prefix_log_prob_table[i][ci] = lp
 		else:
+			prev_candidates = candidates(opt_prefix_log_prob_table[i - 1])
 			for ci, chord in enumerate(all_chords):
 				# mypy juggling
 				prev_locked_chord = get_locked_chord_at(i - 1)
@@ -241,28 +712,21 @@ def linearly_mixed_hmm_predict(
 					prev_chord = prev_locked_chord
 					pci = prev_locked_chord_index
 					prev_log_prob = transition_weight * weighted_transition_log_probs_table[pci][ci] + opt_prefix_log_prob_table[i - 1][prev_locked_chord_index]
-
-					total_prev_log_prob = prev_log_prob
 				else:
-					prev_chords_and_log_probs = ((prev_chord, transition_weight * weighted_transition_log_probs_table[pci][ci] + opt_prefix_log_prob_table[i - 1][pci]) for pci, prev_chord in enumerate(all_chords))
+					prev_chords_and_log_probs = ((all_chords[pci], transition_weight * weighted_transition_log_probs_table[pci][ci] + opt_prefix_log_prob_table[i - 1][pci]) for pci in prev_candidates)
 					prev_chord, prev_log_prob = max(prev_chords_and_log_probs, key=lambda p: p[1])
 
-					total_prev_log_prob = log_sum_exp([
-						transition_weight * weighted_transition_log_probs_table[pcii][ci] + total_prefix_log_prob_table[i - 1][pcii]
-						for pcii, pci in enumerate(all_chords)
-					])
-
 				opt_prefix_log_prob_table[i][ci] = prev_log_prob + appearance_weight * chord_appearance_log_probs_table[i][ci]
 				best_previous_chord_table[i][ci] = prev_chord
-
-				total_prefix_log_prob_table[i][ci] = total_prev_log_prob + appearance_weight * chord_appearance_log_probs_table[i][ci]
 	print('forward done, backward:')
 	# backward
 	for i in range(n - 1, -1, -1):
+		check_stop(should_stop)
 		if i == n - 1:
 			for ci, chord in enumerate(all_chords):
 				opt_suffix_log_prob_table[i][ci] = transition_weight * weighted_seen_log_probs_list[ci] + appearance_weight * chord_appearance_log_probs_table[i][ci]
 		else:
+			next_candidates = candidates(opt_suffix_log_prob_table[i + 1])
 			for ci, chord in enumerate(all_chords):
 				next_locked_chord = get_locked_chord_at(i + 1)
 				if next_locked_chord is not None:
@@ -270,7 +734,7 @@ def linearly_mixed_hmm_predict(
 					nci = inv_all_chords[next_chord]
 					next_log_prob = transition_weight * weighted_back_transition_log_probs_table[nci][ci] + opt_suffix_log_prob_table[i + 1][nci]
 				else:
-					next_chords_and_log_probs = ((next_chord, transition_weight * weighted_back_transition_log_probs_table[nci][ci] + opt_suffix_log_prob_table[i + 1][nci]) for nci, next_chord in enumerate(all_chords))
+					next_chords_and_log_probs = ((all_chords[nci], transition_weight * weighted_back_transition_log_probs_table[nci][ci] + opt_suffix_log_prob_table[i + 1][nci]) for nci in next_candidates)
 					next_chord, next_log_prob = max(next_chords_and_log_probs, key=lambda p: p[1])
 				opt_suffix_log_prob_table[i][ci] = next_log_prob + appearance_weight * chord_appearance_log_probs_table[i][ci]
 				# best_next_chord_table[i][ci] = next_chord
@@ -323,7 +787,7 @@ def linearly_mixed_hmm_predict(
 			print('appearance', w)
 			lpp += w
 			if i != n - 1:
-				w = transition_weight * weighted_back_transition_log_probs[op[i+1]][chord]
+				w = transition_weight * weighted_back_transition_log_probs_table[inv_all_chords[op[i+1]]][ci]
 				print('transition', w)
 				lpp += w
 			else:
@@ -333,15 +797,27 @@ def linearly_mixed_hmm_predict(
 		print(lpp)
 		suggested_progression = list(reversed(rev_optimal_progression))
 	else:
+		weighted_seen = transition_weight * np.array(weighted_seen_log_probs_list)
+		weighted_transitions = transition_weight * np.array(weighted_transition_log_probs_table).T
+		total_prefix_log_prob_table: List[List[float]] = []
+		for i in range(n):
+			prev_locked_chord = get_locked_chord_at(i - 1) if i else None
+			total_prefix_log_prob_table.append(total_prefix_row(
+				chord_appearance_log_probs_table[i],
+				total_prefix_log_prob_table[i - 1] if i else None,
+				opt_prefix_log_prob_table[i - 1] if i else None,
+				None if prev_locked_chord is None else inv_all_chords[prev_locked_chord],
+				weighted_seen, weighted_transitions, appearance_weight))
+
 		rng = random.Random()
 		rng.seed(seed)
 
 		last_chord_opt = get_locked_chord_at(n - 1)
 		if last_chord_opt is None:
-			last_chord, = rng.choices(all_chords, weights=[
-				math.exp(determinism_weight * total_prefix_log_prob_table[n - 1][ci])
+			last_chord, = rng.choices(all_chords, weights=sampling_weights([
+				determinism_weight * total_prefix_log_prob_table[n - 1][ci]
 				for ci, chord in enumerate(all_chords)
-			])
+			]))
 		else:
 			last_chord = last_chord_opt
 
@@ -352,13 +828,13 @@ def linearly_mixed_hmm_predict(
 
 			next_last_chord = get_locked_chord_at(i - 1)
 			if next_last_chord is None:
-				next_last_chord, = rng.choices(all_chords, weights=[
-					math.exp(determinism_weight * (
+				next_last_chord, = rng.choices(all_chords, weights=sampling_weights([
+					determinism_weight * (
 						total_prefix_log_prob_table[i - 1][ci] +
 						transition_weight * weighted_transition_log_probs_table[ci][nci]
-					))
+					)
 					for ci, chord in enumerate(all_chords)
-				])
+				]))
 
 			rev_chosen_progression.append(next_last_chord)
 
@@ -366,45 +842,307 @@ def linearly_mixed_hmm_predict(
 
 	print('gonna rec')
 
-	# However, we want to recommend chords.
+	# However, we want to recommend chords. scores[i][ci] is the optimal log
+	# prob if chord ci is at position i, obeying all locked chords except the
+	# chord at position i itself (subject to rounding error).
+	scores = (
+		np.array(opt_prefix_log_prob_table)
+		+ np.array(opt_suffix_log_prob_table)
+		- transition_weight * np.array(weighted_seen_log_probs_list)
+		- appearance_weight * np.array(chord_appearance_log_probs_table)
+	)
+	tops = top_indices(scores, chord_ranks(all_chords), number_of_recommendations)
+	score_rows = scores.tolist()
 	ret = []
-
-	def score(i: int, chord: Chord) -> float:
-		"""the optimal log prob if chord is at position i
-		
-		obeying all locked chords except the chord at position i itself;
-		subject to rounding error"""
-
-		ci = inv_all_chords[chord]
-		return (
-			opt_prefix_log_prob_table[i][ci]
-			+ opt_suffix_log_prob_table[i][ci]
-			- transition_weight * weighted_seen_log_probs[chord]
-			- appearance_weight * chord_appearance_log_probs_table[i][ci]
-		)
 	for i in range(n):
-		scored_chords = list(reversed(sorted([(score(i, chord), chord) for chord in all_chords])[-number_of_recommendations:]))
-		max_score = scored_chords[0][0]
-		rescored_chords = [(math.exp(s - max_score), chord) for s, chord in scored_chords]
 		suggested_chord = suggested_progression[i]
 		chosen_chord = preserve_chords[i] if preserve_chords else suggested_chord
-		scored_suggested = (math.exp(score(i, suggested_chord) - max_score), suggested_chord)
-		scored_chosen = (math.exp(score(i, chosen_chord) - max_score), chosen_chord)
-
-		# FIXME lol
-		if scored_chosen not in rescored_chords:
-			rescored_chords[-1] = scored_chosen
-			if scored_suggested not in rescored_chords:
-				rescored_chords[-2] = scored_suggested
-		elif scored_suggested not in rescored_chords:
-			if scored_chosen == rescored_chords[-1]:
-				rescored_chords[-2] = scored_suggested
+		ret.append(recommend_measure(score_rows[i], tops[i], all_chords, inv_all_chords[suggested_chord], inv_all_chords[chosen_chord]))
+	print('retting')
+	return ret
+
+# The low-memory version of everything after the tables in
+# linearly_mixed_hmm_predict. Instead of five n x K tables we keep the forward
+# rows (as typed arrays) only every ~sqrt(n) measures, and when we need the rows
+# in between (walking backwards, for the backward pass, the traceback, and the
+# recommendations) we recompute one segment at a time from its checkpoint,
+# with its back-pointers as int16. Appearance rows are recomputed on the fly
+# too. Peak memory is O(sqrt(n) * K) and it's about twice the forward work.
+#
+# Every number is computed by the same float64 operations in the same order as
+# the table version, so scores and choices (ties included, and the rng draws
+# when seeded) are identical. Scores stay float64 rather than float32 for that
+# reason.
+def checkpointed_decode(
+		all_chords: List[Chord],
+		measures: List[List[int]],
+		mixed: MixedStats,
+		locked_chords: List[Optional[Chord]],
+		preserve_chords: Optional[List[Chord]],
+		seen_log_probs_list: List[float],
+		transition_log_probs_table: List[List[float]],
+		back_transition_log_probs_table: List[List[float]],
+		number_of_recommendations: int,
+		appearance_weight: float,
+		transition_weight: float,
+		first_note_weight: float,
+		seed: Optional[int],
+		determinism_weight: float,
+		checkpoint_interval: Optional[int] = None,
+		should_stop: Optional[Callable[[], bool]] = None,
+) -> List[Tuple[Tuple[float, Chord], Optional[Tuple[float, Chord]], List[Tuple[float, Chord]]]]:
+	n = len(measures)
+	K = len(all_chords)
+	assert K < 2 ** 15 # int16 back-pointers
+	inv_all_chords = {chord: i for i, chord in enumerate(all_chords)}
+	interval = checkpoint_interval or max(1, int(math.ceil(math.sqrt(n))))
+	tw = transition_weight
+	aw = appearance_weight
+
+	def get_locked_chord_at(i: int) -> Optional[Chord]:
+		if 0 <= i < len(locked_chords):
+			return locked_chords[i]
+		return None
+
+	table_id = appearance_cache.table_id(mixed, all_chords)
+
+	def appearance_row(i: int) -> List[float]:
+		return appearance_cache.row(table_id, mixed, all_chords, measures[i], first_note_weight)
+
+	if seed is not None:
+		weighted_seen = tw * np.array(seen_log_probs_list)
+		weighted_transitions = tw * np.array(transition_log_probs_table).T
+
+	# (opt prefix, total prefix, back-pointers) for measure i from measure
+	# i - 1's; the total is only needed for sampling, so it's None otherwise
+	def forward_row(i: int, app: List[float], prev_opt: Optional[array], prev_total: Optional[List[float]]) -> Tuple[array, Optional[List[float]], array]:
+		opt = array('d', [-1e3]) * K
+		back = array('h', [-1]) * K
+		prev_locked_chord = get_locked_chord_at(i - 1) if i else None
+		total = None
+		if seed is not None:
+			total = total_prefix_row(app, prev_total, prev_opt, None if prev_locked_chord is None else inv_all_chords[prev_locked_chord], weighted_seen, weighted_transitions, aw)
+		if i == 0:
+			for ci in range(K):
+				opt[ci] = tw * seen_log_probs_list[ci] + aw * app[ci]
+			return (opt, total, back)
+
+		for ci in range(K):
+			if prev_locked_chord is not None:
+				pci = inv_all_chords[prev_locked_chord]
+				prev_log_prob = tw * transition_log_probs_table[pci][ci] + prev_opt[pci]
+			else:
+				pci, prev_log_prob = max(((pci, tw * transition_log_probs_table[pci][ci] + prev_opt[pci]) for pci in range(K)), key=lambda p: p[1])
+			opt[ci] = prev_log_prob + aw * app[ci]
+			back[ci] = pci
+		return (opt, total, back)
+
+	def backward_row(i: int, app: List[float], next_suffix: Optional[array]) -> array:
+		suffix = array('d', [-1e3]) * K
+		if i == n - 1:
+			for ci in range(K):
+				suffix[ci] = tw * seen_log_probs_list[ci] + aw * app[ci]
+			return suffix
+
+		next_locked_chord = get_locked_chord_at(i + 1)
+		for ci in range(K):
+			if next_locked_chord is not None:
+				nci = inv_all_chords[next_locked_chord]
+				next_log_prob = tw * back_transition_log_probs_table[nci][ci] + next_suffix[nci]
+			else:
+				next_log_prob = max(tw * back_transition_log_probs_table[nci][ci] + next_suffix[nci] for nci in range(K))
+			suffix[ci] = next_log_prob + aw * app[ci]
+		return suffix
+
+	# for the recommendations
+	weighted_seen_array = tw * np.array(seen_log_probs_list)
+	ranks = chord_ranks(all_chords)
+
+	# forward, keeping only checkpoints
+	checkpoints: Dict[int, Tuple[array, Optional[List[float]], array]] = {}
+	prev: Optional[Tuple[array, Optional[List[float]], array]] = None
+	for i in range(n):
+		check_stop(should_stop)
+		prev = forward_row(i, appearance_row(i), prev[0] if prev else None, prev[1] if prev else None)
+		if i % interval == 0:
+			checkpoints[i] = prev
+	print('forward done (checkpointed), backward:')
+
+	if seed is not None:
+		rng = random.Random()
+		rng.seed(seed)
+
+	rev_ret = []
+	suffix: Optional[array] = None
+	next_back: Optional[array] = None # back-pointers of measure i + 1
+	next_ci: Optional[int] = None # suggested chord of measure i + 1
+	for segment_start in reversed(range(0, n, interval)):
+		segment_end = min(segment_start + interval, n)
+		apps = [appearance_row(i) for i in range(segment_start, segment_end)]
+		rows = [checkpoints.pop(segment_start)]
+		for i in range(segment_start + 1, segment_end):
+			rows.append(forward_row(i, apps[i - segment_start], rows[-1][0], rows[-1][1]))
+
+		for i in range(segment_end - 1, segment_start - 1, -1):
+			check_stop(should_stop)
+			app = apps[i - segment_start]
+			opt, total, back = rows[i - segment_start]
+			suffix = backward_row(i, app, suffix)
+
+			locked_chord = get_locked_chord_at(i)
+			if seed is None:
+				if i == n - 1:
+					ci = inv_all_chords[locked_chord] if locked_chord is not None else max(range(K), key=lambda ci: opt[ci])
+				else:
+					ci = next_back[next_ci]
 			else:
-				rescored_chords[-1] = scored_suggested
+				if locked_chord is not None:
+					ci = inv_all_chords[locked_chord]
+				elif i == n - 1:
+					ci, = rng.choices(range(K), weights=sampling_weights([
+						determinism_weight * total[ci]
+						for ci in range(K)
+					]))
+				else:
+					ci, = rng.choices(range(K), weights=sampling_weights([
+						determinism_weight * (
+							total[ci] +
+							tw * transition_log_probs_table[ci][next_ci]
+						)
+						for ci in range(K)
+					]))
 
-		# for mypy
-		ret_scored_suggested = None if scored_suggested == scored_chosen else scored_suggested
+			scores = np.asarray(opt) + np.asarray(suffix) - weighted_seen_array - aw * np.asarray(app)
+			top, = top_indices(scores[None, :], ranks, number_of_recommendations)
+			chosen_index = inv_all_chords[preserve_chords[i]] if preserve_chords else ci
+			rev_ret.append(recommend_measure(scores.tolist(), top, all_chords, ci, chosen_index))
+			next_back = back
+			next_ci = ci
 
-		ret.append((scored_chosen, ret_scored_suggested, rescored_chords))
 	print('retting')
-	return ret
+	return list(reversed(rev_ret))
+
+# Fixed-lag smoothing for live input. Feed it one measure of notes at a time;
+# each step returns the chord for measure t - lag, which is final, and a
+# provisional chord for measure t, the best guess so far.
+#
+# This is the forward (Viterbi) half of linearly_mixed_hmm_predict run
+# incrementally: each measure adds one row of forward scores and
+# back-pointers, O(K^2), and we only keep the rows of the uncommitted window,
+# so memory is O(K * lag) no matter how long the piece is. Committing the
+# oldest measure treats its chord like a locked chord in the batch
+# predictor: the next row's back-pointers all point to it and its scores are
+# redone from it, O(K), so every path we backtrack from then on goes through
+# it and the committed chords form one path. Later rows aren't redone; their
+# scores are still the unconditioned ones, which only matters when a path
+# that didn't go through the committed chord was winning somewhere.
+#
+# Until something is committed this is exactly the batch forward pass, so with
+# lag >= the piece length, flush() gives the batch predictor's chords.
+class StreamingHarmonizer:
+	def __init__(self,
+			weighted_stat_sets: List[Tuple[float, SongStatSet]],
+			lag: int = 2,
+			jazziness: float = 0,
+			first_note_weight: float = 1.0,
+			):
+		assert lag >= 0
+		self.lag = lag
+		self.appearance_weight = 1.0 + jazziness
+		self.transition_weight = 1.0 - jazziness
+		self.first_note_weight = first_note_weight
+
+		self.mixed = mix_stat_sets(weighted_stat_sets, first_note_weight)
+		self.all_chords: List[Chord] = decoded_chords(self.mixed, [], None)
+		self.seen_log_probs_list = self.mixed.seen_log_probs_list(self.all_chords)
+		self.transition_log_probs_table = self.mixed.transition_table(self.all_chords)
+		self.appearance_table_id = appearance_cache.table_id(self.mixed, self.all_chords)
+
+		self.measures_seen = 0
+		# the last committed chord index and the log prob of the committed
+		# prefix ending in it
+		self.committed: Optional[Tuple[int, float]] = None
+		# one entry per uncommitted measure, oldest first
+		self.window_appearances: List[List[float]] = []
+		self.window_opt: List[List[float]] = []
+		self.window_back: List[List[int]] = []
+
+	def forward_row(self, appearance_row: List[float], prev_opt: Optional[List[float]]) -> Tuple[List[float], List[int]]:
+		"""the row after prev_opt, or after the committed chord if there's no
+		prev_opt"""
+		tw = self.transition_weight
+		aw = self.appearance_weight
+		table = self.transition_log_probs_table
+		opt = []
+		back = []
+		for ci in range(len(self.all_chords)):
+			if prev_opt is None:
+				if self.committed is None:
+					# very first measure
+					opt.append(tw * self.seen_log_probs_list[ci] + aw * appearance_row[ci])
+					back.append(-1)
+					continue
+				pci, committed_log_prob = self.committed
+				prev_log_prob = tw * table[pci][ci] + committed_log_prob
+			else:
+				pci, prev_log_prob = max(((pci, tw * table[pci][ci] + prev_opt[pci]) for pci in range(len(self.all_chords))), key=lambda p: p[1])
+			opt.append(prev_log_prob + aw * appearance_row[ci])
+			back.append(pci)
+		return (opt, back)
+
+	def best_window_path(self) -> List[int]:
+		"""chord indices for the uncommitted window, oldest first"""
+		last_opt = self.window_opt[-1]
+		ci = max(range(len(self.all_chords)), key=lambda ci: last_opt[ci])
+		rev_path = [ci]
+		for back in reversed(self.window_back[1:]):
+			ci = back[ci]
+			rev_path.append(ci)
+		return list(reversed(rev_path))
+
+	def commit_oldest(self) -> Chord:
+		ci = self.best_window_path()[0]
+		self.committed = (ci, self.window_opt[0][ci])
+		del self.window_appearances[0]
+		del self.window_opt[0]
+		del self.window_back[0]
+		if self.window_opt:
+			# the new oldest measure now follows the committed chord
+			self.window_opt[0], self.window_back[0] = self.forward_row(self.window_appearances[0], None)
+		return self.all_chords[ci]
+
+	def push(self, notes: List[int]) -> Tuple[Optional[Tuple[int, Chord]], Chord]:
+		"""add measure t (notes are semitones above the tonic); returns
+		((t - lag, its committed chord) or None if t < lag, provisional chord
+		for measure t)"""
+		appearance_row = appearance_cache.row(self.appearance_table_id, self.mixed, self.all_chords, notes, self.first_note_weight)
+		opt, back = self.forward_row(appearance_row, self.window_opt[-1] if self.window_opt else None)
+		self.window_appearances.append(appearance_row)
+		self.window_opt.append(opt)
+		self.window_back.append(back)
+		t = self.measures_seen
+		self.measures_seen += 1
+
+		committed = None
+		if len(self.window_opt) > self.lag:
+			committed = (t - self.lag, self.commit_oldest())
+		if self.window_opt:
+			provisional = self.all_chords[self.best_window_path()[-1]]
+		else:
+			# lag 0: the current measure was just committed
+			assert committed is not None
+			provisional = committed[1]
+		return (committed, provisional)
+
+	def flush(self) -> List[Tuple[int, Chord]]:
+		"""the piece is over; commit everything still in the window and get
+		ready for a new piece"""
+		start = self.measures_seen - len(self.window_opt)
+		ret = [(start + j, self.all_chords[ci]) for j, ci in enumerate(self.best_window_path())] if self.window_opt else []
+		self.measures_seen = 0
+		self.committed = None
+		self.window_appearances = []
+		self.window_opt = []
+		self.window_back = []
+		return ret
+
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import argparse, subprocess, sys, time
+from typing import List, Tuple
+
+# How long it takes to import what the server imports, and whether anything
+# heavy snuck in. Serving only reads the columnar corpora, so it should never
+# pull in music21 (or anything else only the parsers need); this exits with
+# status 1 if it does, so it can go in a pre-commit hook or CI.
+#
+#   python import_benchmark.py           # server (and batch) import path
+#   python import_benchmark.py parse_all # or anything else
+
+# modules the serving path must not import
+forbidden = ['music21']
+
+def import_time(module: str) -> Tuple[float, List[Tuple[int, str]]]:
+	"""wall-clock seconds to start a fresh interpreter and import module, and
+	(cumulative microseconds, name) for every module it imported"""
+	start_time = time.time()
+	proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], stderr=subprocess.PIPE, universal_newlines=True)
+	elapsed = time.time() - start_time
+	if proc.returncode != 0:
+		print(proc.stderr)
+		raise RuntimeError('importing {} failed'.format(module))
+
+	modules = []
+	for line in proc.stderr.splitlines():
+		# import time: self [us] | cumulative | imported package
+		if not line.startswith('import time:') or 'cumulative' in line: continue
+		_, cumulative, name = line[len('import time:'):].split('|')
+		modules.append((int(cumulative), name.rstrip()))
+	return elapsed, modules
+
+def main():
+	parser = argparse.ArgumentParser(description='Time importing the serving path and check it stays free of parser-only dependencies.')
+	parser.add_argument('modules', nargs='*', default=['server', 'batch'], help='modules to import (default: server, batch)')
+	parser.add_argument('-n', '--repeat', type=int, default=5, help='imports to time per module; the fastest counts')
+	parser.add_argument('--top', type=int, default=10, help='how many of the slowest direct imports to list')
+	args = parser.parse_args()
+
+	failed = False
+	for module in args.modules:
+		runs = [import_time(module) for _ in range(args.repeat)]
+		elapsed, modules = min(runs, key=lambda run: run[0])
+		print('{}: {:.3f} seconds (best of {}), {} modules'.format(module, elapsed, args.repeat, len(modules)))
+
+		# what module itself imports directly (one level of indentation),
+		# slowest first
+		direct = sorted(((us, name.strip()) for us, name in modules if name.startswith('   ') and not name.startswith('    ')), reverse=True)
+		for us, name in direct[:args.top]:
+			print('  {:8.1f} ms  {}'.format(us / 1000, name))
+
+		imported = set(name.strip() for _, name in modules)
+		for bad in forbidden:
+			culprits = sorted(name for name in imported if name == bad or name.startswith(bad + '.'))
+			if culprits:
+				print('! {} imports {} ({} modules)'.format(module, bad, len(culprits)))
+				failed = True
+	sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+	main()
@@ -1,96 +1,145 @@
 import sys
 sys.path.append('..')
-from collections import defaultdict, Counter
+from typing import Callable, Hashable, List, Optional
 from chord import Chord, C, RelativeChord, RC
+import corpus.columnar as columnar
 import corpus.rs as rs
 import corpus.abc as abc
 import corpus.marg as marg
 import numpy as np
 
-rs_song_dict = rs.load_songs()
-abc_song_dict = abc.load_songs()
-marg_songs = marg.load_songs()
+# Everything here is a function of one song x chord matrix of reps-weighted
+# counts, so we build that once per corpus (cached on disk inside the columnar
+# store, see ColumnarCorpus.song_chord_counts) and do the statistics as whole-
+# matrix numpy operations instead of rescanning every song for every chord.
 
-def count_tonic_root_triads(songs):
-	d = [[0,0],[0,0]]
-	for song in songs:
-		has_major = any(measure.chord.simplified() == C.I for measure in song.measures)
-		has_minor = any(measure.chord.simplified() == C.i for measure in song.measures)
-		d[has_major][has_minor] += 1
+rs_store = columnar.ColumnarCorpus.load(rs.columnar_path)
+abc_store = columnar.ColumnarCorpus.load(abc.columnar_path)
+marg_store = columnar.ColumnarCorpus.load(marg.columnar_path)
+
+class ChordMatrix:
+	def __init__(self, song_names: List[str], columns: List[Hashable], counts: np.ndarray):
+		self.song_names = song_names
+		self.columns = columns # e.g. simplified chords
+		self.column_index = {column: i for i, column in enumerate(columns)}
+		self.counts = counts # counts[song, column]
+
+	def column(self, key: Hashable) -> np.ndarray:
+		i = self.column_index.get(key)
+		if i is None: return np.zeros(len(self.song_names), dtype=self.counts.dtype)
+		return self.counts[:, i]
+
+	def totals(self) -> np.ndarray:
+		return np.maximum(self.counts.sum(axis=1), 1)
+
+	def fractions(self) -> np.ndarray:
+		return self.counts / self.totals()[:, None]
+
+	def column_fractions(self, key: Hashable) -> np.ndarray:
+		return self.column(key) / self.totals()
+
+def chord_matrix(store: columnar.ColumnarCorpus, key: Callable[[Chord], Hashable], modes: Optional[List[str]] = None) -> ChordMatrix:
+	"""songs of the given modes (None for all) x key(chord)"""
+	indices = store.song_indices(modes)
+	counts = store.song_chord_counts()[indices]
+
+	# vocabulary ids in order of first appearance in the selected songs (so
+	# ties sort the same way a Counter filled song by song would)
+	offsets = store.arrays['song_measure_offsets']
+	selected = np.zeros(len(store), dtype=bool)
+	selected[indices] = True
+	measure_chord = store.arrays['measure_chord'][np.repeat(selected, np.diff(offsets))]
+	vocab, first = np.unique(measure_chord, return_index=True)
+	vocab = vocab[np.argsort(first)]
+
+	# merge those into columns with one matrix product
+	columns: List[Hashable] = []
+	column_index = {}
+	merge = np.zeros((len(store.chords), len(vocab)), dtype=counts.dtype)
+	for chord_id in vocab.tolist():
+		k = key(store.chords[chord_id])
+		if k not in column_index:
+			column_index[k] = len(columns)
+			columns.append(k)
+		merge[chord_id, column_index[k]] = 1
+	return ChordMatrix(
+		[store.song_names_and_metas[i][0] for i in indices],
+		columns,
+		counts @ merge[:, :len(columns)])
+
+def simplified_matrix(store: columnar.ColumnarCorpus, modes: Optional[List[str]] = None) -> ChordMatrix:
+	return chord_matrix(store, Chord.simplified, modes)
+
+def relative_chord_matrix(store: columnar.ColumnarCorpus, modes: Optional[List[str]] = None) -> ChordMatrix:
+	return chord_matrix(store, lambda chord: chord.relative_chord, modes)
+
+def count_tonic_root_triads(m: ChordMatrix):
+	has_major = m.column(C.tonic_major) > 0
+	has_minor = m.column(C.tonic_minor) > 0
+	d = [[int(np.sum(~has_major & ~has_minor)), int(np.sum(~has_major & has_minor))],
+		[int(np.sum(has_major & ~has_minor)), int(np.sum(has_major & has_minor))]]
 	print(d)
 
-def show_corrs(title, songs):
+def show_corrs(title, m: ChordMatrix):
 	print('=' * 32, title)
 	all_chords = C.all_simple_chords
-	# a = np.array([[sum(measure.reps or (1/0) for measure in song.measures if measure.chord.simplified() == chord) for song in songs] for chord in all_chords])
-	a = np.array([[any(measure.chord.simplified() == chord for measure in song.measures) for song in songs] for chord in all_chords])
-	for i1, c1 in enumerate(all_chords):
-		for i2, c2 in enumerate(all_chords):
-			if i1 < i2:
-				corr = np.corrcoef(a[i1], a[i2])
-				assert corr.shape == (2, 2)
-				corr = corr[0,1]
-				if abs(corr) > 0.3:
-					print(c1.to_roman_numeral(), c2.to_roman_numeral(), corr)
-
-def count_chord_frac(song, chord):
-	chord_counter = Counter()
-	total = 0
-	for measure in song.measures:
-		chord_counter[measure.chord.simplified()] += measure.reps
-		total += measure.reps
-	return chord_counter[chord] / total
-
-def show_stats(title, songs):
+	# a = np.stack([m.column(chord) for chord in all_chords])
+	a = np.stack([m.column(chord) > 0 for chord in all_chords])
+	# chords that are in every song or none have no correlation with anything
+	with np.errstate(divide='ignore', invalid='ignore'):
+		corr = np.corrcoef(a)
+	for i1, i2 in zip(*np.nonzero(np.triu(np.abs(corr) > 0.3, 1))):
+		print(all_chords[i1].to_roman_numeral(), all_chords[i2].to_roman_numeral(), corr[i1, i2])
+
+def best_song(m: ChordMatrix, fracs: np.ndarray) -> tuple:
+	"""max((frac, song name)) over the songs"""
+	best = fracs.max()
+	return (best, max(m.song_names[i] for i in np.flatnonzero(fracs == best)))
+
+def top_songs(m: ChordMatrix, fracs: np.ndarray, n: int) -> List[tuple]:
+	"""sorted((frac, song name))[-n:]"""
+	order = np.lexsort((np.array(m.song_names), fracs))[-n:]
+	return [(fracs[i], m.song_names[i]) for i in order]
+
+def show_top(m: ChordMatrix, stringify: Callable[[Hashable], str]):
+	totals = m.counts.sum(axis=0)
+	fracs = m.fractions()
+	# stable, so ties stay in order of first appearance
+	for j in np.argsort(-totals, kind='stable'):
+		print("{:10} {:10} {:7.02f}% {}".format(stringify(m.columns[j]), totals[j],
+			*best_song(m, 100*fracs[:, j])))
+
+def show_stats(title, m: ChordMatrix):
 	print('=' * 32, title)
-	chord_counter = Counter()
-	for song in songs:
-		for measure in song.measures:
-			chord_counter[measure.chord.simplified()] += measure.reps
-	for k, v in sorted(chord_counter.items(), key=lambda p: -p[1]):
-		print("{:10} {:10} {:7.02f}% {}".format(k.to_roman_numeral(), v,
-			*max((100*count_chord_frac(song, k), song.name) for song in songs)))
+	show_top(m, lambda k: k.to_roman_numeral())
 
 	ii = Chord(2, RC.min) # (that's 2 semitones, which is coincidentally ii)
 	IV = Chord(5, RC.maj)
-	for percent, song_name in sorted((100*count_chord_frac(song, ii), song.name) for song in songs)[-100:]:
+	for percent, song_name in top_songs(m, 100*m.column_fractions(ii), 100):
 		print("      {:7.02f}% {}".format(percent, song_name))
-	for percent, song_name in sorted((100*count_chord_frac(song, IV), song.name) for song in songs)[-100:]:
+	for percent, song_name in top_songs(m, 100*m.column_fractions(IV), 100):
 		print("      {:7.02f}% {}".format(percent, song_name))
 
-def count_rc_frac(song, rc):
-	chord_counter = Counter()
-	total = 0
-	for measure in song.measures:
-		chord_counter[measure.chord.relative_chord] += measure.reps
-		total += measure.reps
-	return chord_counter[rc] / total
-
-def show_stats_2(title, songs):
+def show_stats_2(title, m: ChordMatrix):
 	print('=' * 32, title)
-	chord_counter = Counter()
-	for song in songs:
-		for measure in song.measures:
-			chord_counter[measure.chord.relative_chord] += measure.reps
-	for k, v in sorted(chord_counter.items(), key=lambda p: -p[1]):
-		print("{:10} {:10} {:7.02f}% {}".format(k.stringify() if k else '-', v,
-			*max((100*count_rc_frac(song, k), song.name) for song in songs)))
+	show_top(m, lambda k: k.stringify() if k else '-')
 
-count_tonic_root_triads(rs_song_dict['all'])
+count_tonic_root_triads(simplified_matrix(rs_store))
 
 # c = 0
-# for song in marg_songs:
-# 	if song.meta == 'minor': print(song.name); c += 1
+# for song in marg_store.iter_songs(['min']):
+# 	print(song.name); c += 1
 # print(c)
-# print(len(rs_song_dict['all']))
-# print(len(abc_song_dict['all']))
-# print(len(marg_songs))
-
-# show_stats_2('rs', rs_song_dict['all'])
-# # show_stats_2('rs maj', rs_song_dict['maj'])
-# # show_stats_2('rs min', rs_song_dict['min'])
-# # show_stats_2('rs mixed', rs_song_dict['mix'])
-# show_stats_2('abc', abc_song_dict['all'])
-# # show_stats_2('abc maj', abc_song_dict['maj'])
-# # show_stats_2('abc min', abc_song_dict['min'])
-show_stats('marg', marg_songs)
+# print(len(rs_store))
+# print(len(abc_store))
+# print(len(marg_store))
+
+# show_corrs('rs', simplified_matrix(rs_store))
+# show_stats_2('rs', relative_chord_matrix(rs_store))
+# # show_stats_2('rs maj', relative_chord_matrix(rs_store, ['maj']))
+# # show_stats_2('rs min', relative_chord_matrix(rs_store, ['min']))
+# # show_stats_2('rs mixed', relative_chord_matrix(rs_store, ['mix']))
+# show_stats_2('abc', relative_chord_matrix(abc_store))
+# # show_stats_2('abc maj', relative_chord_matrix(abc_store, ['maj']))
+# # show_stats_2('abc min', relative_chord_matrix(abc_store, ['min']))
+show_stats('marg', simplified_matrix(marg_store))
@@ -1,7 +1,79 @@
-import corpus.rs as rs
-import corpus.abc as abc
-import corpus.marg as marg
+import argparse, importlib, os, time, traceback
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
 
-rs.dump_songs()
-abc.dump_songs()
-marg.dump_songs()
+from measure import Song
+import corpus.cache as cache
+
+corpus_names = ['rs', 'abc', 'marg']
+
+# Runs in a worker process, so it only gets picklable arguments and has to
+# look the corpus module up again by name. Any exception is returned instead
+# of raised so one bad file doesn't take the rest of the corpus down with it.
+def parse_source_isolated(job: Tuple[str, Tuple[str, ...]]) -> Tuple[List[Song], Optional[str]]:
+	corpus_name, source = job
+	module = importlib.import_module('corpus.' + corpus_name)
+	try:
+		return (module.parse_source(source), None)
+	except Exception:
+		return ([], traceback.format_exc())
+
+def parse_corpus(corpus_name: str, executor: Optional[ProcessPoolExecutor], use_cache: bool = True) -> List[Song]:
+	module = importlib.import_module('corpus.' + corpus_name)
+	start_time = time.time()
+	sources = module.list_sources()
+
+	version = cache.converter_version(corpus_name)
+	keys = [cache.source_key(version, source) for source in sources]
+	cached: List[Optional[List[Song]]] = [cache.load(corpus_name, key) if use_cache else None for key in keys]
+	jobs = [(corpus_name, source) for source, hit in zip(sources, cached) if hit is None]
+
+	# map preserves input order, so the output is the same no matter which
+	# worker finishes first
+	if executor is None:
+		results = map(parse_source_isolated, jobs)
+	else:
+		results = executor.map(parse_source_isolated, jobs)
+
+	songs: List[Song] = []
+	failures = []
+	for source, key, hit in zip(sources, keys, cached):
+		if hit is None:
+			source_songs, error = next(results)
+			if error is not None:
+				print('! failed to parse', ', '.join(source))
+				print(error)
+				failures.append(source)
+			else:
+				cache.store(corpus_name, key, source_songs)
+		else:
+			source_songs = hit
+		songs.extend(source_songs)
+	pruned = cache.prune(corpus_name, keys)
+
+	module.dump_songs(songs)
+	print("{}: {} songs from {} files in {:.2f} seconds ({} cached, {} parsed, {} failed, {} stale cache entries removed)".format(corpus_name, len(songs), len(sources), time.time() - start_time, len(sources) - len(jobs), len(jobs), len(failures), pruned))
+	return songs
+
+def main():
+	parser = argparse.ArgumentParser(description='Parse all corpora into our format and pickle them.')
+	parser.add_argument('corpora', nargs='*', default=corpus_names, help='which corpora to parse: {} (default: all)'.format(', '.join(corpus_names)))
+	parser.add_argument('--no-cache', action='store_true', help='reparse every file even if its cached parse is up to date')
+	parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes; 1 parses serially in this process')
+	args = parser.parse_args()
+	for corpus_name in args.corpora:
+		if corpus_name not in corpus_names:
+			parser.error('unknown corpus: {}'.format(corpus_name))
+
+	start_time = time.time()
+	if args.jobs > 1:
+		with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+			for corpus_name in args.corpora:
+				parse_corpus(corpus_name, executor, use_cache=not args.no_cache)
+	else:
+		for corpus_name in args.corpora:
+			parse_corpus(corpus_name, None, use_cache=not args.no_cache)
+	print("All done in {:.2f} seconds".format(time.time() - start_time))
+
+if __name__ == '__main__':
+	main()
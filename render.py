@@ -0,0 +1,78 @@
+from typing import Dict, Iterable, List
+
+from chord import Chord
+
+# Everything the client needs to show a chord depends only on the chord, the
+# key signature, and the bottom bass note, so precompute it. The voicing only
+# depends on the bottom bass mod 12, up to shifting everything by octaves:
+# render_offset puts the bass in [bottom_bass, bottom_bass + 12), and
+# (x - 12q - r) % 12 + 12q + r == ((x - r) % 12 + r) + 12q.
+
+key_signatures = range(-7, 8) # C♭ major to C♯ major
+
+class RenderEntry:
+	__slots__ = ['name', 'value', 'voicings']
+
+	def __init__(self, name: str, value: str, voicings: List[List[int]]):
+		self.name = name
+		self.value = value
+		self.voicings = voicings # indexed by bottom bass mod 12
+
+def render_entry(chord: Chord, key_signature: int) -> RenderEntry:
+	midi_root = (key_signature * 7) % 12
+	return RenderEntry(
+		chord.chordname(key_signature),
+		chord.relative_to_absolute(key_signature).stringify(),
+		[chord.render_offset(midi_root, bass_class) for bass_class in range(12)])
+
+class RenderTable:
+	def __init__(self, chords: Iterable[Chord]):
+		# chord id -> key signature -> entry
+		self.entries: Dict[int, Dict[int, RenderEntry]] = {}
+		for chord in chords:
+			self.entries[chord.id] = {key_signature: render_entry(chord, key_signature) for key_signature in key_signatures}
+
+	def entry(self, chord: Chord, key_signature: int) -> RenderEntry:
+		by_key = self.entries.get(chord.id)
+		if by_key is None:
+			# locked/preserved chords from the client can be outside the
+			# vocabulary we were built with; remember them too
+			by_key = self.entries[chord.id] = {}
+		entry = by_key.get(key_signature)
+		if entry is None:
+			entry = by_key[key_signature] = render_entry(chord, key_signature)
+		return entry
+
+	def productionize(self, chord: Chord, key_signature: int, score: float, bottom_bass: int) -> dict:
+		entry = self.entry(chord, key_signature)
+		bass_octave, bass_class = divmod(bottom_bass, 12)
+		octave_offset = 12 * bass_octave
+		return {
+			"name": entry.name,
+			"score": score,
+			"value": entry.value,
+			"midis": [midi + octave_offset for midi in entry.voicings[bass_class]],
+		}
+
+def check_render_table(chords: Iterable[Chord], bottom_basses: Iterable[int] = range(24, 60)) -> int:
+	"""compare the table against computing everything directly; prints
+	mismatches and returns how many there were"""
+	chords = list(chords)
+	bottom_basses = list(bottom_basses)
+	table = RenderTable(chords)
+	mismatches = 0
+	for chord in chords:
+		for key_signature in key_signatures:
+			midi_root = (key_signature * 7) % 12
+			for bottom_bass in bottom_basses:
+				expected = {
+					"name": chord.chordname(key_signature),
+					"score": 0,
+					"value": chord.relative_to_absolute(key_signature).stringify(),
+					"midis": chord.render_offset(midi_root, bottom_bass),
+				}
+				actual = table.productionize(chord, key_signature, 0, bottom_bass)
+				if actual != expected:
+					print('mismatch:', chord, key_signature, bottom_bass, expected, actual)
+					mismatches += 1
+	return mismatches
@@ -1,152 +1,507 @@
 #!/usr/bin/env python
 
+import argparse
 import asyncio
+import functools
+import gc
+import http
+import os
+import signal
+import socket
+import sys
+import threading
+import time
 import websockets
 import json
 import traceback
+from typing import List, Optional, Tuple
 
-import corpus.rs
-import corpus.abc
-import corpus.marg
-from music21 import roman
-from typing import List, Optional
-from typing_extensions import Literal
-from hmmpredictor import SongStatSet, linearly_mixed_hmm_predict
-from chord import Chord
-
-from functools import lru_cache
+from harmonize import Model, WarmingUp, build_model, build_model_stages, cache_key, cached_harmonize, corpus_signature, harmonize, harmonize_cost, handle_live, handle_similar
+from hmmpredictor import DecodeCancelled, appearance_cache, clear_caches
+from speculation import neighbor_requests
 
 # import logging
 # logger = logging.getLogger('websockets')
 # logger.setLevel(logging.INFO)
 # logger.addHandler(logging.StreamHandler())
 
-def productionize_chord(chord, key_signature: int, score: float, bottom_bass: int):
-	midi_root = (key_signature * 7) % 12
-	return {
-		"name": chord.chordname(key_signature),
-		"score": score,
-		"value": chord.relative_to_absolute(key_signature).stringify(),
-		"midis": chord.render_offset(midi_root, bottom_bass),
-	}
+# built in main(), before any workers are forked, or in the background by
+# warm_up() with --lazy
+model: Optional[Model] = None
+
+# Lazy startup: bind the port right away and build the model in the
+# background, major first (see build_model_stages). Until a request's mode is
+# ready, it gets {'seq', 'warmingUp': {'readyModes', 'retryAfter'}} instead of
+# a result, and the client asks again. GET /ready answers 200 once everything
+# is loaded (503 with the ready modes before that) and GET /health answers 200
+# as soon as we're listening, for whatever supervises us.
+warm_up_retry_after = 1.0 # seconds
+
+async def warm_up() -> float:
+	global model
+	print("warming up...")
+	start_time = time.time()
+	loop = asyncio.get_event_loop()
+	stages = build_model_stages()
+	while True:
+		stage = await loop.run_in_executor(None, next, stages, None)
+		if stage is None: break
+		model = stage
+		print("ready for {} after {:.2f} seconds".format(', '.join(model.ready_modes()), time.time() - start_time))
+	return time.time() - start_time
+
+def ready_modes() -> List[str]:
+	return [] if model is None else model.ready_modes()
+
+async def process_request(path: str, request_headers):
+	if path == '/health':
+		return (http.HTTPStatus.OK, [('Content-Type', 'application/json')], json.dumps({'alive': True}).encode('utf-8') + b'\n')
+	if path == '/ready':
+		ready = model is not None and model.ready()
+		status = http.HTTPStatus.OK if ready else http.HTTPStatus.SERVICE_UNAVAILABLE
+		return (status, [('Content-Type', 'application/json')], json.dumps({'ready': ready, 'readyModes': ready_modes()}).encode('utf-8') + b'\n')
+	return None # carry on with the websocket handshake
+
+# Hot reload: when the corpora are dumped again (or someone on this machine
+# sends {'seq', 'admin': 'reload'}), we build a new model on a background
+# thread while we keep serving from the old one, then swap it in. Every
+# message is handled start to finish by whichever model was current when it
+# arrived, and live sessions keep their harmonizer until they reset, so
+# nothing in flight notices. With several workers, only the parent watches
+# and reloads (see serve_workers); a worker that gets a reload message passes
+# it on to the parent with SIGHUP.
+#
+# A build that's already running may have read the corpora before whatever
+# asked for the reload changed them, so a reload never just shares it: it
+# queues one rebuild to start once that build (or --lazy's warm-up) is done.
+# Reloads asked for while one is queued share the queued one.
+build_task: Optional[asyncio.Future] = None # warm-up or the rebuild in progress
+queued_reload: Optional[asyncio.Future] = None
+# set in workers
+parent_pid: Optional[int] = None
+
+async def reload_model(reason: str) -> float:
+	"""returns how long the rebuild took"""
+	global queued_reload
+	if queued_reload is None:
+		queued_reload = asyncio.ensure_future(queued_rebuild(reason))
+	return await asyncio.shield(queued_reload)
+
+async def queued_rebuild(reason: str) -> float:
+	global build_task, queued_reload
+	while build_task is not None and not build_task.done():
+		await asyncio.wait([build_task])
+	# from here on, a reload needs another rebuild after this one
+	queued_reload = None
+	build_task = asyncio.ensure_future(rebuild_model(reason))
+	return await build_task
+
+async def rebuild_model(reason: str) -> float:
+	global model
+	print("reloading model ({})...".format(reason))
+	start_time = time.time()
+	new_model = await asyncio.get_event_loop().run_in_executor(None, build_model)
+	model = new_model
+	# they'd keep the old model's stat sets alive until they aged out
+	clear_caches()
+	elapsed = time.time() - start_time
+	print("reloaded model in {:.2f} seconds".format(elapsed))
+	return elapsed
+
+class CorpusWatcher:
+	"""poll() every so often says whether the corpora have been dumped again"""
+	def __init__(self):
+		self.last = corpus_signature()
+		self.pending: Optional[Tuple] = None
+
+	def poll(self) -> bool:
+		signature = corpus_signature()
+		if signature is None or signature == self.last:
+			self.pending = None
+			return False
+		if signature != self.pending:
+			# wait until it holds still for a whole interval, so dumping
+			# several corpora in a row is one reload and not several
+			self.pending = signature
+			return False
+		self.last = signature
+		self.pending = None
+		return True
+
+async def watch_corpora(interval: float):
+	watcher = CorpusWatcher()
+	while True:
+		await asyncio.sleep(interval)
+		if not watcher.poll(): continue
+		try:
+			await reload_model('corpora changed')
+		except Exception:
+			traceback.print_exc()
+
+# Speculation (--speculate): after answering a harmonize request, spend up to
+# speculation_budget seconds of CPU harmonizing the requests the client is
+# likely to send next (see speculation.py) into the model's response cache.
+# The guesses run on another thread, which checks between measures whether
+# the budget is spent or the next message on that connection has arrived, so
+# a real request waits for at most one measure of speculation.
+speculation_budget = 0.0 # seconds of CPU per answered request; 0 is off
+
+class QuietThreadsStdout:
+	"""stands in for sys.stdout, dropping what threads that asked to be quiet
+	print (the predictor is chatty) and passing the rest on"""
+	def __init__(self, stream):
+		self.stream = stream
+		self.local = threading.local()
+
+	def write(self, s: str) -> int:
+		if getattr(self.local, 'quiet', False): return len(s)
+		return self.stream.write(s)
+
+	def __getattr__(self, name: str):
+		return getattr(self.stream, name)
 
-rs_songs = corpus.rs.load_songs()
-abc_songs = corpus.abc.load_songs()
-marg_songs = corpus.marg.load_songs()
-print("loaded songs")
+def harmonize_within(current_model: Model, ans: dict, budget: float, cancelled: threading.Event) -> Tuple[Optional[dict], float]:
+	"""harmonize on this thread, giving up once it has used budget seconds of
+	its CPU or cancelled is set; returns (response or None, CPU seconds)"""
+	start_time = time.thread_time()
+	def should_stop() -> bool:
+		return cancelled.is_set() or time.thread_time() - start_time > budget
+	quiet = sys.stdout.local if isinstance(sys.stdout, QuietThreadsStdout) else threading.local()
+	quiet.quiet = True
+	try:
+		return harmonize(current_model, ans, should_stop=should_stop), time.thread_time() - start_time
+	except (DecodeCancelled, WarmingUp):
+		return None, time.thread_time() - start_time
+	finally:
+		# the executor's threads do other things too
+		quiet.quiet = False
 
-major_songs = rs_songs['maj'] + rs_songs['mix'] + abc_songs['maj'] + marg_songs
-minor_songs = rs_songs['min'] + abc_songs['min']
+async def speculate(current_model: Model, ans: dict, cancelled: threading.Event):
+	# let messages that are already waiting get in (and cancel us) first
+	await asyncio.sleep(0.01)
+	loop = asyncio.get_event_loop()
+	spent = 0.0
+	done = 0
+	for guess in neighbor_requests(ans):
+		if cancelled.is_set() or spent >= speculation_budget:
+			break
+		key = cache_key(guess)
+		if key in current_model.response_cache:
+			continue
+		response, seconds = await loop.run_in_executor(None, harmonize_within, current_model, guess, speculation_budget - spent, cancelled)
+		spent += seconds
+		if response is not None:
+			current_model.response_cache.put(key, response)
+			done += 1
+	print("speculated {} requests in {:.2f} CPU seconds".format(done, spent))
 
-major_songs = [song.modify_chord(lambda chord: chord.beta_collapse()) for song in major_songs]
-minor_songs = [song.modify_chord(lambda chord: chord.beta_collapse()) for song in minor_songs]
+# Progressive answers (--deadline): when the exact harmonization looks like
+# it'll take longer than deadline seconds, first send a quick approximate one
+# (a beam search, see linearly_mixed_hmm_predict) with 'final': False, then
+# the exact one with the same seq and 'final': True. The approximate one is
+# given up on if it isn't done by the deadline, since by then it isn't quick.
+# How long it looks like it'll take is learned from the exact ones we've done
+# so far (until there are any, we assume the worst). Both run on another
+# thread, so the approximate answer goes out while the exact one is worked
+# on. Only exact answers go in the cache. If the exact one fails, the client
+# gets an error with the request's seq, which ends it like 'final' would.
+deadline = 0.0 # seconds; 0 is off
+approximate_beam_width = 16
+exact_seconds_per_cost: Optional[float] = None
 
-major_stat_set = SongStatSet.from_songs(major_songs)
-parallel_minor_stat_set = SongStatSet.from_songs(minor_songs)
-relative_minor_stat_set = SongStatSet.from_songs([song.transpose(-3) for song in minor_songs])
+async def send_progressively(websocket, current_model: Model, ans: dict) -> bool:
+	"""returns whether it was a cache hit"""
+	global exact_seconds_per_cost
+	key = cache_key(ans)
+	response = current_model.response_cache.get(key)
+	if response is not None:
+		await websocket.send(json.dumps(dict(response, seq=ans['seq'], final=True)))
+		return True
 
-all_chords = list(sorted(set(major_stat_set.all_chords()) | set(parallel_minor_stat_set.all_chords()) | set(relative_minor_stat_set.all_chords())))
+	loop = asyncio.get_event_loop()
+	cost = harmonize_cost(current_model, ans)
+	if exact_seconds_per_cost is None or cost * exact_seconds_per_cost > deadline:
+		start_time = time.time()
+		def too_late() -> bool:
+			return time.time() - start_time > deadline
+		try:
+			approximate = await loop.run_in_executor(None, functools.partial(harmonize, current_model, ans, beam_width=approximate_beam_width, should_stop=too_late))
+			await websocket.send(json.dumps(dict(approximate, final=False)))
+			print("approximate answer in {:.2f} seconds".format(time.time() - start_time))
+		except DecodeCancelled:
+			print("no approximate answer within {:.2f} seconds".format(deadline))
+		except Exception:
+			# the exact one might still work
+			traceback.print_exc()
+
+	start_time = time.time()
+	response = await loop.run_in_executor(None, harmonize, current_model, ans)
+	elapsed = time.time() - start_time
+	current_model.response_cache.put(key, response)
+	await websocket.send(json.dumps(dict(response, final=True)))
+	print("exact answer in {:.2f} seconds".format(elapsed))
 
-# all_stat_set = SongStatSet.from_songs(major_songs + minor_songs)
-# minor_in_relative_major_stat_set = SongStatSet.from_songs(major_songs + [song.transpose(-3) for song in minor_songs])
+	rate = elapsed / max(cost, 1)
+	# a moving average, since one unusually slow request shouldn't make us
+	# send two answers to every request after it
+	exact_seconds_per_cost = rate if exact_seconds_per_cost is None else 0.7 * exact_seconds_per_cost + 0.3 * rate
+	return False
+
+def is_local(websocket) -> bool:
+	address = websocket.remote_address
+	return address is not None and address[0] in ('127.0.0.1', '::1')
+
+async def handle_admin(websocket, admin) -> dict:
+	if not is_local(websocket):
+		raise PermissionError('admin messages are only accepted from this machine')
+	if admin == 'reload':
+		if parent_pid is not None:
+			# it'll replace all the workers, us included, once it's done
+			os.kill(parent_pid, signal.SIGHUP)
+			return {'reloading': True}
+		return {'reloaded': True, 'seconds': await reload_model('admin message')}
+	if admin == 'stats':
+		return {'appearanceCache': appearance_cache.stats(), 'responseCache': 0 if model is None else len(model.response_cache.entries)}
+	raise ValueError('unknown admin command: {}'.format(admin))
 
 async def echo(websocket, path):
 	print("echo!!!")
+	live_state: dict = {}
+	# set to stop this connection's speculation
+	speculation_cancelled: Optional[threading.Event] = None
 	async for message in websocket:
 		print("message!!!")
+		if speculation_cancelled is not None:
+			speculation_cancelled.set()
+		# this message sticks with this model even if a reload finishes
+		current_model = model
+		ans: dict = {}
 		try:
 			ans = json.loads(message)
 			print(ans)
-			seq_number = ans['seq']
-			music = ans['music']
-			chord_length = ans['chordLength']
-			jazziness = ans['jazziness']
-			first_weight = ans['firstWeight']
-			determinism_weight = ans['determinismWeight']
-			seed = ans['seed']
-			bottom_bass = ans['bottomBass']
-
-			# this is a p bad name tbh
-			constraints = ans['constraints'] # Optional[List[{'time': float, 'value': str, 'locked': bool}]]
-			raw_notes = music['notes']
-			key_signature = ans['keySignature']
-			minorness = ans['minorness']
-			tolerance = ans['tolerance']
-			mode = ans['mode']
-			preserve = ans['preserve'] # preserve even unlocked stuff
-
-			midi_root_of_major = key_signature * 7 % 12
-			# even for relative minor we're going to use the major root for simplicity;
-			# we can transpose all the data, so it's fine.
-			if not constraints:
-				last_end = max(note['end'] for note in raw_notes)
-				constraints = [{'time': i * chord_length, 'locked': False} for i in range(1 + int(last_end // chord_length))]
-				preserve = False
-
-			grouped_notes = []
-
-			notes_ix = 0
-			# get all but last measure
-			for constraint, next_constraint in zip(constraints, constraints[1:]):
-				start = constraint['time']
-				end = next_constraint['time']
-
-				group = []
-				while notes_ix < len(raw_notes) and raw_notes[notes_ix]['start'] < end - tolerance:
-					group.append((raw_notes[notes_ix]['pitch'] - midi_root_of_major) % 12)
-					notes_ix += 1
-				grouped_notes.append(group)
-
-			# followed by last group
-			last_group = []
-			while notes_ix < len(raw_notes):
-				last_group.append((raw_notes[notes_ix]['pitch'] - midi_root_of_major) % 12)
-				notes_ix += 1
-			grouped_notes.append(last_group)
-
-			assert len(grouped_notes) == len(constraints)
-
-			print('------------------------')
-			print('constraints:', constraints)
-			locked_chords = [Chord.parse(constraint['value']).absolute_to_relative(key_signature) if constraint['locked'] else None for constraint in constraints]
-
-			if preserve:
-				preserve_chords = [Chord.parse(constraint['value']).absolute_to_relative(key_signature) for constraint in constraints]
+			if 'admin' in ans:
+				await websocket.send(json.dumps({'seq': ans['seq'], 'admin': await handle_admin(websocket, ans['admin'])}))
+				continue
+			if current_model is None:
+				raise WarmingUp(ans.get('mode', 'anything'), [])
+			if 'live' in ans:
+				await websocket.send(json.dumps({'seq': ans['seq'], 'live': handle_live(current_model, ans['live'], live_state)}))
+				continue
+			if 'similar' in ans:
+				await websocket.send(json.dumps({'seq': ans['seq'], 'similar': handle_similar(current_model, ans['similar'])}))
+				continue
+			if deadline > 0:
+				hit = await send_progressively(websocket, current_model, ans)
 			else:
-				preserve_chords = None
-
-
-			if mode == 'major': stat_set_list = [(1.0, major_stat_set)]
-			elif mode == 'parallel-minor': stat_set_list = [(1.0, parallel_minor_stat_set)]
-			elif mode == 'relative-minor': stat_set_list = [(1.0, relative_minor_stat_set)]
-			elif mode == 'mixed-parallel': stat_set_list = [(1.0 - minorness, major_stat_set), (minorness, parallel_minor_stat_set)]
-			elif mode == 'mixed-relative': stat_set_list = [(1.0 - minorness, major_stat_set), (minorness, relative_minor_stat_set)]
-			else: stat_set_list = [(1.0, major_stat_set)] # ?????
-
-			chords = linearly_mixed_hmm_predict(stat_set_list, grouped_notes, locked_chords, preserve_chords, jazziness=jazziness, seed=seed, first_note_weight=first_weight, determinism_weight=determinism_weight)
-			res = []
-			for i, ((chord_score, chord), suggestion, scored_chord_list) in enumerate(chords):
-				res.append({
-					'time': constraints[i]['time'],
-					'value': productionize_chord(chord, key_signature, chord_score, bottom_bass),
-					'suggestion': productionize_chord(suggestion[1], key_signature, suggestion[0], bottom_bass) if suggestion else None,
-					'locked': i < len(locked_chords) and locked_chords[i] is not None,
-					'recommendations': [productionize_chord(c, key_signature, s, bottom_bass) for (s, c) in scored_chord_list],
-				})
-			print('------------------------')
-			print('result:', res)
-			await websocket.send(json.dumps({
-				'seq': seq_number,
-				'allChords': [productionize_chord(c, key_signature, 0, bottom_bass) for c in all_chords],
-				'result': res,
-			}))
+				response, hit = cached_harmonize(current_model, ans)
+				await websocket.send(json.dumps(response))
+			if hit:
+				print('cache hit')
+			if speculation_budget > 0:
+				speculation_cancelled = threading.Event()
+				asyncio.ensure_future(speculate(current_model, ans, speculation_cancelled))
+		except WarmingUp as e:
+			print(e)
+			await websocket.send(json.dumps({'seq': ans.get('seq'), 'warmingUp': {'readyModes': e.ready_modes, 'retryAfter': warm_up_retry_after}}))
 		except Exception as e:
 			print(e)
 			traceback.print_exc()
-			await websocket.send(json.dumps({'error': traceback.format_exc()}))
+			await websocket.send(json.dumps({'seq': ans.get('seq'), 'error': traceback.format_exc()}))
+
+# how long a retiring worker lets its connections finish what they're doing
+# before closing them, so nobody stays on the old model for long
+retire_grace = 10.0 # seconds
+
+async def retire(server):
+	"""stop accepting connections (the other workers have the socket too),
+	give the ones we have retire_grace seconds to close, then close them with
+	1012 (service restart), which the client takes as a cue to reconnect"""
+	server.server.close()
+	give_up_time = time.time() + retire_grace
+	while server.websockets and time.time() < give_up_time:
+		await asyncio.sleep(0.5)
+	await asyncio.gather(*[websocket.close(1012, 'reloading') for websocket in list(server.websockets)], return_exceptions=True)
+	asyncio.get_event_loop().stop()
+
+def serve(watch_interval: float, lazy: bool = False, **kwargs):
+	global build_task
+	start_server = websockets.serve(echo, process_request=process_request, **kwargs)
+
+	print("starting server in event loop...")
+	loop = asyncio.get_event_loop()
+	server = loop.run_until_complete(start_server)
+	if parent_pid is not None:
+		loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(retire(server)))
+	if lazy:
+		# a reload asked for meanwhile happens after it
+		build_task = asyncio.ensure_future(warm_up())
+	if watch_interval > 0:
+		asyncio.ensure_future(watch_corpora(watch_interval))
+	asyncio.get_event_loop().run_forever()
+
+# Multi-worker mode: load the model once, then fork workers that all accept
+# on one listening socket (the kernel hands each connection to whichever
+# worker is free). The workers share the parent's model copy-on-write, and
+# the corpora are mmapped, so N workers cost about one model's worth of
+# memory. Each connection's live state stays in the worker that accepted it.
+# The parent only looks after the workers: it replaces any that die, and
+# passes SIGTERM (or Ctrl-C) on to all of them before exiting.
+#
+# The parent is also the one that hot reloads, when the corpora change or it
+# gets SIGHUP: it builds the new model itself, forks a fresh set of workers
+# that share that one, and sends the old workers SIGHUP, which makes them
+# stop accepting and exit once their connections close, or close them after
+# retire_grace seconds so clients reconnect to a new worker. Reloading in every
+# worker would build N private models at once and lose the sharing for good.
+worker_restart_delay = 1.0 # seconds, so one that dies right away doesn't spin
+
+def listening_socket(host: str, port: int) -> socket.socket:
+	family, type, proto, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE)[0]
+	sock = socket.socket(family, type, proto)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	sock.bind(address)
+	sock.listen(128)
+	sock.setblocking(False)
+	return sock
+
+def start_worker(i: int, sock: socket.socket) -> int:
+	global parent_pid
+	ppid = os.getpid()
+	pid = os.fork()
+	if pid == 0:
+		status = 0
+		try:
+			parent_pid = ppid
+			# the parent's handlers aren't ours
+			signal.signal(signal.SIGTERM, signal.SIG_DFL)
+			signal.signal(signal.SIGINT, signal.default_int_handler)
+			signal.signal(signal.SIGHUP, signal.SIG_DFL)
+			print("worker {} (pid {})".format(i, os.getpid()))
+			serve(0, sock=sock)
+		except KeyboardInterrupt:
+			pass
+		except Exception:
+			traceback.print_exc()
+			status = 1
+		finally:
+			os._exit(status)
+	return pid
+
+def serve_workers(host: str, port: int, workers: int, watch_interval: float):
+	global model
+	sock = listening_socket(host, port)
+
+	# nothing writes to the model after this, but the garbage collector would
+	# still walk (and so copy) every page of it in every worker
+	gc.freeze()
+
+	stopping = False
+	reload_reason: Optional[str] = None
+	def stop(signum, frame):
+		nonlocal stopping
+		stopping = True
+	def request_reload(signum, frame):
+		nonlocal reload_reason
+		reload_reason = 'SIGHUP'
+	signal.signal(signal.SIGTERM, stop)
+	signal.signal(signal.SIGINT, stop)
+	signal.signal(signal.SIGHUP, request_reload)
+
+	# pid -> (worker number, when it started)
+	running = {}
+	# old workers finishing their connections after a reload
+	retiring = set()
+	for i in range(workers):
+		running[start_worker(i, sock)] = (i, time.time())
+
+	watcher = CorpusWatcher() if watch_interval > 0 else None
+	next_watch = time.time() + watch_interval
+
+	print("serving on {} with {} workers".format(sock.getsockname()[:2], workers))
+	while not stopping:
+		if watcher is not None and time.time() >= next_watch:
+			next_watch = time.time() + watch_interval
+			if watcher.poll():
+				reload_reason = 'corpora changed'
+		if reload_reason is not None:
+			print("reloading model ({})...".format(reload_reason))
+			reload_reason = None
+			start_time = time.time()
+			try:
+				new_model = build_model()
+			except Exception:
+				traceback.print_exc()
+			else:
+				# let the old model go (it was frozen with everything else)
+				gc.unfreeze()
+				model = new_model
+				clear_caches()
+				gc.collect()
+				gc.freeze()
+				print("reloaded model in {:.2f} seconds".format(time.time() - start_time))
+				for pid, (i, _) in list(running.items()):
+					running[start_worker(i, sock)] = (i, time.time())
+					del running[pid]
+					retiring.add(pid)
+					os.kill(pid, signal.SIGHUP)
+			continue
+
+		try:
+			pid, status = os.waitpid(-1, os.WNOHANG)
+		except ChildProcessError:
+			break
+		if pid == 0:
+			time.sleep(0.5)
+			continue
+		if pid in retiring:
+			retiring.remove(pid)
+			continue
+		i, start_time = running.pop(pid)
+		print("worker {} (pid {}) exited (wait status {}), restarting it".format(i, pid, status))
+		if time.time() - start_time < worker_restart_delay:
+			time.sleep(worker_restart_delay)
+		if not stopping:
+			running[start_worker(i, sock)] = (i, time.time())
+
+	for pid in list(running) + list(retiring):
+		try:
+			os.kill(pid, signal.SIGTERM)
+		except ProcessLookupError:
+			pass
+	for pid in list(running) + list(retiring):
+		try:
+			os.waitpid(pid, 0)
+		except ChildProcessError:
+			pass
+
+def main():
+	global model, speculation_budget, deadline
+	parser = argparse.ArgumentParser(description='Serve harmonizations to the client over a websocket.')
+	parser.add_argument('--host', default='localhost')
+	parser.add_argument('--port', type=int, default=8765)
+	parser.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes sharing one copy of the model (Unix only)')
+	parser.add_argument('--lazy', action='store_true', help='start listening right away and load the model in the background (single worker only)')
+	parser.add_argument('--speculate', type=float, nargs='?', const=1.0, default=0.0, metavar='SECONDS', help='after each answer, spend up to this much idle CPU time (default 1) precomputing likely next requests')
+	parser.add_argument('--deadline', type=float, default=0.0, metavar='SECONDS', help='if an answer would take longer than this, send a quick approximate one first, then the exact one')
+	parser.add_argument('--watch-interval', type=float, default=5.0, help='seconds between checks for re-dumped corpora to hot reload; 0 to not watch')
+	args = parser.parse_args()
+	speculation_budget = args.speculate
+	if speculation_budget > 0:
+		sys.stdout = QuietThreadsStdout(sys.stdout)
+	deadline = args.deadline
+	if args.lazy and args.workers > 1:
+		# the workers share the model by forking after it's built
+		parser.error('--lazy only works with a single worker')
+
+	if args.lazy:
+		serve(args.watch_interval, lazy=True, host=args.host, port=args.port)
+		return
 
-start_server = websockets.serve(echo, "localhost", 8765)
+	model = build_model()
+	if args.workers > 1:
+		serve_workers(args.host, args.port, args.workers, args.watch_interval)
+	else:
+		serve(args.watch_interval, host=args.host, port=args.port)
 
-print("starting server in event loop...")
-asyncio.get_event_loop().run_until_complete(start_server)
-asyncio.get_event_loop().run_forever()
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,49 @@
+from typing import Iterator, List
+
+# Guesses at the client's next harmonize request, most likely first. While
+# someone drags the minorness or jazziness control, each request is the last
+# one with that value nudged by a step or two, so after answering we can
+# harmonize the neighbors into the response cache while nobody's waiting.
+# After those come the other modes, for when they click a radio button.
+#
+# Values are generated the way the client makes them (an integer UI value
+# divided by its magnitude), so they compare equal to what it'll send.
+
+# the client's slider scales and ranges
+MINORNESS_MAX = 100
+JAZZ_MAGNITUDE = 100
+
+modes = ['major', 'parallel-minor', 'relative-minor', 'mixed-parallel', 'mixed-relative']
+mixed_modes = ['mixed-parallel', 'mixed-relative']
+
+def nudged(value: float, magnitude: int, low: int, high: int, steps: int) -> List[float]:
+	"""value moved by 1, -1, 2, -2, ... up to steps UI units, within range"""
+	ui_value = round(value * magnitude)
+	ret = []
+	for step in range(1, steps + 1):
+		for signed_step in [step, -step]:
+			if low <= ui_value + signed_step <= high:
+				ret.append((ui_value + signed_step) / magnitude)
+	return ret
+
+def neighbor_requests(ans: dict, steps: int = 3, other_modes: bool = True) -> Iterator[dict]:
+	# weights replace the mode and minorness, so varying those gives the same
+	# request again
+	weighted = bool(ans.get('weights'))
+	# the slider that was moved last is the one most likely to move again,
+	# but we can't tell which that was, so interleave them
+	if not weighted and ans['mode'] in mixed_modes:
+		minornesses = nudged(ans['minorness'], MINORNESS_MAX, 0, MINORNESS_MAX, steps)
+	else:
+		minornesses = []
+	jazzinesses = nudged(ans['jazziness'], JAZZ_MAGNITUDE, -JAZZ_MAGNITUDE, JAZZ_MAGNITUDE, steps)
+	for i in range(max(len(minornesses), len(jazzinesses))):
+		if i < len(jazzinesses):
+			yield dict(ans, jazziness=jazzinesses[i])
+		if i < len(minornesses):
+			yield dict(ans, minorness=minornesses[i])
+
+	if other_modes and not weighted:
+		for mode in modes:
+			if mode != ans['mode']:
+				yield dict(ans, mode=mode)
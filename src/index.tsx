@@ -23,6 +23,8 @@ import { InstrumentDialog, DEFAULT_MUSIC_INSTRUMENT, DEFAULT_CHORD_INSTRUMENT, l
 
 const GM_ZERO_INDEXED_PERCUSSION_CHANNEL = 9;
 const WEBSOCKET_URL = "ws://localhost:8765";
+const WS_SERVICE_RESTART = 1012; // close code the server uses when a worker retires
+const RECONNECT_DELAY_MS = 200;
 const CHORD_INCLUSION_TOLERANCE = 1.0e-6;
 
 const INSTRUMENT = 0;
@@ -445,6 +447,8 @@ class MusicPlayer extends Component<{}, MusicPlayerState> {
 	wsReady = false;
 	ws: WebSocket;
 	seq = 0; // sequence number for websocket stuff
+	lastPreserve = false; // to resend the last request if the server is still warming up
+	reconnecting = false;
 
 	constructor(props: {}) {
 		super(props);
@@ -499,12 +503,32 @@ class MusicPlayer extends Component<{}, MusicPlayerState> {
 		this.displayRef = React.createRef();
 		this.displayOuterRef = React.createRef();
 
+		this.connectWS();
+	}
+
+	connectWS = () => {
 		const ws = new WebSocket(WEBSOCKET_URL);
 		this.ws = ws;
 		ws.onopen = () => {
 			this.wsReady = true;
+			if (this.reconnecting) {
+				this.reconnecting = false;
+				this.setState({ error: undefined });
+				// the request we were waiting on may have gone down with
+				// the old connection
+				if (this.state.loading) this.sendWSWithPreserve(this.lastPreserve);
+			}
 		};
 		ws.onclose = event => {
+			this.wsReady = false;
+			if (event.code === WS_SERVICE_RESTART) {
+				// the server is replacing the process we were talking to
+				// (e.g. after reloading its model); the new one's already
+				// listening
+				this.reconnecting = true;
+				setTimeout(this.connectWS, RECONNECT_DELAY_MS);
+				return;
+			}
 			console.error("Connection closed: " + JSON.stringify(event));
 			this.setState({ error: "Connection closed" });
 		};
@@ -517,17 +541,26 @@ class MusicPlayer extends Component<{}, MusicPlayerState> {
 			console.log(event.data);
 			const data = JSON.parse(event.data);
 			const stateDiff = {};
+			if (data.warmingUp) {
+				// the server is still loading the model for this mode; ask again
+				if (data.seq === this.seq) {
+					setTimeout(() => this.sendWSWithPreserve(this.lastPreserve), data.warmingUp.retryAfter * 1000);
+				}
+				return;
+			}
 			if (data.error) {
 				this.setState({ error: data.error });
 			}
 			if (data.allChords) { stateDiff.allChords = data.allChords; }
 			if (data.result) { stateDiff.chords = data.result; }
 			if (data.seq === this.seq) {
-				stateDiff.loading = false;
+				// with --deadline, a quick approximate answer ('final': false)
+				// comes first and the exact one follows
+				stateDiff.loading = data.final === false;
 				this.setState(stateDiff);
 			}
 		};
-	}
+	};
 
 	togglePlaying = () => {
 		if (!this.state.music) return;
@@ -737,6 +770,7 @@ class MusicPlayer extends Component<{}, MusicPlayerState> {
 	sendWSWithPreserve = debounce((preserve) => {
 		if (this.wsReady && this.state.music) {
 			this.seq++;
+			this.lastPreserve = preserve;
 			this.setState({ loading: true });
 			this.ws.send(JSON.stringify({
 				seq: this.seq,
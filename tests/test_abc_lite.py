@@ -0,0 +1,26 @@
+import os
+import pytest
+
+import corpus.abc as abc
+import corpus.abc.lite as lite
+
+fixture_dirpath = os.path.join(os.path.dirname(__file__), 'fixtures', 'abc')
+fixture_sources = [(os.path.join(fixture_dirpath, filename),) for filename in sorted(os.listdir(fixture_dirpath))]
+
+def test_lite_parser_matches_music21():
+	pytest.importorskip('music21')
+	assert abc.check_lite_parser(fixture_sources) == 0
+
+def test_single_tune_files_have_no_songs():
+	path = os.path.join(fixture_dirpath, 'single_tune.abc')
+	assert list(lite.tune_events(path)) == []
+	assert abc.parse_source((path,)) == []
+
+def test_songs_split_at_key_changes():
+	songs = abc.parse_source((os.path.join(fixture_dirpath, 'two_tunes.abc'),))
+	assert [(song.name, song.meta) for song in songs] == [
+		('two_tunes.abc/Test Jig/0', 'major'),
+		('two_tunes.abc/Test Jig/1', 'major'),
+		('two_tunes.abc/Test Reel/0', 'minor'),
+	]
+	assert all(song.measures for song in songs)
@@ -0,0 +1,49 @@
+import contextlib, io, random
+
+from harmonize import Model, cache_key, cached_harmonize
+from hmmpredictor import SongStatSet
+from speculation import neighbor_requests
+from test_streaming import random_songs
+
+def small_model() -> Model:
+	rng = random.Random(5)
+	return Model(SongStatSet.from_songs(random_songs(rng, 20)), SongStatSet.from_songs(random_songs(rng, 20)))
+
+def request(**kwargs) -> dict:
+	# C, E, G, C, one per measure
+	notes = [{'start': float(i), 'end': i + 1.0, 'pitch': pitch} for i, pitch in enumerate([60, 64, 67, 72])]
+	return dict({
+		'seq': 1,
+		'music': {'notes': notes},
+		'chordLength': 1.0,
+		'jazziness': 0.0,
+		'firstWeight': 1.0,
+		'determinismWeight': 1.0,
+		'seed': None,
+		'bottomBass': 40,
+		'constraints': None,
+		'keySignature': 0,
+		'tolerance': 0.1,
+		'preserve': False,
+	}, **kwargs)
+
+def test_weights_without_mode():
+	model = small_model()
+	weighted = request(weights={'major': 1.0, 'minor': 1.0})
+	with contextlib.redirect_stdout(io.StringIO()):
+		response, hit = cached_harmonize(model, weighted)
+		assert not hit
+		# half and half is what mixed-parallel at 0.5 mixes too
+		mixed, _ = cached_harmonize(model, request(mode='mixed-parallel', minorness=0.5))
+		assert mixed == response
+		again, hit = cached_harmonize(model, dict(weighted, seq=2))
+		assert hit and again == dict(response, seq=2)
+	# with or without a mode, the weights decide
+	assert cache_key(dict(weighted, mode='major', minorness=0.3)) == cache_key(weighted)
+
+def test_weighted_neighbors_only_vary_jazziness():
+	weighted = request(weights={'major': 1.0, 'minor': 1.0}, jazziness=0.5)
+	neighbors = list(neighbor_requests(weighted))
+	assert neighbors
+	assert all(set(neighbor) == set(weighted) and neighbor['jazziness'] != weighted['jazziness'] for neighbor in neighbors)
+	assert len(set(cache_key(neighbor) for neighbor in neighbors)) == len(neighbors)
@@ -0,0 +1,95 @@
+import contextlib, io, math, random
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from chord import Chord
+from hmmpredictor import SongStatSet, chord_ranks, compute_mixed_stats, linearly_mixed_hmm_predict, top_indices
+from test_streaming import chords, random_melody, random_songs
+
+# What mixing used to do, with dicts: each entry is the weighted sum of the
+# stat sets' entries, with -1e3 for ones they don't have. Reads with get so
+# the stat sets' defaultdicts don't grow.
+def reference_mix(weighted_dicts, default: float) -> Dict:
+	keys = set()
+	for _weight, d in weighted_dicts:
+		keys.update(d.keys())
+	return {key: sum(weight * d.get(key, default) for weight, d in weighted_dicts) for key in keys}
+
+def reference_mix_rows(weighted_dicts, default: float) -> Dict:
+	keys = set()
+	for _weight, d in weighted_dicts:
+		keys.update(d.keys())
+	return {key: reference_mix([(weight, d.get(key, {})) for weight, d in weighted_dicts], default) for key in keys}
+
+def reference_appearance(stat_set: SongStatSet, first_note_weight: float) -> Dict:
+	ret = {}
+	for chord in set(stat_set.first_appearances.keys()) | set(stat_set.nonfirst_appearances.keys()):
+		first = stat_set.first_appearances.get(chord, {})
+		nonfirst = stat_set.nonfirst_appearances.get(chord, {})
+		note_total = first_note_weight * sum(first.values()) + sum(nonfirst.values())
+		ret[chord] = {note: math.log((first_note_weight * first.get(note, 0) + nonfirst.get(note, 0)) / note_total) for note in set(first.keys()) | set(nonfirst.keys())}
+	return ret
+
+def quietly_predict(*args, **kwargs):
+	with contextlib.redirect_stdout(io.StringIO()):
+		return linearly_mixed_hmm_predict(*args, **kwargs)
+
+def test_array_mixer_matches_dict_mixer():
+	rng = random.Random(2)
+	unknown = Chord.parse('11:dim None 0')
+	assert unknown not in chords
+	for trial in range(12):
+		stat_sets = [SongStatSet.from_songs(random_songs(rng, rng.randint(1, 10))) for _ in range(1 + trial % 3)]
+		# transposed views go through the same mixing in the real model
+		stat_sets = [stat_set.transposed(rng.choice([0, 0, -3, 5])) for stat_set in stat_sets]
+		weighted_stat_sets = [(rng.choice([1.0, 0.5, 0.3, 2.0]), stat_set) for stat_set in stat_sets]
+		first_note_weight = rng.choice([1.0, 0.5, 3.0])
+		mixed = compute_mixed_stats(weighted_stat_sets, first_note_weight)
+
+		seen = reference_mix([(w, ss.seen_log_probs) for w, ss in weighted_stat_sets], -1e3)
+		transition = reference_mix_rows([(w, ss.transition_log_probs) for w, ss in weighted_stat_sets], -1e3)
+		back_transition = reference_mix_rows([(w, ss.back_transition_log_probs) for w, ss in weighted_stat_sets], -1e3)
+		appearance = reference_mix_rows([(w, reference_appearance(ss, first_note_weight)) for w, ss in weighted_stat_sets], -1e3)
+
+		def row(rows: Dict, c1: Chord) -> Dict:
+			# The Problem
+			return rows[c1] if c1 in rows else seen
+
+		universe = sorted(set(seen) | set(transition) | set(appearance)) + [unknown]
+		rng.shuffle(universe)
+		assert mixed.seen_log_probs_list(universe) == [seen.get(c, -1e3) for c in universe]
+		assert mixed.transition_table(universe) == [[row(transition, c1).get(c2, -1e3) for c2 in universe] for c1 in universe]
+		assert mixed.back_transition_table(universe) == [[row(back_transition, c1).get(c2, -1e3) for c2 in universe] for c1 in universe]
+		assert set(mixed.appearance_chords) == set(appearance)
+		for notes in random_melody(rng, 10):
+			for chord in universe:
+				expected = sum(appearance.get(chord, {}).get(note, -1e3) * (first_note_weight if i == 0 else 1) for i, note in enumerate(notes))
+				assert mixed.appearance_log_prob(chord, notes, first_note_weight) == expected
+
+def test_low_memory_matches_table_decode():
+	rng = random.Random(3)
+	for trial in range(20):
+		weighted_stat_sets = [(rng.choice([1.0, 0.5]), SongStatSet.from_songs(random_songs(rng, rng.randint(2, 12)))) for _ in range(rng.randint(1, 3))]
+		melody = random_melody(rng, rng.randint(1, 20))
+		locked_chords: List[Optional[Chord]] = [rng.choice(chords) if rng.random() < 0.2 else None for _ in melody]
+		preserve_chords = [rng.choice(chords) for _ in melody] if rng.random() < 0.5 else None
+		kwargs = dict(
+			jazziness=rng.choice([0.0, 0.4, -0.3]),
+			first_note_weight=rng.choice([1.0, 2.0]),
+			seed=rng.choice([None, rng.randrange(1000)]),
+			determinism_weight=rng.choice([1.0, 0.5]),
+		)
+		expected = quietly_predict(weighted_stat_sets, melody, locked_chords, preserve_chords, **kwargs)
+		assert quietly_predict(weighted_stat_sets, melody, locked_chords, preserve_chords, low_memory=True, **kwargs) == expected
+
+def test_top_indices_matches_sorting():
+	rng = random.Random(4)
+	vocabulary = [Chord.parse('{:02d}:{} None 0'.format(root, quality)) for root in range(12) for quality in ['maj', 'min', 'dim']]
+	for trial in range(50):
+		all_chords = rng.sample(vocabulary, rng.randint(1, len(vocabulary)))
+		# coarse scores, so there are lots of ties
+		scores = np.array([[float(rng.randrange(-5, 0)) for _ in all_chords] for _ in range(rng.randint(1, 5))])
+		count = rng.randint(1, 12)
+		expected = [[all_chords.index(chord) for _score, chord in reversed(sorted(zip(row, all_chords))[-count:])] for row in scores.tolist()]
+		assert top_indices(scores, chord_ranks(all_chords), count) == expected
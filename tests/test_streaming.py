@@ -0,0 +1,75 @@
+import contextlib, io, random
+from typing import List
+
+from chord import Chord
+from measure import Measure, Song
+from hmmpredictor import SongStatSet, StreamingHarmonizer, linearly_mixed_hmm_predict
+
+chords = [Chord.parse(s) for s in ['00:maj None 0', '05:maj None 0', '07:maj None 0', '09:min None 0', '02:min None 0', '07:maj min 0', '04:min None 0']]
+
+def random_songs(rng: random.Random, count: int) -> List[Song]:
+	songs = []
+	for i in range(count):
+		measures = []
+		for _ in range(rng.randint(4, 12)):
+			chord = rng.choice(chords)
+			notes = [(rng.choice(chord.render()) % 12 if rng.random() < 0.7 else rng.randrange(12), 1.0) for _ in range(rng.randint(1, 4))]
+			measures.append(Measure(chord, '', 0.0, 0.0, rng.randint(1, 2), notes))
+		songs.append(Song('song{}'.format(i), 'major', measures))
+	return songs
+
+def random_melody(rng: random.Random, length: int) -> List[List[int]]:
+	return [[rng.randrange(12) for _ in range(rng.randint(1, 4))] for _ in range(length)]
+
+def batch_chords(weighted_stat_sets, melody: List[List[int]], jazziness: float) -> List[Chord]:
+	# the predictor is chatty
+	with contextlib.redirect_stdout(io.StringIO()):
+		result = linearly_mixed_hmm_predict(weighted_stat_sets, melody, [None] * len(melody), None, jazziness=jazziness)
+	return [chosen for (_, chosen), _, _ in result]
+
+def streamed(harmonizer: StreamingHarmonizer, melody: List[List[int]]) -> List[Chord]:
+	committed = []
+	for t, notes in enumerate(melody):
+		done, provisional = harmonizer.push(notes)
+		if done is not None:
+			committed.append(done)
+		assert provisional is not None
+	committed.extend(harmonizer.flush())
+	assert [t for t, _ in committed] == list(range(len(melody)))
+	return [chord for _, chord in committed]
+
+def test_long_lag_matches_batch():
+	rng = random.Random(1)
+	for trial in range(20):
+		weighted_stat_sets = [(1.0, SongStatSet.from_songs(random_songs(rng, 15))), (0.5, SongStatSet.from_songs(random_songs(rng, 5)))]
+		melody = random_melody(rng, rng.randint(1, 30))
+		jazziness = rng.choice([0.0, 0.3, -0.2])
+		expected = batch_chords(weighted_stat_sets, melody, jazziness)
+		harmonizer = StreamingHarmonizer(weighted_stat_sets, lag=len(melody), jazziness=jazziness)
+		assert streamed(harmonizer, melody) == expected
+		# and again after flush reset it
+		assert streamed(harmonizer, melody) == expected
+
+def test_long_lag_breaks_ties_like_batch():
+	# two chords that only ever alternate, so neither is likelier than the
+	# other and everything comes down to tie-breaking; pick two that sort in
+	# the opposite order from how a set of them iterates
+	a, b = next((a, b) for a in chords for b in chords if list({a, b}) == [b, a] and a < b)
+	songs = [Song('ab', 'major', [Measure(chord, '', 0.0, 0.0, 1, [(0, 1.0)]) for chord in [a, b, a, b]]), Song('ba', 'major', [Measure(chord, '', 0.0, 0.0, 1, [(0, 1.0)]) for chord in [b, a, b, a]])]
+	weighted_stat_sets = [(1.0, SongStatSet.from_songs(songs))]
+	melody = [[0]] * 8
+	harmonizer = StreamingHarmonizer(weighted_stat_sets, lag=len(melody))
+	assert streamed(harmonizer, melody) == batch_chords(weighted_stat_sets, melody, 0.0)
+
+def test_window_stays_within_lag():
+	rng = random.Random(2)
+	weighted_stat_sets = [(1.0, SongStatSet.from_songs(random_songs(rng, 15)))]
+	for lag in [0, 1, 3]:
+		harmonizer = StreamingHarmonizer(weighted_stat_sets, lag=lag)
+		for t, notes in enumerate(random_melody(rng, 20)):
+			committed, provisional = harmonizer.push(notes)
+			assert len(harmonizer.window_opt) == min(t + 1, lag)
+			if t >= lag:
+				assert committed is not None and committed[0] == t - lag
+			if lag == 0:
+				assert provisional is committed[1]